@@ -0,0 +1,263 @@
+"""Speed and quality benchmark for the ketuvim_nert correction path.
+
+Builds a reproducible corpus from vocabulary.csv with the typo model used for training
+(training/typos.py, fixed seed), runs run_nert_corrector's building blocks under several
+configurations, and writes throughput, latency percentiles, peak RSS and accuracy as JSON.
+
+    python benchmarks/nert_benchmark.py --vocabulary web/models/vocabulary.csv -o results.json
+    python benchmarks/nert_benchmark.py --vocabulary web/models/vocabulary.csv --baseline results.json
+
+Each configuration runs in its own process, so peak RSS and warm caches do not leak between them.
+With --baseline the run exits with status 1 if any configuration got slower or less accurate
+than the tolerances allow.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from difflib import SequenceMatcher
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'web'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'training'))
+
+from lexicon import read_vocabulary
+from typos import simulate_complex_typo
+
+# name -> how the corrector is set up. 'full-beam' is the original whole-text behaviour.
+CONFIGURATIONS = {
+    'full-beam': {'mode': 'full', 'strategy': 'beam'},
+    'spans-beam': {'mode': 'spans', 'strategy': 'beam'},
+    'spans-greedy': {'mode': 'spans', 'strategy': 'greedy'},
+    'spans-adaptive': {'mode': 'spans', 'strategy': 'adaptive'},
+    'spans-adaptive-lexicon': {'mode': 'spans', 'strategy': 'adaptive', 'lexicon': True},
+    'spans-adaptive-lexicon-cache': {'mode': 'spans', 'strategy': 'adaptive', 'lexicon': True, 'cache': True},
+    'spans-constrained': {'mode': 'spans', 'strategy': 'beam', 'constrained': True},
+    'int8-spans-adaptive': {'mode': 'spans', 'strategy': 'adaptive', 'backend': 'int8'},
+}
+DEFAULT_CONFIGURATIONS = ['full-beam', 'spans-beam', 'spans-adaptive', 'spans-adaptive-lexicon-cache', 'int8-spans-adaptive']
+
+
+# --- Corpus ---
+def build_corpus(vocabulary, seed, num_words, num_pages, lines_per_page, page_error_rate):
+    """Returns {'words': [(input, expected)], 'pages': [(input, expected)]}, identical for a given seed."""
+    rng = random.Random(seed)
+    vocabulary = sorted(set(word for word in vocabulary if word.strip()))
+    words = []
+    for _ in range(num_words):
+        word = rng.choice(vocabulary)
+        words.append((simulate_complex_typo(word, rng=rng), word))
+    pages = []
+    for _ in range(num_pages):
+        input_lines, expected_lines = [], []
+        for line_number in range(lines_per_page):
+            clean = rng.sample(vocabulary, min(len(vocabulary), rng.randint(6, 12)))
+            noisy = [simulate_complex_typo(word, error_rate=page_error_rate, rng=rng) or word for word in clean]
+            # Metric book lines carry record numbers and punctuation that must come back unchanged
+            prefix = f"{line_number + 1}. "
+            input_lines.append(prefix + ', '.join(noisy) + '.')
+            expected_lines.append(prefix + ', '.join(clean) + '.')
+        pages.append(('\n'.join(input_lines), '\n'.join(expected_lines)))
+    return {'words': words, 'pages': pages}
+
+
+def word_accuracy(outputs, expected, split_into_spans):
+    """Share of words that match after aligning output and target, so an inserted or dropped
+    word costs one word instead of shifting all later ones; extra output words count as errors."""
+    correct = total = 0
+    for output, target in zip(outputs, expected):
+        output_words = [chunk for is_word, chunk in split_into_spans(output) if is_word]
+        target_words = [chunk for is_word, chunk in split_into_spans(target) if is_word]
+        total += max(len(output_words), len(target_words))
+        matcher = SequenceMatcher(None, output_words, target_words, autojunk=False)
+        correct += sum(block.size for block in matcher.get_matching_blocks())
+    return correct / total if total else 0.0
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# --- Running one configuration (in a child process) ---
+def run_configuration(name, corpus, vocabulary_path, threads):
+    # Only for the correction functions: importing app opens no database and creates no files
+    import app
+    from correction_cache import CorrectionCache
+    from decoding import DecodingPolicy
+    from lexicon import LexiconIndex
+    from constrained_decoding import load_vocabulary_trie
+
+    config = CONFIGURATIONS[name]
+    app.NERT_INTRA_OP_THREADS = threads
+    requested_backend = config.get('backend', 'float32')
+    details = {}
+    start = time.perf_counter()
+    tokenizer, model = app.load_nert_model(app.NERT_MODEL_PATH, backend=requested_backend, details=details)
+    load_seconds = time.perf_counter() - start
+    if not (tokenizer and model):
+        return {'configuration': name, 'error': 'model failed to load'}
+    # The int8 backend falls back to float32 when it disagrees too often; report what actually ran
+    backend = details['backend']
+    if backend != requested_backend:
+        print(f"WARNING: {name} asked for the {requested_backend} backend but ran on {backend}.", file=sys.stderr)
+
+    policy = DecodingPolicy.from_options({'strategy': config['strategy']}, default=app.NERT_DECODING_POLICY)
+    lexicon = LexiconIndex(read_vocabulary(vocabulary_path)) if config.get('lexicon') else None
+    trie = None
+    cache_dir = tempfile.mkdtemp(prefix='nert_benchmark_')
+    if config.get('constrained'):
+        trie = load_vocabulary_trie(os.path.join(cache_dir, 'trie.pkl'), vocabulary_path, tokenizer, app.NERT_MODEL_PATH)
+    cache = None
+    if config.get('cache'):
+        cache = CorrectionCache(os.path.join(cache_dir, 'cache.db'), app.NERT_MODEL_PATH)
+
+    def correct(text):
+        if config['mode'] == 'full':
+            return app.correct_full_text(text, tokenizer, model, policy=policy)
+        return app.correct_text_by_spans(text, tokenizer, model, cache=cache, lexicon=lexicon, trie=trie, policy=policy)
+
+    results = []
+    for kind, pairs in corpus.items():
+        if not pairs:
+            continue
+        latencies, outputs = [], []
+        started = time.perf_counter()
+        for source, _ in pairs:
+            item_start = time.perf_counter()
+            outputs.append(correct(source))
+            latencies.append(time.perf_counter() - item_start)
+        elapsed = time.perf_counter() - started
+        expected = [target for _, target in pairs]
+        words = sum(len([c for w, c in app.split_into_spans(target) if w]) for target in expected)
+        results.append({
+            'configuration': name,
+            'kind': kind,
+            'items': len(pairs),
+            'words': words,
+            'seconds': elapsed,
+            'items_per_second': len(pairs) / elapsed if elapsed else None,
+            'words_per_second': words / elapsed if elapsed else None,
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p95_ms': percentile(latencies, 95) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000,
+            'accuracy': word_accuracy(outputs, expected, app.split_into_spans),
+            'input_accuracy': word_accuracy([source for source, _ in pairs], expected, app.split_into_spans),
+            'exact_match': sum(1 for o, t in zip(outputs, expected) if o == t) / len(pairs),
+        })
+    for result in results:
+        result['backend'] = backend
+        result['requested_backend'] = requested_backend
+        result['model_load_seconds'] = load_seconds
+        result['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+# --- Comparison with a previous run ---
+def find_regressions(results, baseline, max_slowdown, max_accuracy_drop):
+    previous = {(r['configuration'], r['kind']): r for r in baseline.get('results', []) if 'kind' in r}
+    regressions = []
+    for result in results:
+        old = previous.get((result.get('configuration'), result.get('kind')))
+        if not old:
+            continue
+        if old.get('words_per_second') and result.get('words_per_second') is not None:
+            slowdown = 1 - result['words_per_second'] / old['words_per_second']
+            if slowdown > max_slowdown:
+                regressions.append(f"{result['configuration']}/{result['kind']}: throughput down {slowdown:.1%}")
+        drop = old['accuracy'] - result['accuracy']
+        if drop > max_accuracy_drop:
+            regressions.append(f"{result['configuration']}/{result['kind']}: accuracy down {drop:.2%}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ketuvim_nert correction path.")
+    parser.add_argument('--vocabulary', default=os.path.join(REPO_DIR, 'web', 'models', 'vocabulary.csv'))
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--words', type=int, default=500, help="number of single-word inputs")
+    parser.add_argument('--pages', type=int, default=10, help="number of full-page inputs")
+    parser.add_argument('--lines-per-page', type=int, default=25)
+    parser.add_argument('--page-error-rate', type=float, default=0.3)
+    parser.add_argument('--configurations', nargs='+', default=DEFAULT_CONFIGURATIONS,
+                        choices=sorted(CONFIGURATIONS))
+    parser.add_argument('--threads', type=int, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument('-o', '--output', help="write results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--max-slowdown', type=float, default=0.10)
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.005)
+    args = parser.parse_args()
+
+    vocabulary = read_vocabulary(args.vocabulary)
+    corpus = build_corpus(vocabulary, args.seed, args.words, args.pages, args.lines_per_page, args.page_error_rate)
+    print(f"Corpus: {len(corpus['words'])} words, {len(corpus['pages'])} pages (seed {args.seed}).", file=sys.stderr)
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name in args.configurations:
+        print(f"Running {name}...", file=sys.stderr)
+        with context.Pool(1) as pool:
+            outcome = pool.apply(run_configuration, (name, corpus, args.vocabulary, args.threads))
+        outcome = outcome if isinstance(outcome, list) else [outcome]
+        if outcome and 'backend' in outcome[0]:
+            print(f"{name} ran on the {outcome[0]['backend']} backend.", file=sys.stderr)
+        results.extend(outcome)
+
+    report = {
+        'meta': {
+            'seed': args.seed,
+            'words': args.words,
+            'pages': args.pages,
+            'lines_per_page': args.lines_per_page,
+            'page_error_rate': args.page_error_rate,
+            'vocabulary': os.path.abspath(args.vocabulary),
+            'threads': args.threads,
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['regressions'] = find_regressions(results, json.load(f), args.max_slowdown, args.max_accuracy_drop)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    for regression in report.get('regressions', []):
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    sys.exit(1 if report.get('regressions') else 0)
+
+
+if __name__ == '__main__':
+    main()
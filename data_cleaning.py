@@ -1,51 +1,228 @@
+import argparse
 import cv2
 import os
 import numpy as np
 import hashlib
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+# Failures are recorded in the manifest but tried again on every run, e.g. once a codec is installed
+RETRY_STATUSES = ('unreadable', 'write_failed')
+# Every decoded image is remembered, kept or not: a copy of a low quality scan is a duplicate too
+INDEXED_STATUSES = ('saved', 'low_quality')
 
 def compute_hash(image):
-    success, encoded_image = cv2.imencode('.png', image)
-    if not success:
-        return None
-    return hashlib.md5(encoded_image.tobytes()).hexdigest()
+    # Hash the decoded pixels, not the file: the same scan saved again with other metadata
+    # or in another lossless format is still a duplicate
+    digest = hashlib.blake2b(str(image.shape).encode('ascii'), digest_size=16)
+    digest.update(np.ascontiguousarray(image).tobytes())
+    return digest.hexdigest()
+
+def compute_dhash(gray, hash_size=8):
+    """64-bit difference hash: survives re-scans, re-compression and small brightness changes."""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
 
 def is_low_quality(image, threshold=10):
     return np.var(image) < threshold
 
-raw_folder = 'data/raw'
-cleaned_folder = 'data/cleaned'
-os.makedirs(cleaned_folder, exist_ok=True)
-
-image_hashes = set()
-
-# Traverse raw_folder recursively
-for root, dirs, files in os.walk(raw_folder):
-    for filename in files:
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff')):
-            file_path = os.path.join(root, filename)
-            img = cv2.imread(file_path)
-            if img is None:
-                print(f"Skipping unreadable image: {filename}")
-                continue
-
-            img_hash = compute_hash(img)
-            if img_hash is None:
-                print(f"Error computing hash for {filename}, skipping.")
-                continue
-            if img_hash in image_hashes:
-                print(f"Duplicate found, skipping {filename}")
-                continue
-            image_hashes.add(img_hash)
-
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            if is_low_quality(gray):
-                print(f"Low quality image detected, skipping: {filename}")
-                continue
-
-            # Save the cleaned image with the same relative path structure
-            relative_path = os.path.relpath(root, raw_folder)
-            save_dir = os.path.join(cleaned_folder, relative_path)
-            os.makedirs(save_dir, exist_ok=True)
-            cleaned_path = os.path.join(save_dir, filename)
-            cv2.imwrite(cleaned_path, gray)
-            print(f"Saved cleaned image: {cleaned_path}")
+class NearDuplicateIndex:
+    """Finds perceptual hashes within max_distance bits of each other.
+
+    The 64-bit hash is split into 8 bands of 8 bits. Two hashes that differ in at most 7 bits
+    share at least one band exactly, so only images sharing a band are compared.
+    """
+
+    def __init__(self, max_distance=6, bands=8):
+        if max_distance >= bands:
+            raise ValueError("max_distance must be smaller than the number of bands")
+        self.max_distance = max_distance
+        self.bands = bands
+        self.band_bits = 64 // bands
+        self.tables = [{} for _ in range(bands)]
+
+    def _band_keys(self, phash):
+        mask = (1 << self.band_bits) - 1
+        return [(phash >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def find(self, phash):
+        """Returns (name, distance) of the closest indexed image, or None."""
+        best = None
+        seen = set()
+        for table, key in zip(self.tables, self._band_keys(phash)):
+            for other_hash, name in table.get(key, ()):
+                if other_hash in seen:
+                    continue
+                seen.add(other_hash)
+                distance = bin(phash ^ other_hash).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (name, distance)
+        return best
+
+    def add(self, phash, name):
+        for table, key in zip(self.tables, self._band_keys(phash)):
+            table.setdefault(key, []).append((phash, name))
+
+# --- Manifest ---
+# One row per raw file, written as soon as the file is done: a rerun skips files whose
+# size and modification time are unchanged (unless they failed), and an interrupted run
+# picks up where it stopped.
+# Version 2: content_hash is a hash of the decoded pixels (version 1 hashed the file bytes).
+MANIFEST_VERSION = 2
+
+def open_manifest(path):
+    manifest = sqlite3.connect(path)
+    manifest.execute('PRAGMA journal_mode=WAL')
+    version = manifest.execute('PRAGMA user_version').fetchone()[0]
+    if version < MANIFEST_VERSION:
+        # Hashes of another kind cannot be compared with new ones; every file is processed again
+        manifest.execute('DROP TABLE IF EXISTS files')
+        manifest.execute(f'PRAGMA user_version = {MANIFEST_VERSION}')
+    manifest.execute('''CREATE TABLE IF NOT EXISTS files (
+        relative_path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        content_hash TEXT,
+        phash TEXT,
+        status TEXT NOT NULL,
+        duplicate_of TEXT,
+        cleaned_path TEXT,
+        processed_at REAL NOT NULL
+    )''')
+    manifest.commit()
+    return manifest
+
+def record(manifest, relative_path, stat, result, status, duplicate_of=None, cleaned_path=None):
+    phash = result.get('phash')
+    manifest.execute(
+        'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (relative_path, stat[0], stat[1], result.get('content_hash'),
+         None if phash is None else format(phash, '016x'), status, duplicate_of, cleaned_path, time.time())
+    )
+
+# --- Worker ---
+def clean_image(task):
+    """Runs in a worker process: decode, hash, perceptual hash, quality check, save grayscale."""
+    file_path, relative_path, cleaned_path = task
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        return {'relative_path': relative_path, 'status': 'unreadable', 'error': str(e)}
+    result = {'relative_path': relative_path}
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        result['status'] = 'unreadable'
+        return result
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Hashed before the quality check, so copies of a rejected scan are still found as duplicates
+    result['content_hash'] = compute_hash(image)
+    result['phash'] = compute_dhash(gray)
+    if is_low_quality(gray):
+        result['status'] = 'low_quality'
+        return result
+    os.makedirs(os.path.dirname(cleaned_path), exist_ok=True)
+    if not cv2.imwrite(cleaned_path, gray):
+        result['status'] = 'write_failed'
+        return result
+    result['status'] = 'saved'
+    result['cleaned_path'] = cleaned_path
+    return result
+
+def find_images(raw_folder):
+    for root, dirs, files in os.walk(raw_folder):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, filename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate and clean raw register scans.")
+    parser.add_argument('--raw', default='data/raw')
+    parser.add_argument('--cleaned', default='data/cleaned')
+    parser.add_argument('--manifest', default='data/cleaning_manifest.db')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--near-duplicate-distance', type=int, default=6,
+                        help="max differing bits of the 64-bit perceptual hash (0 disables near-duplicate checks)")
+    args = parser.parse_args()
+
+    raw_folder = args.raw
+    cleaned_folder = args.cleaned
+    os.makedirs(cleaned_folder, exist_ok=True)
+    os.makedirs(os.path.dirname(args.manifest) or '.', exist_ok=True)
+    manifest = open_manifest(args.manifest)
+
+    # Files unchanged since the last run keep their result and seed the duplicate indexes
+    known = {row[0]: row[1:] for row in manifest.execute(
+        'SELECT relative_path, size, mtime_ns, content_hash, phash, status FROM files')}
+    image_hashes = {}
+    near_duplicates = NearDuplicateIndex(args.near_duplicate_distance) if args.near_duplicate_distance else None
+    tasks = []
+    stats = {}
+    skipped = 0
+    for file_path in find_images(raw_folder):
+        relative_path = os.path.relpath(file_path, raw_folder)
+        stat = os.stat(file_path)
+        previous = known.get(relative_path)
+        if (previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns
+                and previous[4] not in RETRY_STATUSES):
+            skipped += 1
+            if previous[4] in INDEXED_STATUSES:
+                image_hashes[previous[2]] = relative_path
+                if near_duplicates and previous[3]:
+                    near_duplicates.add(int(previous[3], 16), relative_path)
+            continue
+        cleaned_path = os.path.join(cleaned_folder, relative_path)
+        tasks.append(((file_path, relative_path, cleaned_path), (stat.st_size, stat.st_mtime_ns)))
+    print(f"{len(tasks)} new or changed images to process, {skipped} unchanged since the last run.")
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # map() keeps walk order, so the first copy of a duplicate is always the one kept
+        results = pool.map(clean_image, [task for task, _ in tasks], chunksize=8)
+        for (task, stat), result in zip(tasks, results):
+            relative_path = task[1]
+            status = result['status']
+            duplicate_of = None
+            if status in ('saved', 'low_quality'):
+                if result['content_hash'] in image_hashes:
+                    status, duplicate_of = 'duplicate', image_hashes[result['content_hash']]
+                elif near_duplicates:
+                    match = near_duplicates.find(result['phash'])
+                    if match:
+                        status, duplicate_of = 'near_duplicate', match[0]
+            if status in ('duplicate', 'near_duplicate') and result.get('cleaned_path'):
+                os.remove(result['cleaned_path'])
+            if status in INDEXED_STATUSES:
+                image_hashes[result['content_hash']] = relative_path
+                if near_duplicates:
+                    near_duplicates.add(result['phash'], relative_path)
+
+            if status == 'saved':
+                print(f"Saved cleaned image: {result['cleaned_path']}")
+            elif status == 'duplicate':
+                print(f"Duplicate found, skipping {relative_path} (same file as {duplicate_of})")
+            elif status == 'near_duplicate':
+                print(f"Near-duplicate found, skipping {relative_path} (re-scan of {duplicate_of})")
+            elif status == 'low_quality':
+                print(f"Low quality image detected, skipping: {relative_path}")
+            elif status == 'write_failed':
+                print(f"ERROR writing cleaned image for {relative_path}")
+            else:
+                print(f"Skipping unreadable image: {relative_path}")
+            record(manifest, relative_path, stat, result, status, duplicate_of,
+                   result.get('cleaned_path') if status == 'saved' else None)
+            manifest.commit()
+            stats[status] = stats.get(status, 0) + 1
+
+    elapsed = time.perf_counter() - started
+    manifest.close()
+    summary = ', '.join(f"{count} {status}" for status, count in sorted(stats.items())) or "nothing to do"
+    rate = len(tasks) / elapsed if elapsed and tasks else 0
+    print(f"Done in {elapsed:.1f}s ({rate:.1f} images/s): {summary}.")
+
+if __name__ == '__main__':
+    main()
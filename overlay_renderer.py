@@ -0,0 +1,167 @@
+"""Draws kraken segmentation overlays (boundary polygons and baselines) as a tiled preview pyramid.
+
+Level 0 is the full-resolution page and every further level halves it, down to the level that
+fits in a single tile. Tiles are written as <out_dir>/<level>/<col>_<row>.png next to a
+pyramid.json that describes the pyramid, and the web app serves them under /overlays/.
+Each tile is drawn on its own crop of the page. No full-size overlay is ever created, and
+lines keep the same on-screen thickness at every zoom level.
+"""
+import json
+import math
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+TILE_SIZE = 256
+MANIFEST_NAME = 'pyramid.json'
+BOUNDARY_COLOR = (0, 255, 0)  # BGR
+BASELINE_COLOR = (0, 0, 255)
+LINE_THICKNESS = 2
+SHIFT = 4  # fractional bits of the fixed-point coordinates passed to cv2.polylines
+
+
+class Shapes:
+    """All polylines of one kind, as one array of points so scaling is a single numpy operation."""
+
+    def __init__(self, polylines, closed):
+        self.closed = closed
+        self.count = len(polylines)
+        if polylines:
+            self.points = np.concatenate(polylines).astype(np.float64)
+            self.ends = np.cumsum([len(p) for p in polylines])
+            self.starts = self.ends - np.array([len(p) for p in polylines])
+            self.mins = np.array([p.min(axis=0) for p in polylines])
+            self.maxs = np.array([p.max(axis=0) for p in polylines])
+        else:
+            self.points = np.zeros((0, 2))
+            self.ends = self.starts = np.zeros(0, dtype=np.int64)
+            self.mins = self.maxs = np.zeros((0, 2))
+
+    def at_scale(self, scale):
+        """Fixed-point int32 points for a level scaled by (scale_x, scale_y)."""
+        return np.round(self.points * scale * (1 << SHIFT)).astype(np.int32)
+
+    def in_region(self, low, high):
+        """Indices of the shapes whose bounding box overlaps [low, high] (page coordinates)."""
+        if not self.count:
+            return []
+        overlaps = np.all((self.maxs >= low) & (self.mins <= high), axis=1)
+        return np.flatnonzero(overlaps)
+
+
+def line_geometry(lines):
+    """Boundary polygons and baselines of kraken's "lines"; a bbox-only line becomes its rectangle."""
+    boundaries, baselines = [], []
+    for line in lines:
+        try:
+            boundary = line.get('boundary')
+            baseline = line.get('baseline')
+            bbox = line.get('bbox')
+            if boundary and len(boundary) >= 3:
+                boundaries.append(np.asarray(boundary, dtype=np.float64).reshape(-1, 2))
+            elif bbox and len(bbox) == 4:
+                x, y, w, h = map(float, bbox)
+                boundaries.append(np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]]))
+            if baseline and len(baseline) >= 2:
+                baselines.append(np.asarray(baseline, dtype=np.float64).reshape(-1, 2))
+            if not (boundary or baseline or bbox):
+                print("Skipping a line segment without geometry:", line)
+        except (TypeError, ValueError):
+            print("Skipping a line segment with invalid geometry:", line)
+    return Shapes(boundaries, closed=True), Shapes(baselines, closed=False)
+
+
+def draw_shapes(canvas, shapes, points, selected, offset, color, thickness):
+    if len(selected) == 0:
+        return
+    offset = np.round(np.asarray(offset) * (1 << SHIFT)).astype(np.int32)
+    polylines = [points[shapes.starts[i]:shapes.ends[i]] - offset for i in selected]
+    # One call per tile and kind: the loop over polylines runs inside OpenCV
+    cv2.polylines(canvas, polylines, shapes.closed, color, thickness, cv2.LINE_AA, SHIFT)
+
+
+def to_bgr(image):
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
+
+
+def render_full(image, lines, thickness=LINE_THICKNESS):
+    """A single full-resolution overlay, for callers that still want one file."""
+    boundaries, baselines = line_geometry(lines)
+    canvas = to_bgr(image)
+    scale = np.array([1.0, 1.0])
+    draw_shapes(canvas, boundaries, boundaries.at_scale(scale), range(boundaries.count), (0, 0), BOUNDARY_COLOR, thickness)
+    draw_shapes(canvas, baselines, baselines.at_scale(scale), range(baselines.count), (0, 0), BASELINE_COLOR, thickness)
+    return canvas
+
+
+def level_count(width, height, tile_size):
+    return max(1, math.ceil(math.log2(max(width, height) / tile_size)) + 1) if max(width, height) > tile_size else 1
+
+
+def render_pyramid(image, lines, out_dir, tile_size=TILE_SIZE, thickness=LINE_THICKNESS, tile_format='png', workers=4):
+    """Writes the overlay pyramid of a page (grayscale or BGR array) to out_dir; returns its manifest.
+
+    The pyramid is built in a sibling directory and swapped in at the end, so a reader never
+    sees a half-written one.
+    """
+    height, width = image.shape[:2]
+    boundaries, baselines = line_geometry(lines)
+    levels = level_count(width, height, tile_size)
+    staging = out_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+
+    def write_tile(path, tile):
+        if not cv2.imwrite(path, tile):
+            raise OSError(f"Could not write tile {path}")
+
+    level_image = image
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        writes = deque()
+        for level in range(levels):
+            if level:
+                # Each level is downsampled from the previous one, never from the full page
+                level_height, level_width = level_image.shape[:2]
+                level_image = cv2.resize(level_image, ((level_width + 1) // 2, (level_height + 1) // 2),
+                                         interpolation=cv2.INTER_AREA)
+            level_height, level_width = level_image.shape[:2]
+            scale = np.array([level_width / width, level_height / height])
+            boundary_points = boundaries.at_scale(scale)
+            baseline_points = baselines.at_scale(scale)
+            level_dir = os.path.join(staging, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            margin = thickness / scale
+            for row, y0 in enumerate(range(0, level_height, tile_size)):
+                for col, x0 in enumerate(range(0, level_width, tile_size)):
+                    tile = to_bgr(level_image[y0:y0 + tile_size, x0:x0 + tile_size])
+                    low = np.array([x0, y0]) / scale - margin
+                    high = np.array([x0 + tile.shape[1], y0 + tile.shape[0]]) / scale + margin
+                    draw_shapes(tile, boundaries, boundary_points, boundaries.in_region(low, high),
+                                (x0, y0), BOUNDARY_COLOR, thickness)
+                    draw_shapes(tile, baselines, baseline_points, baselines.in_region(low, high),
+                                (x0, y0), BASELINE_COLOR, thickness)
+                    # PNG/JPEG encoding releases the GIL, so tiles are written in parallel
+                    path = os.path.join(level_dir, f"{col}_{row}.{tile_format}")
+                    writes.append(pool.submit(write_tile, path, tile))
+                    # Bounded: only a few drawn tiles wait for the encoder at any time
+                    if len(writes) > workers * 4:
+                        writes.popleft().result()
+        for write in writes:
+            write.result()
+
+    manifest = {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'levels': levels,
+        'format': tile_format,
+        'lines': max(boundaries.count, baselines.count),
+    }
+    with open(os.path.join(staging, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(staging, out_dir)
+    return manifest
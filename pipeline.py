@@ -0,0 +1,355 @@
+"""Page images in, corrected transcriptions out: binarize -> segment -> recognize -> correct -> store.
+
+Each stage runs in its own thread(s) and hands pages to the next one through a bounded
+queue. All stages work at the same time, and a slow stage holds the earlier ones back
+instead of letting pages pile up in memory. Results are written to the web app's
+transcriptions table (and the page images to its upload store), so they show up in
+/history and can be reviewed on the edit page.
+
+    python pipeline.py scans/volume_12 --recognizer ketuvim_recognizer.mlmodel
+
+As a library:
+
+    pipeline = Pipeline('ketuvim_recognizer.mlmodel')
+    for result in pipeline.run(collect_inputs(['scans/volume_12'])):
+        print(result['image_name'], result['status'])
+    print(pipeline.stats())
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from segmentation import KrakenAPI, collect_inputs
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_DIR, 'web'))
+
+STOP = object()
+
+
+class Stage:
+    """One step of the pipeline, run by `workers` threads between two bounded queues.
+
+    work(pages) processes a batch of up to batch_size pages in place; it may mark single
+    pages as failed with page['error']. Pages that already failed pass through untouched.
+    """
+
+    def __init__(self, name, work, workers=1, batch_size=1):
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.batch_size = batch_size
+        self.inbox = None
+        self.outbox = None
+        self.lock = threading.Lock()
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.input_wait_seconds = 0.0
+        self.output_wait_seconds = 0.0
+        self.puts = 0
+        self.blocked_puts = 0
+        self.max_queue_depth = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.running = self.workers
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"pipeline-{self.name}-{i}", daemon=True).start()
+
+    def _take(self):
+        """Up to batch_size pages, waiting only for the first; stop is True once the input has ended."""
+        start = time.perf_counter()
+        item = self.inbox.get()
+        waited = time.perf_counter() - start
+        pages, stop = [], False
+        while True:
+            if item is STOP:
+                self.inbox.put(STOP)  # for the other workers of this stage
+                stop = True
+                break
+            pages.append(item)
+            if len(pages) >= self.batch_size:
+                break
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.input_wait_seconds += waited
+        return pages, stop
+
+    def _put(self, page):
+        # A put that has to wait means the next stage is the slower one: backpressure
+        blocked = self.outbox.full()
+        start = time.perf_counter()
+        self.outbox.put(page)
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.puts += 1
+            self.blocked_puts += blocked
+            self.output_wait_seconds += waited
+            self.max_queue_depth = max(self.max_queue_depth, self.outbox.qsize())
+
+    def _run(self):
+        while True:
+            pages, stop = self._take()
+            pending = [page for page in pages if not page.get('error')]
+            if pending:
+                start = time.perf_counter()
+                try:
+                    self.work(pending)
+                except Exception as e:
+                    for page in pending:
+                        page['error'] = f"{type(e).__name__}: {e}"
+                elapsed = time.perf_counter() - start
+                for page in pending:
+                    page['timings'][self.name] = elapsed / len(pending)
+                    if page.get('error') and not page.get('failed_stage'):
+                        page['failed_stage'] = self.name
+                with self.lock:
+                    self.busy_seconds += elapsed
+                    self.failed += sum(1 for page in pending if page.get('error'))
+                    self.processed += sum(1 for page in pending if not page.get('error'))
+            for page in pages:
+                self._put(page)
+            if stop:
+                break
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last:
+            self.finished = time.perf_counter()
+            self.outbox.put(STOP)
+
+    def stats(self):
+        wall = ((self.finished or time.perf_counter()) - self.started) if self.started else 0.0
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'batch_size': self.batch_size,
+                'processed': self.processed,
+                'failed': self.failed,
+                'busy_seconds': round(self.busy_seconds, 3),
+                # Share of the stage's worker time spent working; the bottleneck is close to 1
+                'utilization': round(self.busy_seconds / (wall * self.workers), 3) if wall else None,
+                'pages_per_minute': round(self.processed / wall * 60, 2) if wall else None,
+                # What the stage could do if it never waited for input or for the next stage
+                'capacity_pages_per_minute': round(self.processed / self.busy_seconds * 60 * self.workers, 2)
+                                             if self.busy_seconds else None,
+                'input_wait_seconds': round(self.input_wait_seconds, 3),
+                'output_wait_seconds': round(self.output_wait_seconds, 3),
+                'blocked_puts': self.blocked_puts,
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+
+class Pipeline:
+    """Loads the kraken segmenter, the recognizer and ketuvim_nert once, then streams pages through them."""
+
+    def __init__(self, recognizer_path, segmenter='baseline', segmentation_model=None, database=None, correct=True,
+                 save=True, store_images=True, queue_size=4, binarize_workers=2, segment_workers=1,
+                 recognize_workers=1, correct_batch_size=8, decoding=None):
+        from kraken.lib import models
+        import app as ketuvim_app
+        from storage import connect, migrate
+        from decoding import DecodingPolicy
+
+        self.app = ketuvim_app
+        self.segmenter = segmenter
+        self.kraken = KrakenAPI(segmenter, segmentation_model)
+        print(f"Loading recognizer from {recognizer_path}...")
+        self.recognizer = models.load_any(recognizer_path)
+        self.bundle = None
+        if correct:
+            self.bundle = ketuvim_app.load_nert_bundle({})
+            if not self.bundle:
+                raise RuntimeError("NERT model could not be loaded.")
+        self.policy = DecodingPolicy.from_options(decoding, default=ketuvim_app.NERT_DECODING_POLICY)
+        self.save = save
+        self.store_images = store_images
+        self.db = None
+        if save:
+            self.db = connect(database or ketuvim_app.DATABASE)
+            migrate(self.db)
+        self.queue_size = queue_size
+        self.stages = [
+            Stage('binarize', self.binarize, workers=binarize_workers),
+            Stage('segment', self.segment, workers=segment_workers),
+            Stage('recognize', self.recognize, workers=recognize_workers),
+            # Corrections of several pages go through the model together
+            Stage('correct', self.correct, batch_size=correct_batch_size),
+            # One writer: a single connection, one transaction per batch
+            Stage('store', self.store, batch_size=correct_batch_size),
+        ]
+        self.started = None
+        self.finished = None
+        self.pages = 0
+
+    # --- Stages ---
+    def binarize(self, pages):
+        from PIL import Image
+        for page in pages:
+            with Image.open(page['path']) as image:
+                original = image.copy()
+            page['binarized'] = self.kraken.binarize(original)
+            # Baseline models recognize from the original page, legacy box models from the binarized one
+            page['image'] = original if self.segmenter == 'baseline' else None
+
+    def segment(self, pages):
+        for page in pages:
+            page['segmentation'] = self.kraken.segment(page['binarized'])
+
+    def recognize(self, pages):
+        from kraken import rpred
+        for page in pages:
+            source = page['image'] if page['image'] is not None else page['binarized']
+            records = rpred.rpred(self.recognizer, source, page['segmentation'])
+            page['input_text'] = '\n'.join(record.prediction for record in records)
+            # Only text from here on: let the images go
+            page['image'] = page['binarized'] = page['segmentation'] = None
+
+    def correct(self, pages):
+        texts = [page['input_text'] for page in pages]
+        if self.bundle:
+            corrected = self.app.run_nert_corrector_batch(texts, self.bundle['tokenizer'], self.bundle['model'],
+                                                          lexicon=self.bundle['lexicon'],
+                                                          vocabulary_trie=self.bundle['trie'], policy=self.policy)
+        else:
+            corrected = texts
+        for page, corrected_text in zip(pages, corrected):
+            page['corrected_text'] = corrected_text
+
+    def store(self, pages):
+        if not self.save:
+            return
+        rows = []
+        for page in pages:
+            if self.store_images:
+                with open(page['path'], 'rb') as f:
+                    page['image_name'], _ = self.app.upload_store.save(f, page['image_name'], self.db)
+            rows.append((page['image_name'], page['input_text'], page['corrected_text']))
+        self.app.write_transcriptions(self.db, rows)
+
+    # --- Running ---
+    def run(self, images):
+        """Streams the images through the pipeline, yielding one result per page as it completes."""
+        from werkzeug.utils import secure_filename
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        for stage, inbox, outbox in zip(self.stages, queues, queues[1:]):
+            stage.inbox, stage.outbox = inbox, outbox
+            stage.start()
+
+        def feed():
+            for path in images:
+                page = {'path': path, 'image_name': secure_filename(os.path.basename(path)), 'timings': {},
+                        'started': time.perf_counter()}
+                if not os.path.isfile(path):
+                    page['error'], page['failed_stage'] = "input image does not exist", 'input'
+                queues[0].put(page)
+            queues[0].put(STOP)
+
+        self.started = time.perf_counter()
+        threading.Thread(target=feed, name="pipeline-feed", daemon=True).start()
+        while True:
+            page = queues[-1].get()
+            if page is STOP:
+                break
+            self.pages += 1
+            result = {
+                'image': page['path'],
+                'image_name': page['image_name'],
+                'status': 'failed' if page.get('error') else 'done',
+                'seconds': round(time.perf_counter() - page['started'], 3),
+                'stage_seconds': {name: round(seconds, 3) for name, seconds in page['timings'].items()},
+            }
+            if page.get('error'):
+                result['error'] = page['error']
+                result['failed_stage'] = page.get('failed_stage')
+            else:
+                result['corrected_text'] = page['corrected_text']
+            yield result
+        self.finished = time.perf_counter()
+
+    def stats(self):
+        wall = ((self.finished or time.perf_counter()) - self.started) if self.started else 0.0
+        return {
+            'pages': self.pages,
+            'seconds': round(wall, 3),
+            'pages_per_minute': round(self.pages / wall * 60, 2) if wall else None,
+            'queue_size': self.queue_size,
+            'stages': {stage.name: stage.stats() for stage in self.stages},
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+def print_stats(stats):
+    print(f"{stats['pages']} pages in {stats['seconds']:.1f}s ({stats['pages_per_minute'] or 0:.1f} pages/min)")
+    print(f"{'stage':<10} {'pages/min':>10} {'capacity':>10} {'util':>6} {'in-wait s':>10} {'out-wait s':>11} "
+          f"{'blocked':>8} {'max q':>6}")
+    for name, stage in stats['stages'].items():
+        print(f"{name:<10} {stage['pages_per_minute'] or 0:>10.1f} {stage['capacity_pages_per_minute'] or 0:>10.1f} "
+              f"{stage['utilization'] or 0:>6.2f} {stage['input_wait_seconds']:>10.1f} "
+              f"{stage['output_wait_seconds']:>11.1f} {stage['blocked_puts']:>8} {stage['max_queue_depth']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe register pages end to end and store the results.")
+    parser.add_argument('inputs', nargs='*', help="images and/or directories of images")
+    parser.add_argument('--file-list', help="text file with one image path per line")
+    parser.add_argument('--recognizer', required=True, help="ketuvim_recognizer model file")
+    parser.add_argument('--segmenter', choices=['baseline', 'boxes'], default='baseline',
+                        help="kraken's baseline segmenter (default), or the legacy bounding boxes")
+    parser.add_argument('--segmentation-model', help="baseline segmentation model, e.g. ketuvim_segmenter")
+    parser.add_argument('--database', help="transcriptions database (default: the web app's ketuvim.db)")
+    parser.add_argument('--no-correct', action='store_true', help="store the recognized text without NERT correction")
+    parser.add_argument('--dry-run', action='store_true', help="do not write to the database")
+    parser.add_argument('--queue-size', type=int, default=4, help="pages waiting between two stages at most")
+    parser.add_argument('--binarize-workers', type=int, default=2)
+    parser.add_argument('--segment-workers', type=int, default=1)
+    parser.add_argument('--recognize-workers', type=int, default=1)
+    parser.add_argument('--correct-batch-size', type=int, default=8)
+    parser.add_argument('--decoding-strategy', choices=['greedy', 'beam', 'adaptive'])
+    parser.add_argument('--stats', help="write per-page results and stage statistics as JSON here")
+    args = parser.parse_args()
+    if not args.inputs and not args.file_list:
+        parser.error("give at least one image, directory or --file-list")
+
+    pipeline = Pipeline(args.recognizer, segmenter=args.segmenter, segmentation_model=args.segmentation_model,
+                        database=args.database, correct=not args.no_correct, save=not args.dry_run,
+                        queue_size=args.queue_size, binarize_workers=args.binarize_workers,
+                        segment_workers=args.segment_workers, recognize_workers=args.recognize_workers,
+                        correct_batch_size=args.correct_batch_size,
+                        decoding={'strategy': args.decoding_strategy} if args.decoding_strategy else None)
+    results = []
+    try:
+        for count, result in enumerate(pipeline.run(collect_inputs(args.inputs, args.file_list)), 1):
+            results.append(result)
+            if result['status'] == 'done':
+                print(f"[{count}] {result['image_name']}: done in {result['seconds']:.1f}s")
+            else:
+                print(f"[{count}] {result['image_name']}: FAILED in {result['failed_stage']}: {result['error']}")
+    finally:
+        pipeline.close()
+
+    stats = pipeline.stats()
+    print_stats(stats)
+    if args.stats:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump({'stats': stats, 'results': results}, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if any(result['status'] == 'failed' for result in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,78 +1,245 @@
+import argparse
+import dataclasses
 import subprocess
 import sys
 import os
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import cv2
+import numpy as np
+
+from overlay_renderer import MANIFEST_NAME, render_full, render_pyramid
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+REPORT_NAME = 'segmentation_report.json'
+
+class SegmentationError(Exception):
+    pass
 
 def run_command(command):
     print("Running command:", " ".join(command))
     result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     if result.returncode != 0:
-        print("Command failed with error:")
-        print(result.stderr)
-        sys.exit(result.returncode)
+        raise SegmentationError(f"{command[0]} exited with status {result.returncode}: {result.stderr.strip()}")
     return result.stdout
 
-def main(input_image_path):
-    # Ensure the input image exists
-    if not os.path.exists(input_image_path):
-        print("Input image does not exist:", input_image_path)
-        sys.exit(1)
-
+def output_paths(input_image_path, output_dir, tiles_dir=None, full_overlay=False):
     # Prepare output filenames based on the input image's basename
     base_name = os.path.splitext(os.path.basename(input_image_path))[0]
-    # You can adjust the output directory as needed
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
+    # With tiles_dir (e.g. web/overlays) the pyramid lands where the web app serves it from
+    pyramid_dir = os.path.join(tiles_dir, base_name) if tiles_dir else os.path.join(output_dir, f"{base_name}_overlay")
+    paths = {
+        'binarized': os.path.join(output_dir, f"{base_name}_binarized.png"),
+        'segmentation': os.path.join(output_dir, f"{base_name}_segmentation.json"),
+        'pyramid': os.path.join(pyramid_dir, MANIFEST_NAME),
+    }
+    if full_overlay:
+        paths['overlay'] = os.path.join(output_dir, f"{base_name}_overlay.png")
+    return paths
+
+def is_up_to_date(input_image_path, paths):
+    """True if every output exists and is newer than the input image."""
+    source_mtime = os.path.getmtime(input_image_path)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= source_mtime for path in paths.values())
+
+# --- Kraken Engines ---
+# 'api' loads kraken (and the baseline model) once per worker process and keeps the
+# binarized page in memory; 'cli' runs the kraken command per step like a single run does.
+class KrakenAPI:
+    def __init__(self, segmenter, model_path=None):
+        from kraken import binarization
+        self.binarization = binarization
+        self.segmenter = segmenter
+        if segmenter == 'baseline':
+            from importlib import resources
+            from kraken import blla
+            from kraken.lib import vgsl
+            self.segment_page = blla.segment
+            model_path = model_path or str(resources.files('kraken').joinpath('blla.mlmodel'))
+            self.model = vgsl.TorchVGSLModel.load_model(model_path)
+        else:
+            from kraken import pageseg
+            self.segment_page = pageseg.segment
+            self.model = None
+
+    def binarize(self, image):
+        return self.binarization.nlbin(image)
+
+    def segment(self, binarized):
+        """kraken's own segmentation result (what kraken.rpred expects as bounds)."""
+        if self.model is not None:
+            return self.segment_page(binarized, model=self.model)
+        return self.segment_page(binarized)
+
+    def process(self, input_image_path, paths):
+        from PIL import Image
+        with Image.open(input_image_path) as image:
+            binarized = self.binarize(image)
+        binarized.save(paths['binarized'])
+        seg_data = segmentation_to_json(self.segment(binarized))
+        with open(paths['segmentation'], 'w') as f:
+            json.dump(seg_data, f)
+        return seg_data, np.array(binarized.convert('L'))
+
+class KrakenCLI:
+    def __init__(self, segmenter, model_path=None):
+        self.segment_args = ["segment", "-bl"] if segmenter == 'baseline' else ["segment", "-x"]
+        if segmenter == 'baseline' and model_path:
+            self.segment_args += ["-i", model_path]
 
-    binarized_image = os.path.join(output_dir, f"{base_name}_binarized.png")
-    segmentation_json = os.path.join(output_dir, f"{base_name}_segmentation.json")
-    overlay_image = os.path.join(output_dir, f"{base_name}_overlay.png")
+    def process(self, input_image_path, paths):
+        run_command(["kraken", "-i", input_image_path, paths['binarized'], "binarize"])
+        run_command(["kraken", "-i", paths['binarized'], paths['segmentation']] + self.segment_args)
+        with open(paths['segmentation'], 'r') as f:
+            seg_data = segmentation_to_json(json.load(f))
+        img = cv2.imread(paths['binarized'], cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise SegmentationError(f"Could not read the binarized image from {paths['binarized']}")
+        return seg_data, img
 
-    # Binarize the image using Kraken
-    binarize_cmd = ["kraken", "-i", input_image_path, binarized_image, "binarize"]
-    run_command(binarize_cmd)
-    print("Binarized image saved to", binarized_image)
+def segmentation_to_json(result):
+    """Same JSON layout as `kraken segment` writes: a dictionary with a "lines" key."""
+    if dataclasses.is_dataclass(result):
+        return json.loads(json.dumps(dataclasses.asdict(result), default=str))
+    if 'lines' not in result and 'boxes' in result:
+        # Older kraken versions return the legacy segmenter's boxes as (x0, y0, x1, y1)
+        result = dict(result)
+        result['lines'] = [{'bbox': [x0, y0, x1 - x0, y1 - y0]} for x0, y0, x1, y1 in result.pop('boxes')]
+    return result
 
-    # Segment the binarized image using Kraken
-    segment_cmd = ["kraken", "-i", binarized_image, segmentation_json, "segment"]
-    run_command(segment_cmd)
-    print("Segmentation JSON saved to", segmentation_json)
+def create_engine(engine, segmenter, model_path=None):
+    if engine in ('api', 'auto'):
+        try:
+            return KrakenAPI(segmenter, model_path)
+        except ImportError as e:
+            if engine == 'api':
+                raise
+            print(f"WARNING: kraken cannot be imported here ({e}), falling back to the kraken command.")
+    return KrakenCLI(segmenter, model_path)
 
-    # Load the segmentation JSON file and draw an overlay
+# --- Per-Image Processing ---
+worker_engine = None
+
+def load_engine(engine, segmenter, model_path=None):
+    global worker_engine
+    worker_engine = create_engine(engine, segmenter, model_path)
+
+def init_worker(engine, segmenter, model_path=None):
+    """Initializer of the pool's worker processes."""
+    # One model per process: keep each worker's math libraries from oversubscribing the cores.
+    # A single process segmenting on its own keeps every thread.
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    load_engine(engine, segmenter, model_path)
+
+def segment_image(input_image_path, output_dir, tiles_dir=None, full_overlay=False):
+    """Binarize, segment and render the overlay pyramid for one image; never raises."""
+    start = time.perf_counter()
+    paths = output_paths(input_image_path, output_dir, tiles_dir, full_overlay)
     try:
-        with open(segmentation_json, 'r') as f:
-            seg_data = json.load(f)
+        seg_data, img = worker_engine.process(input_image_path, paths)
+        lines = seg_data.get("lines", [])
+        render_pyramid(img, lines, os.path.dirname(paths['pyramid']), workers=2)
+        if full_overlay:
+            cv2.imwrite(paths['overlay'], render_full(img, lines))
+        return {'image': input_image_path, 'status': 'done', 'lines': len(lines),
+                'seconds': time.perf_counter() - start, **paths}
     except Exception as e:
-        print("Failed to load segmentation JSON:", e)
-        sys.exit(1)
-
-    # The JSON output (as seen in your example) is a dictionary with a "lines" key.
-    lines = seg_data.get("lines", [])
-    print(f"Found {len(lines)} segmented lines.")
-
-    # Load the binarized image (for overlay)
-    img = cv2.imread(binarized_image)
-    if img is None:
-        print("Could not read the binarized image from", binarized_image)
-        sys.exit(1)
-
-    # Draw bounding boxes over the image for each segmented line
-    for line in lines:
-        bbox = line.get("bbox")
-        if bbox and len(bbox) == 4:
-            x, y, w, h = map(int, bbox)
-            # Draw a green rectangle (BGR: (0, 255, 0)) with a thickness of 2 pixels
-            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        return {'image': input_image_path, 'status': 'failed', 'error': f"{type(e).__name__}: {e}",
+                'seconds': time.perf_counter() - start}
+
+def collect_inputs(inputs, file_list=None):
+    images = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                images.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(item)
+    if file_list:
+        with open(file_list, 'r') as f:
+            images.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return list(dict.fromkeys(images))
+
+def segment_batch(images, output_dir, workers=1, engine='auto', segmenter='baseline', model_path=None, force=False,
+                  tiles_dir=None, full_overlay=False):
+    """Segments many images; returns the per-image results (skipped, done or failed)."""
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    todo = []
+    for image in images:
+        if not os.path.exists(image):
+            print("Input image does not exist:", image)
+            results.append({'image': image, 'status': 'failed', 'error': 'input image does not exist'})
+        elif not force and is_up_to_date(image, output_paths(image, output_dir, tiles_dir, full_overlay)):
+            results.append({'image': image, 'status': 'skipped'})
         else:
-            print("Skipping a line segment with invalid bbox:", line)
+            todo.append(image)
+    skipped = sum(1 for r in results if r['status'] == 'skipped')
+    print(f"{len(todo)} images to segment, {skipped} already up to date.")
+
+    start = time.perf_counter()
+    # No engine (and no kraken model) is loaded when every image is up to date
+    if todo and (len(todo) == 1 or workers <= 1):
+        load_engine(engine, segmenter, model_path)
+        outcomes = (segment_image(image, output_dir, tiles_dir, full_overlay) for image in todo)
+        results.extend(report_progress(outcomes, len(todo), start))
+    elif todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(engine, segmenter, model_path)) as pool:
+            futures = [pool.submit(segment_image, image, output_dir, tiles_dir, full_overlay) for image in todo]
+            outcomes = (future.result() for future in as_completed(futures))
+            results.extend(report_progress(outcomes, len(todo), start))
+    elapsed = time.perf_counter() - start
+
+    done = sum(1 for r in results if r['status'] == 'done')
+    failed = [r for r in results if r['status'] == 'failed']
+    rate = done / elapsed * 60 if elapsed and done else 0
+    print(f"Segmented {done} pages in {elapsed:.1f}s ({rate:.1f} pages/min), {skipped} skipped, {len(failed)} failed.")
+    for result in failed:
+        print(f"FAILED {result['image']}: {result['error']}")
+    return results
+
+def report_progress(outcomes, total, start):
+    for count, result in enumerate(outcomes, 1):
+        elapsed = time.perf_counter() - start
+        if result['status'] == 'done':
+            print(f"[{count}/{total}] {result['image']}: {result['lines']} lines in {result['seconds']:.1f}s "
+                  f"({count / elapsed * 60:.1f} pages/min)")
+        else:
+            print(f"[{count}/{total}] {result['image']}: {result['error']}")
+        yield result
+
+def main():
+    parser = argparse.ArgumentParser(description="Binarize and segment register pages with kraken.")
+    parser.add_argument('inputs', nargs='*', help="images and/or directories of images")
+    parser.add_argument('--file-list', help="text file with one image path per line")
+    # You can adjust the output directory as needed
+    parser.add_argument('--output-dir', default='data')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--engine', choices=['auto', 'api', 'cli'], default='auto',
+                        help="kraken Python API loaded once per worker, or the kraken command per image")
+    parser.add_argument('--segmenter', choices=['baseline', 'boxes'], default='baseline',
+                        help="kraken's baseline segmenter (as `kraken segment` does), or the legacy bounding boxes")
+    parser.add_argument('--model', help="baseline segmentation model, e.g. ketuvim_segmenter (default: kraken's)")
+    parser.add_argument('--tiles-dir', help="write overlay pyramids to <tiles-dir>/<image name>/ (e.g. web/overlays)")
+    parser.add_argument('--full-overlay', action='store_true', help="also write a full-resolution overlay PNG")
+    parser.add_argument('--force', action='store_true', help="redo images whose outputs are up to date")
+    args = parser.parse_args()
+    if not args.inputs and not args.file_list:
+        parser.error("give at least one image, directory or --file-list")
+
+    images = collect_inputs(args.inputs, args.file_list)
+    results = segment_batch(images, args.output_dir, workers=args.workers, engine=args.engine,
+                            segmenter=args.segmenter, model_path=args.model, force=args.force,
+                            tiles_dir=args.tiles_dir, full_overlay=args.full_overlay)
 
-    # Save the overlay image
-    cv2.imwrite(overlay_image, img)
-    print("Overlay image saved as", overlay_image)
+    report_path = os.path.join(args.output_dir, REPORT_NAME)
+    with open(report_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Per-image report saved to", report_path)
+    sys.exit(1 if any(r['status'] == 'failed' for r in results) else 0)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python unified_segmentation.py <input_image>")
-        sys.exit(1)
-    main(sys.argv[1])
+    main()
@@ -0,0 +1,75 @@
+import sqlite3
+import sys
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+import numpy as np
+
+import data_cleaning
+
+
+def scan(seed):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=(64, 48, 3), dtype=np.uint8)
+
+
+def blank():
+    return np.full((64, 48, 3), 250, dtype=np.uint8)
+
+
+def run(tmp_path, monkeypatch, near_duplicate_distance=0):
+    manifest = tmp_path / 'manifest.db'
+    monkeypatch.setattr(sys, 'argv', ['data_cleaning.py', '--raw', str(tmp_path / 'raw'),
+                                      '--cleaned', str(tmp_path / 'cleaned'), '--manifest', str(manifest),
+                                      '--workers', '1', '--near-duplicate-distance', str(near_duplicate_distance)])
+    data_cleaning.main()
+    db = sqlite3.connect(manifest)
+    try:
+        return {row[0]: (row[1], row[2]) for row in db.execute('SELECT relative_path, status, duplicate_of FROM files')}
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def raw(tmp_path):
+    (tmp_path / 'raw').mkdir()
+    return tmp_path / 'raw'
+
+
+def test_the_same_pixels_in_another_file_are_a_duplicate(tmp_path, monkeypatch, raw):
+    cv2.imwrite(str(raw / 'a.png'), scan(1), [cv2.IMWRITE_PNG_COMPRESSION, 9])
+    cv2.imwrite(str(raw / 'b.png'), scan(1), [cv2.IMWRITE_PNG_COMPRESSION, 0])
+    assert (raw / 'a.png').read_bytes() != (raw / 'b.png').read_bytes()
+    assert run(tmp_path, monkeypatch) == {'a.png': ('saved', None), 'b.png': ('duplicate', 'a.png')}
+    assert not (tmp_path / 'cleaned' / 'b.png').exists()
+
+
+def test_copies_of_a_low_quality_scan_are_duplicates(tmp_path, monkeypatch, raw):
+    cv2.imwrite(str(raw / 'a.png'), blank())
+    cv2.imwrite(str(raw / 'b.png'), blank())
+    assert run(tmp_path, monkeypatch) == {'a.png': ('low_quality', None), 'b.png': ('duplicate', 'a.png')}
+
+    # A later run still knows the rejected scan
+    cv2.imwrite(str(raw / 'c.png'), blank())
+    assert run(tmp_path, monkeypatch)['c.png'] == ('duplicate', 'a.png')
+
+
+def test_low_quality_scans_are_in_the_near_duplicate_index(tmp_path, monkeypatch, raw):
+    image = blank()
+    image[10:30, 10:30] = 244  # faint, but not the same pixels once re-compressed
+    cv2.imwrite(str(raw / 'a.png'), image)
+    cv2.imwrite(str(raw / 'b.jpg'), image, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    results = run(tmp_path, monkeypatch, near_duplicate_distance=6)
+    assert results == {'a.png': ('low_quality', None), 'b.jpg': ('near_duplicate', 'a.png')}
+
+
+def test_a_manifest_with_file_hashes_is_processed_again(tmp_path, monkeypatch, raw):
+    cv2.imwrite(str(raw / 'a.png'), scan(1))
+    run(tmp_path, monkeypatch)
+    db = sqlite3.connect(tmp_path / 'manifest.db')
+    db.execute("UPDATE files SET status = 'duplicate', content_hash = 'file bytes'")
+    db.execute('PRAGMA user_version = 1')
+    db.commit()
+    db.close()
+    assert run(tmp_path, monkeypatch) == {'a.png': ('saved', None)}
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+import numpy as np
+
+from overlay_renderer import BASELINE_COLOR, BOUNDARY_COLOR, MANIFEST_NAME, render_full, render_pyramid
+
+# What kraken's baseline segmenter (blla) writes: a baseline and a boundary polygon per line
+BASELINE_LINES = [
+    {'id': 'line_1', 'tags': {'type': 'default'},
+     'baseline': [[20, 90], [300, 95], [580, 88]],
+     'boundary': [[20, 60], [580, 58], [580, 100], [20, 102]]},
+    {'id': 'line_2', 'tags': {'type': 'default'},
+     'baseline': [[40, 330], [560, 335]],
+     'boundary': [[40, 300], [560, 302], [560, 342], [40, 340]]},
+]
+
+
+def page(width=600, height=400):
+    return np.full((height, width), 255, dtype=np.uint8)
+
+
+def stitch(level_dir, columns, rows):
+    return np.vstack([np.hstack([cv2.imread(os.path.join(level_dir, f"{col}_{row}.png")) for col in range(columns)])
+                      for row in range(rows)])
+
+
+def has_color(image, color):
+    return bool(np.any(np.all(image == color, axis=2)))
+
+
+def test_tiles_of_a_baseline_page_join_into_the_full_overlay(tmp_path):
+    out_dir = str(tmp_path / 'page')
+    manifest = render_pyramid(page(), BASELINE_LINES, out_dir, tile_size=256, workers=2)
+    assert manifest == {'width': 600, 'height': 400, 'tile_size': 256, 'levels': 3, 'format': 'png', 'lines': 2}
+    with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+        assert json.load(f) == manifest
+    # Both lines cross tile borders; drawing each tile on its own crop must not leave seams
+    stitched = stitch(os.path.join(out_dir, '0'), 3, 2)
+    full = render_full(page(), BASELINE_LINES)
+    assert stitched.shape == full.shape
+    # OpenCV anti-aliases a clipped polyline slightly differently, so a few edge pixels may
+    # differ by a shade; the strokes themselves must be the same
+    drawn_tiles, drawn_full = np.any(stitched != 255, axis=2), np.any(full != 255, axis=2)
+    assert (drawn_tiles ^ drawn_full).sum() <= 0.02 * drawn_full.sum()
+    assert np.array_equal(np.all(stitched == BASELINE_COLOR, axis=2), np.all(full == BASELINE_COLOR, axis=2))
+    assert has_color(full, BASELINE_COLOR) and has_color(full, BOUNDARY_COLOR)
+
+
+def test_every_level_is_half_the_previous_and_the_last_fits_one_tile(tmp_path):
+    out_dir = str(tmp_path / 'page')
+    render_pyramid(page(), BASELINE_LINES, out_dir, tile_size=256)
+    assert sorted(os.listdir(os.path.join(out_dir, '1'))) == ['0_0.png', '1_0.png']
+    [top] = os.listdir(os.path.join(out_dir, '2'))
+    tile = cv2.imread(os.path.join(out_dir, '2', top))
+    assert tile.shape == (100, 150, 3)
+    # Baselines stay visible at the smallest zoom
+    assert has_color(tile, BASELINE_COLOR)
+
+
+def test_a_tile_away_from_every_line_stays_blank(tmp_path):
+    lines = [{'baseline': [[10, 30], [200, 30]], 'boundary': [[10, 10], [200, 10], [200, 35], [10, 35]]}]
+    out_dir = str(tmp_path / 'page')
+    render_pyramid(page(), lines, out_dir, tile_size=256)
+    far = cv2.imread(os.path.join(out_dir, '0', '2_1.png'))
+    assert np.all(far == 255)
+
+
+def test_boxes_and_malformed_lines_are_drawn_or_skipped_without_failing(tmp_path):
+    lines = BASELINE_LINES[:1] + [{'bbox': [30, 200, 100, 40]}, {'baseline': 'not points'}, {}]
+    manifest = render_pyramid(page(), lines, str(tmp_path / 'page'), tile_size=256)
+    assert manifest['lines'] == 2
+    full = render_full(page(), lines)
+    assert (full[200, 30:131] == BOUNDARY_COLOR).all(axis=1).any()
+
+
+def test_a_new_pyramid_replaces_the_old_one(tmp_path):
+    out_dir = str(tmp_path / 'page')
+    render_pyramid(page(1000, 1000), BASELINE_LINES, out_dir, tile_size=256)
+    render_pyramid(page(), BASELINE_LINES, out_dir, tile_size=256)
+    assert sorted(os.listdir(out_dir)) == ['0', '1', '2', MANIFEST_NAME]
+    assert not os.path.exists(out_dir + '.tmp')
@@ -0,0 +1,167 @@
+import queue
+import sys
+import threading
+import time
+import types
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('flask')
+Image = pytest.importorskip('PIL.Image')
+
+import pipeline
+from pipeline import STOP, Pipeline, Stage
+
+
+class FakeKraken:
+    """Stands in for KrakenAPI: binarizes to mode '1' and finds one line, except on pages named 'blank'."""
+
+    instances = []
+
+    def __init__(self, segmenter, model_path=None):
+        self.segmenter = segmenter
+        FakeKraken.instances.append(self)
+
+    def binarize(self, image):
+        return image.convert('1')
+
+    def segment(self, binarized):
+        if binarized.width == 1:
+            raise ValueError("no lines found")
+        return {'type': self.segmenter, 'lines': [{'baseline': [[0, 5], [9, 5]]}]}
+
+
+@pytest.fixture
+def fake_kraken(monkeypatch):
+    """kraken is not needed: the recognizer 'reads' the image mode, so tests can see which image it got."""
+    def rpred(net, image, bounds):
+        return [SimpleNamespace(prediction=f"{net} {image.mode} {bounds['type']}")]
+
+    kraken = types.ModuleType('kraken')
+    kraken.rpred = SimpleNamespace(rpred=rpred)
+    kraken_lib = types.ModuleType('kraken.lib')
+    kraken_lib.models = SimpleNamespace(load_any=lambda path: 'recognizer')
+    monkeypatch.setitem(sys.modules, 'kraken', kraken)
+    monkeypatch.setitem(sys.modules, 'kraken.lib', kraken_lib)
+    monkeypatch.setattr(pipeline, 'KrakenAPI', FakeKraken)
+    FakeKraken.instances.clear()
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for name, size in (('page_1.png', (10, 10)), ('blank.png', (1, 1)), ('page_2.png', (12, 10))):
+        Image.new('L', size, 200).save(tmp_path / name)
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def stored(database):
+    from storage import connect
+    db = connect(database)
+    try:
+        return {row['image_name']: row['corrected_text'] for row in db.execute('SELECT * FROM transcriptions')}
+    finally:
+        db.close()
+
+
+def test_pages_are_segmented_with_baselines_and_recognized_from_the_original(tmp_path, fake_kraken, images):
+    database = str(tmp_path / 'ketuvim.db')
+    runner = Pipeline('ketuvim_recognizer.mlmodel', database=database, correct=False, store_images=False)
+    results = {result['image_name']: result for result in runner.run(images + [str(tmp_path / 'missing.png')])}
+    runner.close()
+    [kraken] = FakeKraken.instances
+    assert kraken.segmenter == 'baseline'
+    assert results['page_1.png']['corrected_text'] == 'recognizer L baseline'
+    assert results['blank.png']['failed_stage'] == 'segment'
+    assert results['missing.png']['failed_stage'] == 'input'
+    assert stored(database) == {'page_1.png': 'recognizer L baseline', 'page_2.png': 'recognizer L baseline'}
+
+    stats = runner.stats()
+    assert stats['pages'] == 4
+    assert stats['stages']['segment']['failed'] == 1
+    assert stats['stages']['store']['processed'] == 2
+
+
+def test_box_segmentation_recognizes_from_the_binarized_page(tmp_path, fake_kraken, images):
+    runner = Pipeline('ketuvim_recognizer.mlmodel', segmenter='boxes', correct=False, save=False)
+    results = list(runner.run(images[:1]))
+    assert results[0]['corrected_text'] == 'recognizer 1 boxes'
+
+
+def test_corrections_of_several_pages_share_a_model_call(tmp_path, fake_kraken, images, monkeypatch):
+    calls = []
+
+    def correct(texts, tokenizer, model, **options):
+        calls.append(len(texts))
+        return [text.upper() for text in texts]
+
+    runner = Pipeline('ketuvim_recognizer.mlmodel', correct=False, save=False, correct_batch_size=8)
+    runner.bundle = {'tokenizer': 't', 'model': 'm', 'lexicon': None, 'trie': None}
+    monkeypatch.setattr(runner.app, 'run_nert_corrector_batch', correct)
+    # Let every page reach the correct stage before it starts taking them
+    release = threading.Event()
+    original = runner.stages[3].work
+
+    def gated(pages):
+        release.wait(5)
+        original(pages)
+    runner.stages[3].work = gated
+    threading.Timer(0.3, release.set).start()
+    paths = [images[0]] * 3 + [images[2]] * 3
+    results = list(runner.run(paths))
+    assert [result['corrected_text'] for result in results] == ['RECOGNIZER L BASELINE'] * 6
+    assert sum(calls) == 6 and len(calls) < 6
+
+
+# --- Stage ---
+def run_stages(stages, items, queue_size=2):
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    for stage, inbox, outbox in zip(stages, queues, queues[1:]):
+        stage.inbox, stage.outbox = inbox, outbox
+        stage.start()
+
+    def feed():
+        for item in items:
+            queues[0].put({'n': item, 'timings': {}})
+        queues[0].put(STOP)
+    threading.Thread(target=feed, daemon=True).start()
+    out = []
+    while True:
+        page = queues[-1].get(timeout=10)
+        if page is STOP:
+            return out
+        out.append(page)
+
+
+def test_a_stage_takes_what_is_waiting_up_to_its_batch_size():
+    sizes = []
+
+    def slow(pages):
+        sizes.append(len(pages))
+        time.sleep(0.02)
+    out = run_stages([Stage('batch', slow, batch_size=3)], range(10), queue_size=10)
+    assert sorted(page['n'] for page in out) == list(range(10))
+    assert max(sizes) == 3 and sum(sizes) == 10
+
+
+def test_a_slow_stage_holds_the_earlier_ones_back():
+    fast = Stage('fast', lambda pages: None)
+    slow = Stage('slow', lambda pages: time.sleep(0.01))
+    run_stages([fast, slow], range(20), queue_size=2)
+    assert fast.stats()['blocked_puts'] > 0
+    assert fast.stats()['max_queue_depth'] <= 2
+    assert slow.stats()['utilization'] > fast.stats()['utilization']
+
+
+def test_an_error_fails_only_the_pages_of_that_batch_and_they_skip_later_stages():
+    def picky(pages):
+        if any(page['n'] == 3 for page in pages):
+            raise RuntimeError("cannot read page 3")
+    later = []
+    out = run_stages([Stage('first', picky), Stage('second', lambda pages: later.extend(p['n'] for p in pages))],
+                     range(5))
+    failed = [page for page in out if page.get('error')]
+    assert [(page['n'], page['failed_stage']) for page in failed] == [(3, 'first')]
+    assert sorted(later) == [0, 1, 2, 4]
@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+import numpy as np
+
+import segmentation
+from segmentation import KrakenCLI, segment_batch, segmentation_to_json
+
+
+class FakeEngine:
+    """Stands in for kraken: one baseline line per page, or an error for pages named 'broken'."""
+
+    def __init__(self, segmenter):
+        self.segmenter = segmenter
+        self.processed = []
+
+    def process(self, input_image_path, paths):
+        self.processed.append(os.path.basename(input_image_path))
+        if 'broken' in input_image_path:
+            raise segmentation.SegmentationError("kraken exited with status 1")
+        image = np.full((300, 400), 255, dtype=np.uint8)
+        cv2.imwrite(paths['binarized'], image)
+        seg_data = {'lines': [{'baseline': [[10, 50], [390, 50]], 'boundary': [[10, 20], [390, 20], [390, 55], [10, 55]]}]}
+        with open(paths['segmentation'], 'w') as f:
+            json.dump(seg_data, f)
+        return seg_data, image
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engines = []
+
+    def create_engine(engine, segmenter, model_path=None):
+        engines.append(FakeEngine(segmenter))
+        return engines[-1]
+
+    monkeypatch.setattr(segmentation, 'create_engine', create_engine)
+    return engines
+
+
+@pytest.fixture
+def pages(tmp_path):
+    names = []
+    for name in ('a.png', 'b.png', 'broken.png'):
+        cv2.imwrite(str(tmp_path / name), np.zeros((10, 10), dtype=np.uint8))
+        names.append(str(tmp_path / name))
+    return names
+
+
+def test_every_page_gets_outputs_and_a_failure_does_not_stop_the_batch(tmp_path, engine, pages):
+    output_dir = tmp_path / 'out'
+    results = segment_batch(pages + [str(tmp_path / 'missing.png')], str(output_dir), workers=1)
+    assert [(os.path.basename(r['image']), r['status']) for r in results] == [
+        ('missing.png', 'failed'), ('a.png', 'done'), ('b.png', 'done'), ('broken.png', 'failed')]
+    assert 'kraken exited' in results[-1]['error']
+    [worker] = engine
+    assert worker.segmenter == 'baseline'
+    assert (output_dir / 'a_segmentation.json').exists()
+    assert (output_dir / 'a_overlay' / 'pyramid.json').exists()
+
+
+def test_pages_with_current_outputs_are_skipped_unless_forced(tmp_path, engine, pages):
+    output_dir = str(tmp_path / 'out')
+    segment_batch(pages[:2], output_dir)
+    results = segment_batch(pages[:2], output_dir)
+    assert [r['status'] for r in results] == ['skipped', 'skipped']
+    assert len(engine) == 1  # nothing left to do, so no engine was loaded
+
+    os.utime(pages[0], (os.path.getmtime(pages[0]) + 10,) * 2)
+    assert [r['status'] for r in segment_batch(pages[:2], output_dir)] == ['skipped', 'done']
+    assert [r['status'] for r in segment_batch(pages[:2], output_dir, force=True)] == ['done', 'done']
+
+
+def test_only_pool_workers_are_limited_to_one_thread(monkeypatch, engine):
+    monkeypatch.delenv('OMP_NUM_THREADS', raising=False)
+    segmentation.load_engine('api', 'baseline')
+    assert 'OMP_NUM_THREADS' not in os.environ
+    segmentation.init_worker('api', 'baseline')
+    assert os.environ['OMP_NUM_THREADS'] == '1'
+
+
+def test_the_command_line_engine_converts_legacy_boxes(tmp_path, monkeypatch):
+    paths = {'binarized': str(tmp_path / 'page_binarized.png'), 'segmentation': str(tmp_path / 'page.json')}
+    commands = []
+
+    def run_command(command):
+        commands.append(command)
+        if command[-1] == 'binarize':
+            cv2.imwrite(paths['binarized'], np.zeros((20, 20), dtype=np.uint8))
+        else:
+            with open(paths['segmentation'], 'w') as f:
+                json.dump({'text_direction': 'horizontal-lr', 'boxes': [[1, 2, 11, 7]]}, f)
+
+    monkeypatch.setattr(segmentation, 'run_command', run_command)
+    seg_data, image = KrakenCLI('boxes').process('page.png', paths)
+    assert commands[1][-2:] == ['segment', '-x']
+    assert seg_data['lines'] == [{'bbox': [1, 2, 10, 5]}]
+    assert image.shape == (20, 20)
+
+
+def test_baseline_results_keep_their_lines():
+    lines = [{'baseline': [[0, 5], [9, 5]], 'boundary': [[0, 0], [9, 0], [9, 6], [0, 6]]}]
+    assert segmentation_to_json({'type': 'baselines', 'lines': lines}) == {'type': 'baselines', 'lines': lines}
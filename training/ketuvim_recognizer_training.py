@@ -1,20 +1,40 @@
-import subprocess
+import argparse
+import json
+import sys
 
-def run_command(command):
-    print(f"Executing: {command}")
-    result = subprocess.run(command, shell=True)
-    if result.returncode != 0:
-        print(f"Error: Command failed - {command}")
-        exit(result.returncode)
+from recognizer_corpus import CommandError, compile_corpus, detect_device, report_training, run_command
 
 def main():
-    commands = [
-        "ketos compile --keep-empty-lines -f xml -o labelled.arrow *.xml",
-        "ketos train -f binary -d mps --resize both -i pretrain_best.mlmodel -o ketuvim_recognizer -B 4 -r 0.0002 schedule cosine -u NFC --warmup 5000 --freeze-backbone 1000 labelled.arrow"
-    ]
-    
-    for cmd in commands:
-        run_command(cmd)
+    parser = argparse.ArgumentParser(description="Compile PAGE XML (incrementally) and fine-tune the recognizer with ketos.")
+    parser.add_argument('sources', nargs='*', default=['*.xml'], help="PAGE XML files or glob patterns")
+    parser.add_argument('--cache-dir', default='labelled_corpus', help="compiled Arrow shards and their manifest")
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--jobs', type=int, default=2, help="shards compiled at the same time")
+    parser.add_argument('--device', default='auto', help="auto, cpu, mps or cuda:N")
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--epochs', type=int, help="fixed number of epochs (default: ketos' early stopping)")
+    parser.add_argument('--pretrained', default='pretrain_best.mlmodel')
+    parser.add_argument('--output', default='ketuvim_recognizer')
+    parser.add_argument('--stats', help="write compile and training throughput as JSON here")
+    args = parser.parse_args()
+
+    try:
+        shards, stats = compile_corpus(args.sources, args.cache_dir, num_shards=args.shards, jobs=args.jobs)
+        device = detect_device(args.device)
+        command = ["ketos", "train", "-f", "binary", "-d", device, "--resize", "both", "-i", args.pretrained,
+                   "-o", args.output, "-B", str(args.batch_size), "-r", "0.0002", "--schedule", "cosine",
+                   "-u", "NFC", "--warmup", "5000", "--freeze-backbone", "1000"]
+        if args.epochs:
+            command += ["-N", str(args.epochs), "--quit", "fixed"]
+        seconds = run_command(command + shards)
+    except (CommandError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    stats = report_training(stats, seconds, args.epochs)
+    stats.update(device=device, batch_size=args.batch_size)
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump(stats, f, indent=2)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,134 @@
+import itertools
+import json
+import random
+
+from torch.utils.data import IterableDataset, get_worker_info
+
+from typos import simulate_complex_typo
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_correction_pairs(path):
+    """Streams (input, corrected) pairs from an export of web/corpus_export.py, a batch at a time.
+
+    Reads JSONL or Parquet, at page or word granularity: a page record with an alignment
+    gives one pair per aligned word, any other record its input_text and corrected_text.
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        columns = [name for name in ('input_text', 'corrected_text', 'alignment') if name in parquet.schema_arrow.names]
+        records = (record for batch in parquet.iter_batches(batch_size=1024, columns=columns)
+                   for record in batch.to_pylist())
+    else:
+        records = read_jsonl(path)
+    for record in records:
+        if record.get('alignment') is not None:
+            for source, target in record['alignment']:
+                yield source, target
+        elif record.get('input_text') and record.get('corrected_text'):
+            yield record['input_text'], record['corrected_text']
+
+
+class TypoStream(IterableDataset):
+    """Streams (misspelled, correct) training examples generated on the fly from a vocabulary.
+
+    Nothing but the vocabulary is held for the whole run: each DataLoader worker takes every
+    num_workers-th word (in a shuffled order), makes its typo variants with its own seeded
+    random.Random, and tokenizes them a pool at a time in one tokenizer call. Each pool is
+    sorted by length and emitted in batch_size chunks, in shuffled order, so the batches
+    the DataLoader forms hold words of similar length and DataCollatorForSeq2Seq pads each
+    batch only to its longest example instead of to max_len.
+
+    Call set_epoch() before each epoch to get fresh typos; the same seed and epoch always
+    give the same examples.
+
+    corrections names an exported file of real OCR errors fixed by volunteers (see
+    read_correction_pairs); its pairs are streamed from disk, spread evenly among the
+    synthetic ones, correction_repeats times per epoch.
+    """
+
+    def __init__(self, vocabulary, tokenizer, variants_per_word=100, task_prefix="correct: ", max_len=32,
+                 batch_size=16, pool_batches=64, seed=42, corrections=None, correction_repeats=1):
+        self.vocabulary = [word for word in vocabulary if isinstance(word, str) and word]
+        self.tokenizer = tokenizer
+        self.variants_per_word = variants_per_word
+        self.task_prefix = task_prefix
+        self.max_len = max_len
+        self.batch_size = batch_size
+        self.pool_size = batch_size * pool_batches
+        self.seed = seed
+        self.epoch = 0
+        self.corrections = corrections
+        self.correction_repeats = correction_repeats
+        # Counted once by streaming through the file, never held
+        self.num_corrections = sum(1 for _ in read_correction_pairs(corrections)) if corrections else 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def approximate_length(self, error_rate=0.9):
+        # Variants identical to the word are dropped, so the exact count is only known afterwards
+        return (int(len(self.vocabulary) * self.variants_per_word * error_rate)
+                + self.num_corrections * self.correction_repeats)
+
+    def correction_pairs(self, worker_id, num_workers):
+        for _ in range(self.correction_repeats):
+            for index, (source, target) in enumerate(read_correction_pairs(self.corrections)):
+                if index % num_workers == worker_id:
+                    yield self.task_prefix + source, target
+
+    def pairs(self, rng, worker_id, num_workers):
+        indices = list(range(worker_id, len(self.vocabulary), num_workers))
+        rng.shuffle(indices)
+        corrections = self.correction_pairs(worker_id, num_workers) if self.corrections else iter(())
+        per_word = self.num_corrections * self.correction_repeats / num_workers / max(1, len(indices))
+        owed = 0.0
+        for index in indices:
+            word = self.vocabulary[index]
+            for _ in range(self.variants_per_word):
+                misspelled = simulate_complex_typo(word, rng=rng)
+                if misspelled != word and misspelled:
+                    yield self.task_prefix + misspelled, word
+            owed += per_word
+            while owed >= 1:
+                owed -= 1
+                yield from itertools.islice(corrections, 1)
+        yield from corrections
+
+    def encode_pool(self, pool, rng):
+        sources = self.tokenizer([source for source, _ in pool], max_length=self.max_len, truncation=True)
+        targets = self.tokenizer(text_target=[target for _, target in pool], max_length=self.max_len, truncation=True)
+        examples = [
+            {'input_ids': input_ids, 'attention_mask': attention_mask, 'labels': labels}
+            for input_ids, attention_mask, labels in zip(sources['input_ids'], sources['attention_mask'], targets['input_ids'])
+        ]
+        examples.sort(key=lambda example: (len(example['input_ids']), len(example['labels'])))
+        batches = [examples[i:i + self.batch_size] for i in range(0, len(examples), self.batch_size)]
+        # A short last batch stays last so it cannot shift the DataLoader's batch boundaries
+        short = batches.pop() if len(batches[-1]) < self.batch_size else None
+        rng.shuffle(batches)
+        if short:
+            batches.append(short)
+        for batch in batches:
+            yield from batch
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+        # String seeds are hashed deterministically, unlike hash() of a tuple
+        rng = random.Random(f"{self.seed}:{self.epoch}:{worker_id}")
+        pool = []
+        for pair in self.pairs(rng, worker_id, num_workers):
+            pool.append(pair)
+            if len(pool) == self.pool_size:
+                yield from self.encode_pool(pool, rng)
+                pool = []
+        if pool:
+            yield from self.encode_pool(pool, rng)
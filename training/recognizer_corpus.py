@@ -0,0 +1,157 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+COMPILE_ARGS = ["--keep-empty-lines", "-f", "xml"]
+MANIFEST_NAME = 'manifest.json'
+TEXT_LINE = re.compile(rb'<(?:\w+:)?TextLine\b')
+
+
+class CommandError(Exception):
+    pass
+
+
+def run_command(command):
+    """Runs a command given as a list (no shell); returns the seconds it took."""
+    print(f"Executing: {' '.join(command)}")
+    start = time.perf_counter()
+    result = subprocess.run(command)
+    if result.returncode != 0:
+        raise CommandError(f"Command failed with status {result.returncode}: {' '.join(command)}")
+    return time.perf_counter() - start
+
+
+def detect_device(device='auto'):
+    """'auto' picks cuda, then mps, then cpu; any other value is passed to ketos as given."""
+    if device != 'auto':
+        return device
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
+    if torch.cuda.is_available():
+        return 'cuda:0'
+    if torch.backends.mps.is_available() and torch.backends.mps.is_built():
+        return 'mps'
+    return 'cpu'
+
+
+def hash_source(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return hashlib.sha256(data).hexdigest(), len(TEXT_LINE.findall(data))
+
+
+def shard_of(path, num_shards):
+    # Depends on the path only, so a changed or new file never moves other files between shards
+    return int(hashlib.sha1(path.encode('utf-8')).hexdigest()[:8], 16) % num_shards
+
+
+def load_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def compile_corpus(patterns, cache_dir, num_shards=16, jobs=2, compile_args=COMPILE_ARGS):
+    """Compiles PAGE XML into one Arrow shard per group of files, rebuilding only changed shards.
+
+    Source files are hashed and each one is assigned to a shard by its path. A shard is
+    recompiled with `ketos compile` only when its set of files or any of their contents
+    changed since the last run. The shard files are what ketos is then given:
+    ketos train/pretrain load several binary datasets into one training set.
+    Returns (shard_paths, stats).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = sorted({os.path.normpath(path) for pattern in patterns for path in glob.glob(pattern)})
+    if not sources:
+        raise ValueError(f"No source files match {' '.join(patterns)}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        hashes = dict(zip(sources, pool.map(hash_source, sources)))
+    hash_seconds = time.perf_counter() - start
+
+    manifest = load_manifest(cache_dir)
+    options = {'num_shards': num_shards, 'compile_args': list(compile_args)}
+    if manifest.get('options') != options:
+        manifest = {'options': options, 'shards': {}}
+
+    shards = {}
+    for path in sources:
+        shards.setdefault(shard_of(path, num_shards), []).append(path)
+
+    # A shard's digest covers the paths and contents of all of its files
+    wanted = {}
+    for shard, paths in shards.items():
+        digest = hashlib.sha256('\n'.join(f"{p}\t{hashes[p][0]}" for p in paths).encode('utf-8')).hexdigest()
+        wanted[str(shard)] = {'digest': digest, 'files': paths, 'lines': sum(hashes[p][1] for p in paths),
+                              'arrow': os.path.join(cache_dir, f"shard_{shard:03d}.arrow")}
+    for shard, entry in list(manifest['shards'].items()):
+        if shard not in wanted:
+            if os.path.exists(entry['arrow']):
+                os.remove(entry['arrow'])
+            del manifest['shards'][shard]
+
+    dirty = [shard for shard, entry in wanted.items()
+             if manifest['shards'].get(shard, {}).get('digest') != entry['digest'] or not os.path.exists(entry['arrow'])]
+    print(f"{len(sources)} source files in {len(wanted)} shards: {len(dirty)} to compile, "
+          f"{len(wanted) - len(dirty)} unchanged (hashed in {hash_seconds:.1f}s).")
+
+    def compile_shard(shard):
+        entry = wanted[shard]
+        tmp_path = entry['arrow'] + '.tmp'
+        seconds = run_command(["ketos", "compile"] + list(compile_args) + ["-o", tmp_path] + entry['files'])
+        os.replace(tmp_path, entry['arrow'])
+        return shard, seconds
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for shard, seconds in pool.map(compile_shard, dirty):
+            manifest['shards'][shard] = wanted[shard]
+            # Saved after every shard, so an interrupted run keeps the shards it finished
+            save_manifest(cache_dir, manifest)
+    compile_seconds = time.perf_counter() - start
+    save_manifest(cache_dir, manifest)
+
+    compiled_files = sum(len(wanted[shard]['files']) for shard in dirty)
+    compiled_lines = sum(wanted[shard]['lines'] for shard in dirty)
+    stats = {
+        'sources': len(sources),
+        'lines': sum(entry['lines'] for entry in wanted.values()),
+        'shards': len(wanted),
+        'compiled_shards': len(dirty),
+        'compiled_files': compiled_files,
+        'compile_seconds': compile_seconds,
+        'compile_files_per_second': compiled_files / compile_seconds if compile_seconds else None,
+        'compile_lines_per_second': compiled_lines / compile_seconds if compile_seconds else None,
+    }
+    if dirty:
+        print(f"Compiled {compiled_files} files ({compiled_lines} lines) in {compile_seconds:.1f}s "
+              f"({stats['compile_files_per_second']:.1f} files/s, {stats['compile_lines_per_second']:.0f} lines/s).")
+    return [wanted[shard]['arrow'] for shard in sorted(wanted, key=int)], stats
+
+
+def report_training(stats, seconds, epochs=None):
+    stats['train_seconds'] = seconds
+    if epochs:
+        stats['train_lines_per_second'] = stats['lines'] * epochs / seconds if seconds else None
+        print(f"Training took {seconds:.1f}s for {epochs} epochs ({stats['train_lines_per_second']:.1f} lines/s).")
+    else:
+        print(f"Training took {seconds:.1f}s on {stats['lines']} lines "
+              f"({stats['lines'] / seconds if seconds else 0:.1f} corpus lines per second of training).")
+    return stats
@@ -0,0 +1,102 @@
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('torch')
+
+import nert_dataset
+from nert_dataset import TypoStream, read_correction_pairs
+from typos import simulate_complex_typo
+
+VOCABULARY = ['Абрам', 'Хаим', 'Гольдштейн', 'Черновцы', 'Мошко', 'Йом-Кипур', 'Лея', 'Ривка']
+
+
+class CharTokenizer:
+    """One token per character plus EOS (1), like a tokenizer without the model files."""
+
+    def __call__(self, texts=None, text_target=None, max_length=None, truncation=False):
+        texts = text_target if texts is None else texts
+        ids = [[ord(c) for c in text][:max_length - 1 if truncation else None] + [1] for text in texts]
+        return {'input_ids': ids, 'attention_mask': [[1] * len(i) for i in ids]}
+
+
+def decode(ids):
+    return ''.join(chr(i) for i in ids if i != 1)
+
+
+def stream(**options):
+    options = {'variants_per_word': 5, 'batch_size': 4, 'pool_batches': 2, 'seed': 7, **options}
+    return TypoStream(VOCABULARY, CharTokenizer(), **options)
+
+
+def as_pairs(examples):
+    return [(decode(example['input_ids']), decode(example['labels'])) for example in examples]
+
+
+def test_the_same_seed_and_epoch_give_the_same_examples():
+    first, second = stream(), stream()
+    assert as_pairs(first) == as_pairs(second)
+    second.set_epoch(1)
+    assert as_pairs(first) != as_pairs(second)
+
+
+def test_examples_are_misspelled_words_with_the_task_prefix():
+    pairs = as_pairs(stream())
+    assert pairs
+    assert all(source.startswith('correct: ') and source[len('correct: '):] != target for source, target in pairs)
+    assert {target for _, target in pairs} <= set(VOCABULARY)
+
+
+def test_each_worker_takes_its_own_share_of_the_vocabulary(monkeypatch):
+    targets = []
+    for worker_id in range(3):
+        monkeypatch.setattr(nert_dataset, 'get_worker_info', lambda: SimpleNamespace(id=worker_id, num_workers=3))
+        targets.append({target for _, target in as_pairs(stream(variants_per_word=20))})
+    assert set.union(*targets) == set(VOCABULARY)
+    assert sum(len(words) for words in targets) == len(VOCABULARY)
+
+
+def test_full_batches_hold_examples_of_similar_length():
+    examples = list(stream(variants_per_word=20))
+    full = len(examples) // 4 * 4
+    for start in range(0, full, 4):
+        lengths = [len(example['input_ids']) for example in examples[start:start + 4]]
+        assert lengths == sorted(lengths)
+    # pools are sorted, but the batches of a pool are shuffled
+    assert [len(e['input_ids']) for e in examples[:full]] != sorted(len(e['input_ids']) for e in examples[:full])
+
+
+def test_long_examples_are_truncated_to_max_len():
+    assert max(len(example['input_ids']) for example in stream(max_len=8)) == 8
+
+
+def test_real_corrections_are_spread_among_the_synthetic_pairs(tmp_path):
+    corrections = tmp_path / 'corrections.jsonl'
+    with open(corrections, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'input_text': 'Ицкок', 'corrected_text': 'Ицхок'}, ensure_ascii=False) + '\n')
+        f.write(json.dumps({'input_text': 'Сруль', 'corrected_text': 'Сруль', 'alignment': [['Сру ль', 'Сруль']]},
+                           ensure_ascii=False) + '\n')
+    dataset = stream(corrections=str(corrections), correction_repeats=3, pool_batches=1000)
+    assert dataset.num_corrections == 2
+    # the order before pooling shows where the real pairs were placed
+    pairs = list(dataset.pairs(random.Random(0), 0, 1))
+    positions = [i for i, (source, _) in enumerate(pairs) if source in ('correct: Ицкок', 'correct: Сру ль')]
+    assert len(positions) == 6
+    assert positions[0] < len(pairs) // 2
+
+
+def test_correction_files_give_one_pair_per_aligned_word_or_page(tmp_path):
+    path = tmp_path / 'export.jsonl'
+    records = [{'input_text': 'Абрим Хаим', 'corrected_text': 'Абрам Хаим',
+                'alignment': [['Абрим', 'Абрам'], ['Хаим', 'Хаим']]},
+               {'input_text': 'Лея', 'corrected_text': 'Лея'}, {'input_text': 'без правки'}]
+    path.write_text('\n'.join(json.dumps(r, ensure_ascii=False) for r in records) + '\n\n', encoding='utf-8')
+    assert list(read_correction_pairs(str(path))) == [('Абрим', 'Абрам'), ('Хаим', 'Хаим'), ('Лея', 'Лея')]
+
+
+def test_seeded_typos_are_reproducible():
+    words = [simulate_complex_typo('Гольдштейн', rng=random.Random(3)) for _ in range(2)]
+    assert words[0] == words[1] != 'Гольдштейн'
+    assert simulate_complex_typo('Хаим', error_rate=0.0) == 'Хаим'
@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+import recognizer_corpus
+from recognizer_corpus import CommandError, compile_corpus, detect_device, shard_of
+
+PAGE = '<PcGts><Page><TextRegion>{lines}</TextRegion></Page></PcGts>'
+
+
+def write_page(directory, name, lines=2, text='слово'):
+    path = directory / name
+    path.write_text(PAGE.format(lines=''.join(f'<TextLine id="l{i}">{text}</TextLine>' for i in range(lines))),
+                    encoding='utf-8')
+    return str(path)
+
+
+class FakeKetos:
+    """Records the files of each `ketos compile` and writes them into the -o file instead of Arrow data."""
+
+    def __init__(self, fail_after=None):
+        self.compiled = []
+        self.fail_after = fail_after
+
+    def __call__(self, command):
+        if self.fail_after is not None and len(self.compiled) >= self.fail_after:
+            raise CommandError("ketos exited with status 1")
+        output = command[command.index('-o') + 1]
+        files = command[command.index('-o') + 2:]
+        self.compiled.append(files)
+        with open(output, 'w') as f:
+            f.write('\n'.join(files))
+        return 0.01
+
+
+@pytest.fixture
+def ketos(monkeypatch):
+    fake = FakeKetos()
+    monkeypatch.setattr(recognizer_corpus, 'run_command', fake)
+    return fake
+
+
+class Corpus:
+    """Twelve PAGE XML files compiled into four shards."""
+
+    def __init__(self, pattern, cache_dir, paths):
+        self.pattern, self.cache_dir, self.paths = pattern, cache_dir, paths
+
+    def compile(self, **options):
+        return compile_corpus([self.pattern], self.cache_dir, num_shards=4, jobs=1, **options)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    sources = tmp_path / 'xml'
+    sources.mkdir()
+    paths = [write_page(sources, f'page_{i:02d}.xml', lines=i + 1) for i in range(12)]
+    return Corpus(str(sources / '*.xml'), str(tmp_path / 'cache'), paths)
+
+
+def compiled_files(ketos):
+    return sorted(path for files in ketos.compiled for path in files)
+
+
+def test_an_unchanged_corpus_is_not_compiled_again(corpus, ketos):
+    shards, stats = corpus.compile()
+    assert compiled_files(ketos) == sorted(os.path.normpath(p) for p in corpus.paths)
+    assert stats['lines'] == sum(range(1, 13))
+    assert all(os.path.exists(shard) for shard in shards)
+    ketos.compiled.clear()
+    assert corpus.compile()[0] == shards
+    assert ketos.compiled == []
+
+
+def test_a_changed_file_recompiles_only_its_shard(corpus, ketos):
+    corpus.compile()
+    ketos.compiled.clear()
+    changed = corpus.paths[3]
+    with open(changed, 'a', encoding='utf-8') as f:
+        f.write('<!-- corrected -->')
+    _, stats = corpus.compile()
+    [files] = ketos.compiled
+    assert os.path.normpath(changed) in files
+    assert {shard_of(path, 4) for path in files} == {shard_of(os.path.normpath(changed), 4)}
+    assert stats['compiled_shards'] == 1 and stats['compiled_files'] == len(files)
+
+
+def test_a_shard_whose_files_are_gone_is_removed(corpus, ketos):
+    shards, _ = corpus.compile()
+    normalized = [os.path.normpath(p) for p in corpus.paths]
+    emptied = shard_of(normalized[0], 4)
+    for path in normalized:
+        if shard_of(path, 4) == emptied:
+            os.remove(path)
+    remaining, stats = corpus.compile()
+    assert stats['shards'] == len(shards) - 1
+    assert set(remaining) == set(shards) - {os.path.join(corpus.cache_dir, f"shard_{emptied:03d}.arrow")}
+    assert sorted(os.listdir(corpus.cache_dir)) == sorted([os.path.basename(p) for p in remaining] + ['manifest.json'])
+
+
+def test_other_compile_options_or_a_missing_shard_file_force_a_rebuild(corpus, ketos):
+    shards, _ = corpus.compile()
+    ketos.compiled.clear()
+    os.remove(shards[0])
+    corpus.compile()
+    assert len(ketos.compiled) == 1
+    ketos.compiled.clear()
+    corpus.compile(compile_args=['-f', 'alto'])
+    assert len(ketos.compiled) == len(shards)
+
+
+def test_an_interrupted_run_keeps_the_shards_it_finished(corpus, monkeypatch):
+    failing = FakeKetos(fail_after=2)
+    monkeypatch.setattr(recognizer_corpus, 'run_command', failing)
+    with pytest.raises(CommandError):
+        corpus.compile()
+    resumed = FakeKetos()
+    monkeypatch.setattr(recognizer_corpus, 'run_command', resumed)
+    _, stats = corpus.compile()
+    assert stats['compiled_shards'] == stats['shards'] - 2
+    assert not any(name.endswith('.tmp') for name in os.listdir(corpus.cache_dir))
+
+
+def test_no_matching_sources_is_an_error(tmp_path, ketos):
+    with pytest.raises(ValueError):
+        compile_corpus([str(tmp_path / '*.xml')], str(tmp_path / 'cache'))
+
+
+def test_an_explicit_device_is_passed_through():
+    assert detect_device('cpu') == 'cpu'
+    assert detect_device('cuda:1') == 'cuda:1'
@@ -0,0 +1,33 @@
+import random
+
+russian_letters = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+def simulate_complex_typo(word, error_rate=0.9, rng=random):
+    """Simulates a single typo (deletion, insertion, substitution, transposition).
+
+    Pass a seeded random.Random as rng to get reproducible typos.
+    """
+    if not isinstance(word, str) or len(word) < 1 or rng.random() > error_rate:
+        return word
+    possible_errors = ['insertion', 'substitution']
+    if len(word) >= 1: possible_errors.append('deletion')
+    if len(word) >= 2: possible_errors.append('transposition')
+    error_type = rng.choice(possible_errors)
+    try:
+        if error_type == 'deletion':
+            idx = rng.randint(0, len(word) - 1)
+            return word[:idx] + word[idx+1:]
+        elif error_type == 'insertion':
+            idx = rng.randint(0, len(word))
+            return word[:idx] + rng.choice(russian_letters) + word[idx:]
+        elif error_type == 'substitution':
+            idx = rng.randint(0, len(word) - 1)
+            return word[:idx] + rng.choice(russian_letters) + word[idx+1:]
+        elif error_type == 'transposition':
+            idx = rng.randint(0, len(word) - 2)
+            chars = list(word)
+            chars[idx], chars[idx+1] = chars[idx+1], chars[idx]
+            return ''.join(chars)
+    except Exception:
+        return word 
+    return word
@@ -1,37 +1,160 @@
+import hashlib
+import io
+import json
 import os
+import re
 import sqlite3
+import time
+import zipfile
 from datetime import datetime
 from flask import (
-    Flask, request, render_template, redirect, url_for, g, send_from_directory, flash, jsonify
+    Flask, request, render_template, redirect, url_for, g, send_from_directory, send_file, flash, jsonify, Response,
+    stream_with_context
 )
 from werkzeug.utils import secure_filename
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+STARTUP_BEGAN = time.perf_counter()
+
+from correction_cache import CorrectionCache, normalize_span
+from lexicon import load_lexicon_index
+from constrained_decoding import load_vocabulary_trie
+from jobs import JobQueue
+from storage import ConnectionPool, connect, migrate, list_transcriptions
+from batching import MicroBatcher
+from model_manager import ModelManager
+from decoding import DecodingPolicy, decode_batch, decoding_stats
+from metrics import metrics, SlowRequestProfiler
+from upload_store import UploadStore
+from search import index_terms, search_transcriptions
+import corpus_export
 
 # --- Configuration ---
 BASE_DIR = os.path.dirname(__file__)
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 ALLOWED_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
 DATABASE = os.path.join(BASE_DIR, 'ketuvim.db')
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+# /api/correct/batch corrects and stores records in chunks of this many
+BULK_CHUNK_SIZE = 64
+# Stored images never change under their name, so browsers may keep them for a year
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+LEGACY_IMAGE_CACHE_MAX_AGE = 24 * 3600  # flat files in uploads/ saved before the content-addressed store
+THUMBNAIL_SIZE = 320
+# Overlay pyramids written by overlay_renderer.py (segmentation.py --tiles-dir web/overlays),
+# one <image name without extension>/ directory per page
+OVERLAY_FOLDER = os.path.join(BASE_DIR, 'overlays')
+OVERLAY_MANIFEST = 'pyramid.json'
+OVERLAY_CACHE_MAX_AGE = 3600  # pyramids are rewritten when a page is segmented again
 MODEL_DIR = os.path.join(BASE_DIR, 'models')
 NERT_MODEL_PATH = os.path.join(MODEL_DIR, 'ketuvim_nert')
 
+# --- NERT Correction Settings ---
+NERT_TASK_PREFIX = "correct: "
+# 'spans' corrects word by word (as the model was trained), 'full' sends the whole text at once
+NERT_CORRECTION_MODE = 'spans'
+NERT_SPAN_MAX_LENGTH = 32  # same max_len as training/ketuvim_nert_training.py
+NERT_BATCH_SIZE = 32
+NERT_NUM_BEAMS = 4
+# Default decoding policy: greedy first, beam search only for spans below the confidence threshold.
+# The output budget follows the input length; /process can override these per request.
+NERT_DECODING_POLICY = DecodingPolicy(strategy='adaptive', num_beams=NERT_NUM_BEAMS, confidence_threshold=0.8,
+                                      length_ratio=1.5, length_slack=4, max_length=NERT_SPAN_MAX_LENGTH)
+# The most a request may ask for; larger per-request values are lowered to these
+NERT_DECODING_LIMITS = {'num_beams': NERT_NUM_BEAMS, 'max_length': NERT_SPAN_MAX_LENGTH,
+                        'length_slack': NERT_SPAN_MAX_LENGTH}
+NERT_FULL_TEXT_MAX_LENGTH = 512
+NERT_LOG_DECODING = False  # also log batches that needed no escalation
+# Spans from concurrent requests are gathered for up to this long and decoded as one batch
+NERT_MICRO_BATCHING = True
+NERT_BATCH_WINDOW_MS = 10
+# Corrected spans are memoized in memory and in a file next to ketuvim.db; the model files
+# are checked for changes (which drop the cache) every NERT_WATCH_INTERVAL seconds
+NERT_CACHE_PATH = os.path.join(BASE_DIR, 'nert_cache.db')
+NERT_CACHE_MEMORY_ENTRIES = 20000
+# Known and near-known words are resolved from the training vocabulary without the model
+LEXICON_VOCABULARY_PATH = os.path.join(MODEL_DIR, 'vocabulary.csv')
+LEXICON_INDEX_PATH = os.path.join(MODEL_DIR, 'lexicon_index.pkl')
+# Constrained decoding limits beams to spellings from vocabulary.csv (normalized named entities)
+NERT_CONSTRAINED_DECODING = False
+NERT_TRIE_PATH = os.path.join(MODEL_DIR, 'vocabulary_trie.pkl')
+# Background workers that run NERT correction for /process
+NERT_JOB_WORKERS = 2
+NERT_JOB_RETENTION_DAYS = 7  # finished jobs (and their status pages) are deleted after this long
+
+# --- Inference Backend ---
+NERT_BACKEND = 'float32'  # 'float32' or 'int8' (dynamic quantization of the Linear layers)
+NERT_INTRA_OP_THREADS = None  # None keeps torch's default (one per core)
+NERT_INTER_OP_THREADS = None
+NERT_WARMUP = True
+# With the int8 backend, fall back to float32 if it disagrees with it on the sample set
+NERT_INT8_MIN_AGREEMENT = 0.95
+# torch/transformers and the model are loaded in the background on the first request
+# (or at server start); the model directory is checked for changes every NERT_WATCH_INTERVAL seconds
+NERT_WATCH_INTERVAL = 10
+NERT_RETRY_INTERVAL = 30
+# Map the weights from models/ketuvim_nert.safetensors (written by shared_weights.py)
+# instead of reading a private copy: server workers on one host then share a single copy in memory
+NERT_SHARED_WEIGHTS = True
+
+# --- Instrumentation ---
+# Per-stage timings, token and error counts are always recorded and served at /metrics.
+# With PROFILE_SLOW_REQUESTS, a sample of requests and jobs runs under cProfile and
+# dumps of those slower than PROFILE_THRESHOLD_SECONDS are written to PROFILE_DIR.
+PROFILE_SLOW_REQUESTS = False
+PROFILE_SAMPLE_RATE = 0.1
+PROFILE_THRESHOLD_SECONDS = 2.0
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
 # --- Initialize Flask app ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['UPLOAD_FOLDER_ABSOLUTE'] = os.path.abspath(UPLOAD_FOLDER)
-os.makedirs(app.config['UPLOAD_FOLDER_ABSOLUTE'], exist_ok=True)
+# Nothing here touches the disk: the upload store, the job queue, the database pool and the
+# correction cache create their files on first use, so importing app (tests, pipeline.py,
+# the benchmark) leaves ketuvim.db and uploads/ alone
+upload_store = UploadStore(app.config['UPLOAD_FOLDER_ABSOLUTE'], thumbnail_size=THUMBNAIL_SIZE)
+
+slow_request_profiler = SlowRequestProfiler(PROFILE_DIR, enabled=PROFILE_SLOW_REQUESTS,
+                                            sample_rate=PROFILE_SAMPLE_RATE, threshold=PROFILE_THRESHOLD_SECONDS)
 
 # --- Load Models ---
-def load_nert_model(path):
+def load_nert_model(path, backend=NERT_BACKEND, timings=None, details=None):
+    """Loads tokenizer and model; details (a dict) gets the backend actually used and how the weights were loaded."""
     if not os.path.isdir(path):
         print(f"ERROR: NERT model directory not found at {path}")
         return None, None
+    timings = timings if timings is not None else {}
+    details = details if details is not None else {}
     try:
+        start = time.perf_counter()
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+        from inference_backend import configure_threads, prepare_model, warmup
+        from shared_weights import load_shared_model
+        timings['import_libraries'] = time.perf_counter() - start
+
+        intra_op, inter_op = configure_threads(NERT_INTRA_OP_THREADS, NERT_INTER_OP_THREADS)
+        start = time.perf_counter()
         tokenizer = AutoTokenizer.from_pretrained(path)
-        model = AutoModelForSeq2SeqLM.from_pretrained(path)
-        print(f"NERT model loaded successfully from {path}.")
+        timings['tokenizer'] = time.perf_counter() - start
+        start = time.perf_counter()
+        model = load_shared_model(path) if NERT_SHARED_WEIGHTS else None
+        shared = model is not None
+        if model is None:
+            model = AutoModelForSeq2SeqLM.from_pretrained(path)
+        timings['model'] = time.perf_counter() - start
+        print(f"NERT model loaded successfully from {path} ({'shared memory-mapped' if shared else 'private'} weights, "
+              f"{intra_op} intra-op / {inter_op} inter-op threads).")
+        start = time.perf_counter()
+        if backend == 'int8':
+            model, backend = select_int8_model(tokenizer, model)
+        else:
+            model = prepare_model(model, backend)
+        timings['backend'] = time.perf_counter() - start
+        details.update(backend=backend, shared_weights=shared, intra_op_threads=intra_op, inter_op_threads=inter_op)
+        if NERT_WARMUP:
+            timings['warmup'] = warmup(tokenizer, model)
         return tokenizer, model
     except ImportError:
         print("ERROR: transformers or torch library not found. Please install.")
@@ -40,32 +163,57 @@ def load_nert_model(path):
         print(f"ERROR loading NERT model/tokenizer: {e}")
         return None, None
 
-nert_tokenizer, nert_model = load_nert_model(NERT_MODEL_PATH)
-if not (nert_tokenizer and nert_model):
-    print("WARNING: NERT model failed to load. Correction functionality will be disabled.")
+def select_int8_model(tokenizer, float_model):
+    """Returns (model, backend): the int8 model, or the float32 one if they agree too rarely."""
+    from inference_backend import quantize_int8, compare_models
+    float_model.eval()
+    int8_model = quantize_int8(float_model)
+    report = compare_models(tokenizer, float_model, int8_model)
+    print(f"int8 NERT backend agrees with float32 on {report['agreement']:.1%} of {report['samples']} samples "
+          f"({report['speedup'] or 0:.2f}x faster).")
+    if report['agreement'] < NERT_INT8_MIN_AGREEMENT:
+        print("WARNING: int8 backend is below NERT_INT8_MIN_AGREEMENT, using float32 instead.")
+        return float_model, 'float32'
+    return int8_model, 'int8'
+
+def load_nert_bundle(timings):
+    """Loads everything correction needs: tokenizer, model, lexicon index and vocabulary trie."""
+    details = {}
+    tokenizer, model = load_nert_model(NERT_MODEL_PATH, timings=timings, details=details)
+    if not (tokenizer and model):
+        return None
+    start = time.perf_counter()
+    lexicon = load_lexicon_index(LEXICON_INDEX_PATH, LEXICON_VOCABULARY_PATH)
+    if lexicon is None:
+        print("WARNING: Lexicon index not available. Every word will be sent to the NERT model.")
+    timings['lexicon'] = time.perf_counter() - start
+    start = time.perf_counter()
+    trie = load_vocabulary_trie(NERT_TRIE_PATH, LEXICON_VOCABULARY_PATH, tokenizer, NERT_MODEL_PATH)
+    timings['trie'] = time.perf_counter() - start
+    return {'tokenizer': tokenizer, 'model': model, 'lexicon': lexicon, 'trie': trie, 'backend': details['backend']}
+
+nert_models = ModelManager(NERT_MODEL_PATH, load_nert_bundle,
+                           watch_paths=[LEXICON_VOCABULARY_PATH],
+                           watch_interval=NERT_WATCH_INTERVAL,
+                           retry_interval=NERT_RETRY_INTERVAL)
+nert_cache = CorrectionCache(NERT_CACHE_PATH, NERT_MODEL_PATH, max_memory_entries=NERT_CACHE_MEMORY_ENTRIES,
+                             check_interval=NERT_WATCH_INTERVAL)
 
 # --- Database Setup ---
+db_pool = ConnectionPool(DATABASE)
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = db_pool.acquire()
     return db
 
 def init_db():
     try:
-        db = sqlite3.connect(DATABASE)
-        cursor = db.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS transcriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_name TEXT UNIQUE NOT NULL,
-            input_text TEXT,
-            corrected_text TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )''')
-        db.commit()
+        db = connect(DATABASE)
+        version = migrate(db)
         db.close()
-        print("Database initialized.")
+        print(f"Database initialized (schema version {version}).")
     except sqlite3.Error as e:
         print(f"ERROR initializing database: {e}")
 
@@ -73,35 +221,65 @@ def init_db():
 def close_connection(exception):
     db = getattr(g, '_database', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
 # --- Database Operations ---
+def write_transcription(db, image_name, input_text, corrected_text, reviewed=False):
+    write_transcriptions(db, [(image_name, input_text, corrected_text)], reviewed=reviewed)
+
+def write_transcriptions(db, records, reviewed=False):
+    """Stores (image_name, input_text, corrected_text) records in a single transaction.
+
+    reviewed marks corrected texts a person saved; a later model correction of the page clears it.
+    """
+    # An upsert keeps the row id, which the search index is keyed on
+    sql = '''INSERT INTO transcriptions (image_name, input_text, corrected_text, timestamp, reviewed)
+             VALUES (?, ?, ?, ?, ?)
+             ON CONFLICT (image_name) DO UPDATE SET input_text = excluded.input_text,
+                 corrected_text = excluded.corrected_text, timestamp = excluded.timestamp,
+                 reviewed = excluded.reviewed'''
+    now = datetime.now()
+    with metrics.stage('db_commit'):
+        cursor = db.cursor()
+        try:
+            rows = [(image_name, input_text, corrected_text, now, int(reviewed))
+                    for image_name, input_text, corrected_text in records]
+            cursor.executemany(sql, rows)
+            index_terms(db, [text for row in rows for text in row[1:3]])
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
 def save_or_update_transcription(image_name, input_text, corrected_text):
-    sql = '''INSERT OR REPLACE INTO transcriptions (image_name, input_text, corrected_text, timestamp)
-             VALUES (?, ?, ?, ?)'''
+    """Stores a page a person corrected on the edit page."""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute(sql, (image_name, input_text, corrected_text, datetime.now()))
-        db.commit()
+        write_transcription(get_db(), image_name, input_text, corrected_text, reviewed=True)
     except sqlite3.Error as e:
         print(f"ERROR saving transcription for {image_name}: {e}")
         flash(f"Database error saving transcription for {image_name}.", "error")
 
-def get_transcription_data(image_name=None):
+def get_transcription_data(image_name):
     try:
         db = get_db()
         cursor = db.cursor()
-        if image_name:
-            cursor.execute('SELECT image_name, input_text, corrected_text, timestamp FROM transcriptions WHERE image_name = ?', (image_name,))
-            return cursor.fetchone()
-        else:
-            cursor.execute('SELECT image_name, input_text, corrected_text, timestamp FROM transcriptions ORDER BY timestamp DESC')
-            return cursor.fetchall()
+        cursor.execute('SELECT image_name, input_text, corrected_text, timestamp FROM transcriptions WHERE image_name = ?', (image_name,))
+        return cursor.fetchone()
     except sqlite3.Error as e:
         print(f"ERROR fetching transcription data: {e}")
         flash("Database error fetching transcription data.", "error")
-        return None if image_name else []
+        return None
+
+def get_transcription_page(limit=HISTORY_PAGE_SIZE, cursor=None):
+    """Returns (rows, next_cursor) for one page of the history, newest first."""
+    return list_transcriptions(get_db(), limit=limit, cursor=cursor)
+
+def page_size_arg():
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+    return max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
 
 # --- Helper Functions ---
 def allowed_file(filename):
@@ -109,39 +287,309 @@ def allowed_file(filename):
            os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS
 
 # --- NERT Processing Function ---
-def run_nert_corrector(text, tokenizer, model):
+# A word is a run of letters, optionally joined by hyphens or apostrophes (e.g. "Йом-Кипур").
+# Everything between words (spaces, newlines, digits, punctuation) is kept verbatim.
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:[-'][^\W\d_]+)*")
+
+def split_into_spans(text):
+    """Splits text into (is_word, chunk) pieces that join back into the original text."""
+    spans = []
+    position = 0
+    for match in WORD_PATTERN.finditer(text):
+        if match.start() > position:
+            spans.append((False, text[position:match.start()]))
+        spans.append((True, match.group()))
+        position = match.end()
+    if position < len(text):
+        spans.append((False, text[position:]))
+    return spans
+
+def correct_spans(spans, tokenizer, model, batch_size=NERT_BATCH_SIZE, trie=None, policy=None):
+    """Runs unique spans through the model in padded batches and returns {span: correction}.
+
+    With a vocabulary trie, beams may only produce vocabulary spellings.
+    """
+    policy = policy or NERT_DECODING_POLICY
+    prefix_tokens = len(tokenizer(NERT_TASK_PREFIX, add_special_tokens=False)['input_ids'])
+    # Sorting by length keeps spans of similar size together, so batches carry little padding
+    unique_spans = sorted(set(spans), key=len)
+    corrections = {}
+    for start in range(0, len(unique_spans), batch_size):
+        batch = unique_spans[start:start + batch_size]
+        with metrics.stage('tokenize'):
+            inputs = tokenizer(
+                [NERT_TASK_PREFIX + span for span in batch],
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=NERT_SPAN_MAX_LENGTH
+            )
+        decoded, paths = decode_batch(tokenizer, model, inputs, policy, prefix_tokens=prefix_tokens, trie=trie)
+        for span, corrected in zip(batch, decoded):
+            corrections[span] = corrected.strip() or span
+        log_decoding_paths(batch, paths, policy)
+    return corrections
+
+def log_decoding_paths(spans, paths, policy):
+    beam_spans = [span for span, path in zip(spans, paths) if path == 'beam']
+    if policy.strategy == 'adaptive' and beam_spans:
+        print(f"NERT decoding: {len(spans) - len(beam_spans)} greedy, {len(beam_spans)} escalated to beam search: "
+              f"{', '.join(beam_spans)}")
+    elif NERT_LOG_DECODING:
+        print(f"NERT decoding: {len(spans)} span(s) via {paths[0] if paths else policy.strategy}")
+
+def span_config_key(trie=None, policy=None):
+    """Cache key of a decoding configuration; constrained entries are tied to the vocabulary the trie came from."""
+    policy = policy or NERT_DECODING_POLICY
+    constrained = trie.fingerprint if trie is not None and trie.fingerprint else trie is not None
+    return f"spans|{NERT_BACKEND}|{policy.key()}|constrained={constrained}"
+
+def run_micro_batch(key, spans):
+    tokenizer, model, trie, policy = key
+    metrics.observe('batcher_batch_size', len(spans))
+    return correct_spans(spans, tokenizer, model, trie=trie, policy=policy)
+
+nert_batcher = MicroBatcher(run_micro_batch, max_batch_size=NERT_BATCH_SIZE, window=NERT_BATCH_WINDOW_MS / 1000)
+
+def correct_text_by_spans(text, tokenizer, model, cache=None, lexicon=None, trie=None, batcher=None, policy=None):
+    return correct_texts_by_spans([text], tokenizer, model, cache=cache, lexicon=lexicon, trie=trie,
+                                  batcher=batcher, policy=policy)[0]
+
+def correct_texts_by_spans(texts, tokenizer, model, cache=None, lexicon=None, trie=None, batcher=None, policy=None):
+    """Corrects several texts at once; words shared between them are looked up and decoded once."""
+    texts_spans = [split_into_spans(text) for text in texts]
+    words = {normalize_span(chunk) for spans in texts_spans for is_word, chunk in spans if is_word}
+    if not words:
+        return list(texts)
+    if lexicon:
+        corrections, words = lexicon.resolve_many(words)
+    else:
+        corrections = {}
+    config_key = span_config_key(trie=trie, policy=policy)
+    if cache and words:
+        corrections.update(cache.get_many(list(words), config_key))
+    missing = [word for word in words if word not in corrections]
+    if missing:
+        if batcher:
+            new_corrections = batcher.submit((tokenizer, model, trie, policy), missing)
+        else:
+            new_corrections = correct_spans(missing, tokenizer, model, trie=trie, policy=policy)
+        if cache:
+            cache.put_many(new_corrections, config_key)
+        corrections.update(new_corrections)
+    return [''.join(corrections[normalize_span(chunk)] if is_word else chunk for is_word, chunk in spans)
+            for spans in texts_spans]
+
+def correct_full_text(text, tokenizer, model, policy=None):
+    policy = policy or NERT_DECODING_POLICY
+    prefix_tokens = len(tokenizer(NERT_TASK_PREFIX, add_special_tokens=False)['input_ids'])
+    input_text_with_prefix = NERT_TASK_PREFIX + text
+    with metrics.stage('tokenize'):
+        inputs = tokenizer(input_text_with_prefix, return_tensors="pt", truncation=True, max_length=NERT_FULL_TEXT_MAX_LENGTH)
+
+    # device = model.device
+    # inputs = {k: v.to(device) for k, v in inputs.items()}
+
+    decoded, paths = decode_batch(tokenizer, model, inputs, policy, prefix_tokens=prefix_tokens,
+                                  length_cap=NERT_FULL_TEXT_MAX_LENGTH)
+    print(f"NERT decoding: full text ({int(inputs['attention_mask'].sum())} tokens) via {paths[0]}")
+    return decoded[0]
+
+def run_nert_corrector(text, tokenizer, model, mode=None, constrained=None, lexicon=None, vocabulary_trie=None,
+                       policy=None):
     if not text or not tokenizer or not model:
         return text if text else ""
+    return run_nert_corrector_batch([text], tokenizer, model, mode=mode, constrained=constrained, lexicon=lexicon,
+                                    vocabulary_trie=vocabulary_trie, policy=policy)[0]
+
+def run_nert_corrector_batch(texts, tokenizer, model, mode=None, constrained=None, lexicon=None, vocabulary_trie=None,
+                             policy=None):
+    """run_nert_corrector for many texts; in 'spans' mode their words go through the model together."""
+    if not tokenizer or not model:
+        return [text or "" for text in texts]
+    mode = mode or NERT_CORRECTION_MODE
+    policy = policy or NERT_DECODING_POLICY
+    if constrained is None:
+        constrained = NERT_CONSTRAINED_DECODING
+    if constrained and vocabulary_trie is None:
+        print("WARNING: Constrained decoding requested but no vocabulary trie is loaded.")
     try:
-        input_text_with_prefix = "correct: " + text
-        inputs = tokenizer(input_text_with_prefix, return_tensors="pt", truncation=True, max_length=512)
-
-        # device = model.device
-        # inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-             outputs = model.generate(
-                 inputs['input_ids'],
-                 max_length=512,
-                 num_beams=4,
-                 early_stopping=True
-             )
-        corrected_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return corrected_text
+        if mode == 'full':
+            return [correct_full_text(text, tokenizer, model, policy=policy) if text else "" for text in texts]
+        trie = vocabulary_trie if constrained else None
+        batcher = nert_batcher if NERT_MICRO_BATCHING else None
+        return correct_texts_by_spans([text or "" for text in texts], tokenizer, model, cache=nert_cache,
+                                      lexicon=lexicon, trie=trie, batcher=batcher, policy=policy)
     except Exception as e:
         print(f"ERROR during NERT correction: {e}")
-        return text # Return original text on error
+        metrics.inc('errors_total', stage='correction')
+        return [text or "" for text in texts] # Return original text on error
+
+# --- Background Correction Jobs ---
+def request_policy(decoding):
+    """The decoding policy a request asked for, within NERT_DECODING_LIMITS; raises ValueError if invalid."""
+    return DecodingPolicy.from_options(decoding, default=NERT_DECODING_POLICY, limits=NERT_DECODING_LIMITS)
+
+def process_job(image_name, input_text, options):
+    with slow_request_profiler.profile(f"job_{image_name}"), metrics.stage('job'):
+        return run_job(image_name, input_text, options)
+
+def run_job(image_name, input_text, options):
+    """Runs in a job worker thread, outside any request, so it opens its own connection."""
+    bundle = nert_models.get()
+    if not bundle:
+        raise RuntimeError("NERT model is not loaded.")
+    policy = request_policy(options.get('decoding'))
+    corrected_text = run_nert_corrector(input_text, bundle['tokenizer'], bundle['model'],
+                                        mode=options.get('mode'), constrained=options.get('constrained'),
+                                        lexicon=bundle['lexicon'], vocabulary_trie=bundle['trie'],
+                                        policy=policy)
+    db = connect(DATABASE)
+    try:
+        write_transcription(db, image_name, input_text, corrected_text)
+    finally:
+        db.close()
+    return corrected_text
+
+job_queue = JobQueue(DATABASE, process_job, num_workers=NERT_JOB_WORKERS,
+                     retention_seconds=NERT_JOB_RETENTION_DAYS * 24 * 3600)
+
+def wants_json():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
+
+# --- Bulk Correction ---
+def read_archive_records(upload):
+    """Record dicts from an uploaded .zip of <image_name>.txt files or a .jsonl/.ndjson/.json file.
+
+    The upload is read here, while the request is open: the streamed response is produced
+    after Flask has closed the request's files.
+    """
+    name = upload.filename.lower()
+    data = upload.read()
+    if name.endswith('.zip'):
+        return zip_records(zipfile.ZipFile(io.BytesIO(data)))
+    elif name.endswith(('.jsonl', '.ndjson')):
+        return read_ndjson_records(io.BytesIO(data))
+    elif name.endswith('.json'):
+        return json_records(json.loads(data))
+    raise ValueError("Unsupported archive type. Upload a .zip of .txt files, or a .jsonl/.ndjson/.json file.")
+
+def zip_records(archive):
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.txt'):
+                continue
+            image_name = os.path.basename(info.filename)[:-len('.txt')]
+            yield {'image_name': image_name, 'input_text': archive.read(info).decode('utf-8-sig')}
+
+def read_ndjson_records(stream):
+    for line_number, line in enumerate(stream, start=1):
+        line = line.decode('utf-8') if isinstance(line, bytes) else line
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield {'error': f"line {line_number}: invalid JSON ({e})"}
+
+def json_records(payload):
+    records = payload.get('records') if isinstance(payload, dict) else payload
+    if not isinstance(records, list):
+        raise ValueError("Expected a list of records or an object with a 'records' list.")
+    return iter(records)
+
+def bulk_request_records():
+    if 'archive' in request.files:
+        return read_archive_records(request.files['archive'])
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return read_ndjson_records(request.stream)
+    payload = request.get_json(silent=True)
+    if payload is None:
+        raise ValueError("Send JSON records, an NDJSON body or an 'archive' file upload.")
+    return json_records(payload)
+
+def bulk_request_options():
+    payload = request.get_json(silent=True) if request.is_json else None
+    options = payload if isinstance(payload, dict) else {}
+    decoding = options.get('decoding')
+    if decoding is None:
+        decoding = {'strategy': request.args.get('decoding_strategy') or request.form.get('decoding_strategy')}
+    save = options.get('save', request.args.get('save', request.form.get('save', 'true')))
+    return decoding, str(save).lower() not in ('0', 'false', 'no')
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_bulk_corrections(records, bundle, policy, save):
+    """Corrects records chunk by chunk and yields one NDJSON line per record, then a summary line."""
+    started = time.perf_counter()
+    counts = {'records': 0, 'corrected': 0, 'failed': 0}
+    db = connect(DATABASE) if save else None
+    try:
+        for chunk in chunked(records, BULK_CHUNK_SIZE):
+            valid = []
+            for record in chunk:
+                counts['records'] += 1
+                error = record.get('error') if isinstance(record, dict) else "record is not an object"
+                image_name = secure_filename(str(record.get('image_name') or '')) if not error else ''
+                input_text = record.get('input_text') if not error else None
+                if not error and not image_name:
+                    error = "missing image_name"
+                elif not error and not isinstance(input_text, str):
+                    error = "missing input_text"
+                if error:
+                    counts['failed'] += 1
+                    yield json.dumps({'status': 'error', 'image_name': image_name or None, 'error': error},
+                                     ensure_ascii=False) + '\n'
+                    continue
+                valid.append((image_name, input_text.strip()))
+
+            corrected = run_nert_corrector_batch([text for _, text in valid], bundle['tokenizer'], bundle['model'],
+                                                 lexicon=bundle['lexicon'], vocabulary_trie=bundle['trie'],
+                                                 policy=policy)
+            rows = [(image_name, text, corrected_text) for (image_name, text), corrected_text in zip(valid, corrected)]
+            status, error = 'ok', None
+            if save and rows:
+                try:
+                    write_transcriptions(db, rows)
+                except sqlite3.Error as e:
+                    print(f"ERROR saving bulk transcriptions: {e}")
+                    status, error = 'error', f"database error: {e}"
+            for image_name, _, corrected_text in rows:
+                counts['corrected' if status == 'ok' else 'failed'] += 1
+                line = {'status': status, 'image_name': image_name, 'corrected_text': corrected_text}
+                if error:
+                    line['error'] = error
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+    except (ValueError, zipfile.BadZipFile) as e:
+        # Raised while reading the records (e.g. a broken archive); earlier results were already sent
+        yield json.dumps({'status': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+    finally:
+        if db is not None:
+            db.close()
+    elapsed = time.perf_counter() - started
+    counts['seconds'] = round(elapsed, 3)
+    counts['records_per_second'] = round(counts['records'] / elapsed, 2) if elapsed else None
+    yield json.dumps({'summary': counts}) + '\n'
 
 # --- Flask Routes ---
 @app.route('/')
 def index():
     return render_template('main.html', page_title="Process Image and Text")
 
-# *** RENAMED FUNCTION HERE ***
 @app.route('/process', methods=['POST'])
-def process(): # Renamed from process_submission
-    if not (nert_tokenizer and nert_model):
-        flash("NERT model is not loaded, cannot process text.", "error")
+def process():
+    # A model that is still loading is fine: the job waits for it in the background
+    if nert_models.state == 'failed':
+        flash(f"NERT model is not loaded, cannot process text. ({nert_models.error})", "error")
         return redirect(url_for('index'))
 
     if 'image' not in request.files:
@@ -159,17 +607,30 @@ def process(): # Renamed from process_submission
         flash('No input text provided.', 'error')
         return redirect(url_for('index'))
 
+    # Optional per-request decoding settings, e.g. decoding_strategy=beam
+    decoding = {
+        'strategy': request.form.get('decoding_strategy'),
+        'num_beams': request.form.get('num_beams'),
+        'confidence_threshold': request.form.get('confidence_threshold'),
+    }
+    try:
+        request_policy(decoding)
+    except ValueError as e:
+        flash(f"Invalid decoding settings: {e}", 'error')
+        return redirect(url_for('index'))
+
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         try:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER_ABSOLUTE'], filename)
-            file.save(image_path)
-
-            corrected_text = run_nert_corrector(input_text, nert_tokenizer, nert_model)
-            save_or_update_transcription(filename, input_text, corrected_text)
+            # The same scan is stored once; another scan with a taken name gets a new name
+            with metrics.stage('file_save'):
+                filename, _ = upload_store.save(file.stream, filename, get_db())
 
-            # Redirect using the correct function name for the edit page route
-            return redirect(url_for('edit_page', filename=filename))
+            # Correction runs in the background; the client polls the job until it is done
+            job_id = job_queue.submit(filename, input_text, options={'decoding': decoding})
+            if wants_json():
+                return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+            return redirect(url_for('job_page', job_id=job_id))
 
         except Exception as e:
             print(f"ERROR during file saving or NERT processing: {e}")
@@ -179,6 +640,42 @@ def process(): # Renamed from process_submission
         flash('Invalid file type. Allowed types: png, jpg, jpeg.', 'error')
         return redirect(url_for('index'))
 
+@app.route('/api/correct/batch', methods=['POST'])
+def correct_batch():
+    """Corrects many (image_name, input_text) records and streams the results back as NDJSON."""
+    try:
+        records = bulk_request_records()
+        decoding, save = bulk_request_options()
+        policy = request_policy(decoding)
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify(success=False, message=str(e)), 400
+    bundle = nert_models.get()
+    if not bundle:
+        return jsonify(success=False, message="NERT model is not loaded."), 503
+    return Response(stream_with_context(stream_bulk_corrections(records, bundle, policy, save)),
+                    mimetype='application/x-ndjson')
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        flash(f"No processing job found: {job_id}", "error")
+        return redirect(url_for('index'))
+    if job['status'] == 'done':
+        return redirect(url_for('edit_page', filename=job['image_name']))
+    return render_template('job.html',
+                           job=job,
+                           page_title=f"Processing {job['image_name']}")
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify(success=False, message=f"No processing job found: {job_id}"), 404
+    if job['status'] == 'done':
+        job['edit_url'] = url_for('edit_page', filename=job['image_name'])
+    return jsonify(success=True, **job)
+
 @app.route('/edit/<filename>')
 def edit_page(filename):
     entry = get_transcription_data(image_name=filename)
@@ -188,6 +685,7 @@ def edit_page(filename):
 
     return render_template('edit.html',
                            image_name=entry['image_name'],
+                           has_overlay=os.path.isfile(os.path.join(overlay_dir(entry['image_name']), OVERLAY_MANIFEST)),
                            input_text=entry['input_text'],
                            corrected_text=entry['corrected_text'],
                            page_title=f"ketuvim_nert for {entry['image_name']}")
@@ -213,25 +711,268 @@ def save_edited():
 
 @app.route('/history')
 def history():
-    transcriptions = get_transcription_data()
+    cursor = request.args.get('before')
+    try:
+        transcriptions, next_cursor = get_transcription_page(limit=page_size_arg(), cursor=cursor)
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for('history'))
+    except sqlite3.Error as e:
+        print(f"ERROR fetching transcription history: {e}")
+        flash("Database error fetching transcription data.", "error")
+        transcriptions, next_cursor = [], None
     return render_template('history.html',
                             transcriptions=transcriptions,
+                            next_cursor=next_cursor,
+                            is_first_page=not cursor,
                             page_title="Transcription History")
 
+@app.route('/api/history')
+def history_api():
+    try:
+        rows, next_cursor = get_transcription_page(limit=page_size_arg(), cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    except sqlite3.Error as e:
+        print(f"ERROR fetching transcription history: {e}")
+        return jsonify(success=False, message="Database error fetching transcription data."), 500
+    return jsonify(success=True,
+                   items=[dict(row) for row in rows],
+                   next_cursor=next_cursor,
+                   next_url=url_for('history_api', cursor=next_cursor, limit=page_size_arg()) if next_cursor else None)
+
+def search_args():
+    return (request.args.get('q', '').strip(),
+            request.args.get('fuzzy', '') in ('1', 'true', 'on'),
+            request.args.get('field', 'all'))
+
+@app.route('/search')
+def search():
+    query, fuzzy, field = search_args()
+    cursor = request.args.get('before')
+    items, next_cursor, expansions = [], None, {}
+    if query:
+        try:
+            items, next_cursor, expansions = search_transcriptions(get_db(), query, fuzzy=fuzzy, field=field,
+                                                                   limit=page_size_arg(), cursor=cursor)
+        except ValueError as e:
+            flash(str(e), "error")
+        except sqlite3.Error as e:
+            print(f"ERROR searching transcriptions: {e}")
+            flash("Database error searching transcriptions.", "error")
+    return render_template('search.html',
+                            query=query, fuzzy=fuzzy, field=field,
+                            items=items,
+                            expansions=expansions,
+                            next_cursor=next_cursor,
+                            is_first_page=not cursor,
+                            page_title="Search Transcriptions")
+
+@app.route('/api/search')
+def search_api():
+    query, fuzzy, field = search_args()
+    try:
+        items, next_cursor, expansions = search_transcriptions(get_db(), query, fuzzy=fuzzy, field=field,
+                                                               limit=page_size_arg(), cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    except sqlite3.Error as e:
+        print(f"ERROR searching transcriptions: {e}")
+        return jsonify(success=False, message="Database error searching transcriptions."), 500
+    return jsonify(success=True,
+                   items=items,
+                   expansions=expansions,
+                   next_cursor=next_cursor,
+                   next_url=url_for('search_api', q=query, fuzzy=int(fuzzy), field=field, cursor=next_cursor,
+                                    limit=page_size_arg()) if next_cursor else None)
+
+@app.route('/api/export/corrections')
+def export_corrections():
+    """Streams the reviewed (input_text, corrected_text) pairs as JSONL or Parquet, changed words only by default."""
+    file_format = request.args.get('format', 'jsonl')
+    granularity = request.args.get('granularity', 'words')
+    align = request.args.get('alignment', '1') not in ('0', 'false')
+    if file_format not in corpus_export.FORMATS or granularity not in corpus_export.GRANULARITIES:
+        return jsonify(success=False, message="format must be jsonl or parquet, granularity pages or words."), 400
+    if file_format == 'parquet':
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            return jsonify(success=False, message="Parquet export needs pyarrow on the server."), 400
+
+    def generate():
+        # A connection of its own: the response outlives the request's pooled connection
+        db = connect(DATABASE)
+        try:
+            batches = corpus_export.export_batches(
+                db, granularity=granularity, since=request.args.get('since'),
+                reviewed_only=request.args.get('include_unreviewed', '') not in ('1', 'true'),
+                changed_only=request.args.get('changed_only', '1') not in ('0', 'false'), align=align)
+            if file_format == 'parquet':
+                yield from corpus_export.parquet_chunks(batches, granularity, align)
+            else:
+                yield from corpus_export.jsonl_chunks(batches)
+        finally:
+            db.close()
+
+    mimetype = 'application/vnd.apache.parquet' if file_format == 'parquet' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=ketuvim_corrections_{granularity}.{file_format}'})
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(nert_cache.stats())
+
+@app.route('/lexicon/stats')
+def lexicon_stats():
+    bundle = nert_models.bundle
+    if not bundle or bundle['lexicon'] is None:
+        return jsonify(loaded=False)
+    return jsonify(loaded=True, **bundle['lexicon'].stats())
+
+@app.route('/decoding/stats')
+def decoding_stats_view():
+    return jsonify(policy=NERT_DECODING_POLICY._asdict(), paths=decoding_stats())
+
+@app.route('/health')
+def health():
+    bundle = nert_models.bundle
+    return jsonify(status='ok', model=nert_models.status(), backend=bundle['backend'] if bundle else None,
+                   startup=STARTUP_TIMINGS)
+
+@app.route('/ready')
+def ready():
+    status = nert_models.status()
+    return jsonify(ready=status['ready'], state=status['state']), 200 if status['ready'] else 503
+
+@app.route('/batching/stats')
+def batching_stats():
+    return jsonify(nert_batcher.stats())
+
+def cached_image_response(path, etag, max_age, immutable=False):
+    response = send_file(path, etag=etag, max_age=max_age, conditional=True)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+def legacy_image_path(filename):
+    path = os.path.join(app.config['UPLOAD_FOLDER_ABSOLUTE'], secure_filename(filename))
+    return path if os.path.isfile(path) else None
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
+    stored = upload_store.lookup(get_db(), filename)
+    if stored:
+        path, sha256 = stored
+        return cached_image_response(path, sha256, IMAGE_CACHE_MAX_AGE, immutable=True)
     try:
-        return send_from_directory(app.config['UPLOAD_FOLDER_ABSOLUTE'], filename)
+        return send_from_directory(app.config['UPLOAD_FOLDER_ABSOLUTE'], filename, max_age=LEGACY_IMAGE_CACHE_MAX_AGE)
     except FileNotFoundError:
         return "File not found", 404
 
+@app.route('/thumbnails/<filename>')
+def thumbnail(filename):
+    row = get_db().execute('SELECT sha256, extension FROM uploads WHERE image_name = ?', (filename,)).fetchone()
+    try:
+        if row is not None:
+            key = row['sha256']
+            path = upload_store.get_thumbnail(key, extension=row['extension'])
+        else:
+            source = legacy_image_path(filename)
+            if source is None:
+                return "File not found", 404
+            stat = os.stat(source)
+            key = 'legacy_' + hashlib.sha1(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')).hexdigest()[:16]
+            path = upload_store.get_thumbnail(key, source=source)
+    except Exception as e:
+        print(f"ERROR creating thumbnail for {filename}: {e}")
+        metrics.inc('errors_total', stage='thumbnail')
+        return redirect(url_for('uploaded_file', filename=filename))
+    return cached_image_response(path, f"{key}-{THUMBNAIL_SIZE}", IMAGE_CACHE_MAX_AGE, immutable=row is not None)
+
+def overlay_dir(image_name):
+    return os.path.join(os.path.abspath(OVERLAY_FOLDER), secure_filename(os.path.splitext(image_name)[0]))
+
+@app.route('/overlays/<filename>/pyramid.json')
+def overlay_manifest(filename):
+    directory = overlay_dir(filename)
+    if not os.path.isfile(os.path.join(directory, OVERLAY_MANIFEST)):
+        return jsonify(success=False, message=f"No segmentation overlay for {filename}"), 404
+    return send_from_directory(directory, OVERLAY_MANIFEST, max_age=OVERLAY_CACHE_MAX_AGE)
+
+@app.route('/overlays/<filename>/<int:level>/<tile>')
+def overlay_tile(filename, level, tile):
+    # send_from_directory refuses tile names that would leave the level directory
+    try:
+        return send_from_directory(os.path.join(overlay_dir(filename), str(level)), tile, max_age=OVERLAY_CACHE_MAX_AGE)
+    except FileNotFoundError:
+        return "Tile not found", 404
+
+@app.route('/metrics')
+def metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_model_loading():
+    nert_models.start()
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(g, '_request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unknown'
+        metrics.inc('requests_total', endpoint=endpoint, status=response.status_code)
+        # Observed once the body is sent: streamed responses (bulk correction, exports) do their work after this
+        response.call_on_close(lambda: metrics.observe('request_duration_seconds', time.perf_counter() - started,
+                                                       endpoint=endpoint))
+    return response
+
+def collect_component_metrics():
+    """Read at scrape time: cache, micro-batcher, decoding paths, model and job queue state."""
+    samples = []
+    # Only counters kept in memory and queries on small indexed sets: a scrape must not scan
+    # the cache file or the job history
+    cache = nert_cache.stats(count_disk=False)
+    for name in ('memory_hits', 'disk_hits', 'misses', 'evictions', 'invalidations', 'errors'):
+        samples.append(('cache_events_total', 'counter', {'event': name}, cache[name]))
+    samples.append(('cache_entries', 'gauge', {'tier': 'memory'}, cache['memory_entries']))
+    batching = nert_batcher.stats()
+    samples.append(('batcher_queue_depth', 'gauge', {}, batching['queue_depth']))
+    samples.append(('batcher_batches_total', 'counter', {}, batching['batches']))
+    samples.append(('batcher_spans_total', 'counter', {}, batching['spans']))
+    for path, count in decoding_stats().items():
+        samples.append(('decoding_spans_total', 'counter', {'path': path}, count))
+    samples.append(('model_ready', 'gauge', {}, 1 if nert_models.is_ready() else 0))
+    for status, count in job_queue.active_counts().items():
+        samples.append(('jobs', 'gauge', {'status': status}, count))
+    for event, count in job_queue.event_counts().items():
+        samples.append(('job_events_total', 'counter', {'event': event}, count))
+    return samples
+
+metrics.add_collector(collect_component_metrics)
+
+app.wsgi_app = slow_request_profiler.wrap_wsgi(app.wsgi_app)
+
+STARTUP_TIMINGS = {'app_import': time.perf_counter() - STARTUP_BEGAN}
+
 # --- Main Execution Block ---
 if __name__ == '__main__':
     print("Initializing database...")
+    start = time.perf_counter()
     init_db()
-
-    if not (nert_tokenizer and nert_model):
-        print("WARNING: NERT model not loaded. Check errors above.")
+    STARTUP_TIMINGS['init_db'] = time.perf_counter() - start
+
+    # The reloader's parent process only watches files; load the model and run jobs in the serving process
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        print("Loading NERT model in the background...")
+        nert_models.start()
+        # Jobs queued before a restart are picked up without waiting for the next submit or poll
+        job_queue.start()
 
     print("Starting Flask development server...")
     app.run(debug=True, host='127.0.0.1', port=5000)
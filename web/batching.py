@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+def histogram_bucket(value):
+    """Upper bound of the power-of-two bucket that value falls in (1, 2, 4, 8, ...)."""
+    bucket = 1
+    while bucket < value:
+        bucket *= 2
+    return bucket
+
+
+class MicroBatcher:
+    """Collects spans from every in-flight request and runs them through the model as shared batches.
+
+    A batch is started once max_batch_size unique spans are waiting, or window seconds
+    after the first span arrived. Spans are only batched with spans that share the same
+    decoding key, and a span requested by several callers is decoded once.
+    """
+
+    def __init__(self, run_batch, max_batch_size=32, window=0.01):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stats_lock = threading.Lock()
+        self.batch_sizes = {}
+        self.queue_depths = {}
+        self.batches = 0
+        self.spans = 0
+        self.max_queue_depth = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="nert-micro-batcher", daemon=True)
+                self.thread.start()
+
+    def submit(self, key, spans):
+        """Blocks until every span is corrected and returns {span: correction}."""
+        futures = {}
+        with self.condition:
+            for span in spans:
+                if span not in futures:
+                    futures[span] = Future()
+                    self.pending.append((key, span, futures[span]))
+            self.condition.notify()
+        self.start()
+        return {span: future.result() for span, future in futures.items()}
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = time.monotonic() + self.window
+            while len(self.pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            depth = len(self.pending)
+            key = self.pending[0][0]
+            batch = {}
+            rest = deque()
+            for item in self.pending:
+                item_key, span, future = item
+                if item_key == key and (span in batch or len(batch) < self.max_batch_size):
+                    batch.setdefault(span, []).append(future)
+                else:
+                    rest.append(item)
+            self.pending = rest
+        return key, batch, depth
+
+    def _loop(self):
+        while True:
+            key, batch, depth = self._next_batch()
+            self._record(len(batch), depth)
+            try:
+                corrections = self.run_batch(key, list(batch))
+            except Exception as e:
+                for futures in batch.values():
+                    for future in futures:
+                        future.set_exception(e)
+                continue
+            for span, futures in batch.items():
+                for future in futures:
+                    future.set_result(corrections.get(span, span))
+
+    def _record(self, batch_size, depth):
+        with self.stats_lock:
+            self.batches += 1
+            self.spans += batch_size
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            size_bucket = histogram_bucket(batch_size)
+            depth_bucket = histogram_bucket(depth)
+            self.batch_sizes[size_bucket] = self.batch_sizes.get(size_bucket, 0) + 1
+            self.queue_depths[depth_bucket] = self.queue_depths.get(depth_bucket, 0) + 1
+
+    def stats(self):
+        with self.condition:
+            queue_depth = len(self.pending)
+        with self.stats_lock:
+            return {
+                'queue_depth': queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'batches': self.batches,
+                'spans': self.spans,
+                'mean_batch_size': self.spans / self.batches if self.batches else 0.0,
+                'batch_size_histogram': {f"le_{bucket}": count for bucket, count in sorted(self.batch_sizes.items())},
+                'queue_depth_histogram': {f"le_{bucket}": count for bucket, count in sorted(self.queue_depths.items())},
+                'max_batch_size': self.max_batch_size,
+                'window_ms': self.window * 1000,
+            }
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import pickle
+
+from lexicon import read_vocabulary
+
+VOCABULARY_TRIE_VERSION = 1
+
+
+class VocabularyTrie:
+    """Token-prefix trie over the tokenized vocabulary, for use as generate(prefix_allowed_tokens_fn=...).
+
+    Every entry ends with the EOS token, so a beam can only finish on a complete
+    vocabulary spelling and finishes as soon as it has produced one.
+    """
+
+    def __init__(self, token_sequences, eos_token_id):
+        self.root = {}
+        self.eos_token_id = eos_token_id
+        self.fingerprint = None  # of the vocabulary and tokenizer it was built from, set by load_vocabulary_trie
+        self.max_depth = 0
+        self.entries = 0
+        for sequence in token_sequences:
+            node = self.root
+            for token_id in sequence:
+                node = node.setdefault(token_id, {})
+            self.max_depth = max(self.max_depth, len(sequence))
+            self.entries += 1
+
+    def allowed_tokens(self, prefix):
+        node = self.root
+        for token_id in prefix:
+            node = node.get(token_id)
+            if node is None:
+                return [self.eos_token_id]
+        return list(node.keys()) or [self.eos_token_id]
+
+    def prefix_allowed_tokens_fn(self):
+        def allowed(batch_id, input_ids):
+            # The decoder input starts with decoder_start_token_id, which is not part of the trie
+            return self.allowed_tokens(input_ids[1:].tolist())
+        return allowed
+
+
+def trie_fingerprint(csv_path, model_dir):
+    digest = hashlib.sha1()
+    with open(csv_path, 'rb') as f:
+        digest.update(f.read())
+    spiece_path = os.path.join(model_dir, 'spiece.model')
+    if os.path.isfile(spiece_path):
+        with open(spiece_path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build_vocabulary_trie(csv_path, tokenizer, batch_size=1000):
+    vocabulary = sorted(set(read_vocabulary(csv_path)))
+    sequences = []
+    for start in range(0, len(vocabulary), batch_size):
+        encoded = tokenizer(vocabulary[start:start + batch_size], add_special_tokens=True)
+        sequences.extend(encoded['input_ids'])
+    return VocabularyTrie(sequences, tokenizer.eos_token_id)
+
+
+def load_vocabulary_trie(trie_path, csv_path, tokenizer, model_dir):
+    """Loads the cached trie, or builds it with the NERT tokenizer and caches it on disk."""
+    if not (csv_path and os.path.isfile(csv_path)):
+        return None
+    fingerprint = trie_fingerprint(csv_path, model_dir)
+    if os.path.isfile(trie_path):
+        try:
+            with open(trie_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == VOCABULARY_TRIE_VERSION and data.get('fingerprint') == fingerprint:
+                data['trie'].fingerprint = fingerprint
+                print(f"Vocabulary trie loaded from {trie_path} ({data['trie'].entries} entries).")
+                return data['trie']
+        except Exception as e:
+            print(f"ERROR loading vocabulary trie from {trie_path}: {e}")
+    try:
+        trie = build_vocabulary_trie(csv_path, tokenizer)
+        trie.fingerprint = fingerprint
+        with open(trie_path, 'wb') as f:
+            pickle.dump({'version': VOCABULARY_TRIE_VERSION, 'fingerprint': fingerprint, 'trie': trie},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        print(f"Vocabulary trie with {trie.entries} entries saved to {trie_path}.")
+        return trie
+    except Exception as e:
+        print(f"ERROR building vocabulary trie from {csv_path}: {e}")
+        return None
@@ -0,0 +1,278 @@
+"""Streams the human-corrected transcriptions out of ketuvim.db as training pairs for ketuvim_nert.
+
+Rows are read in keyset batches ordered by (timestamp, id), so neither the export nor a slow
+HTTP client ever holds more than one batch in memory or keeps a read transaction open for
+the whole table. Only pages a volunteer saved from the edit page are exported unless
+reviewed_only=False.
+
+By default each record is one changed word pair, the size of what ketuvim_nert is trained on
+(max_len 32 tokens); page records are far longer and get truncated if trained on as they are,
+so --granularity pages is meant for inspection or for the alignment they carry.
+
+    python corpus_export.py ketuvim.db -o corrections.jsonl
+    python corpus_export.py ketuvim.db -o new.parquet --since '2026-10-01 00:00:00'
+
+Each record carries its timestamp; pass the last one as --since to export only what was
+saved after it. training/ketuvim_nert_training.py reads either format (corrections_file).
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+from difflib import SequenceMatcher
+
+# The word spans app.py corrects, so aligned pairs look like the model's inputs
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:[-'][^\W\d_]+)*")
+MIN_SIMILARITY = 0.5  # character similarity below which two words are not a correction of each other
+MAX_BLOCK_WORDS = 40  # longer rewritten stretches are left out of the word pairs (the alignment is quadratic)
+EXPORT_BATCH_SIZE = 500
+FORMATS = ('jsonl', 'parquet')
+GRANULARITIES = ('pages', 'words')
+LAST_ROW_ID = 2 ** 63 - 1
+
+
+# --- Alignment ---
+def letters(text):
+    return re.sub(r"[\s'-]", '', text.lower())
+
+
+def matched_letters(a, b):
+    return sum(block.size for block in SequenceMatcher(None, a, b, autojunk=False).get_matching_blocks())
+
+
+def align_block(source, target):
+    """Aligns two short word lists at the lowest cost in letters, allowing one word to become two and two one.
+
+    Dropping a word costs its length; pairing two costs the letters they do not share (plus
+    one when words were split or joined), so a pair is chosen only where the words look alike.
+    Returns the (source, target) pairs whose sides are similar enough.
+    """
+    n, m = len(source), len(target)
+    cost = [[float('inf')] * (m + 1) for _ in range(n + 1)]
+    step = [[None] * (m + 1) for _ in range(n + 1)]
+    cost[0][0] = 0
+    for i in range(n + 1):
+        for j in range(m + 1):
+            if cost[i][j] == float('inf'):
+                continue
+            moves = [(1, 0), (0, 1)]
+            if i < n and j < m:
+                moves += [(1, 1), (2, 1), (1, 2)]
+            for di, dj in moves:
+                ni, nj = i + di, j + dj
+                if ni > n or nj > m:
+                    continue
+                a, b = letters(''.join(source[i:ni])), letters(''.join(target[j:nj]))
+                if di and dj:
+                    extra = len(a) + len(b) - 2 * matched_letters(a, b) + (1 if di + dj > 2 else 0)
+                else:
+                    extra = len(a) + len(b)
+                if cost[i][j] + extra < cost[ni][nj]:
+                    cost[ni][nj] = cost[i][j] + extra
+                    step[ni][nj] = (di, dj)
+    pairs, i, j = [], n, m
+    while i or j:
+        di, dj = step[i][j]
+        if di and dj:
+            pair = (' '.join(source[i - di:i]), ' '.join(target[j - dj:j]))
+            a, b = letters(pair[0]), letters(pair[1])
+            if 2 * matched_letters(a, b) >= MIN_SIMILARITY * (len(a) + len(b)):
+                pairs.append(pair)
+        i, j = i - di, j - dj
+    return pairs[::-1]
+
+
+def align_words(input_text, corrected_text):
+    """Pairs each word of input_text with the word it became in corrected_text.
+
+    Unchanged words (ignoring case) anchor the alignment; the stretches between them are
+    aligned by character similarity, so a word split in two or two words joined (Йом Кипур,
+    Йом-Кипур) give one phrase pair. Inserted and deleted words have no pair.
+    """
+    source = WORD_PATTERN.findall(input_text or '')
+    target = WORD_PATTERN.findall(corrected_text or '')
+    matcher = SequenceMatcher(None, [word.lower() for word in source], [word.lower() for word in target],
+                              autojunk=False)
+    pairs = []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            pairs.extend(zip(source[i1:i2], target[j1:j2]))
+        elif op == 'replace' and max(i2 - i1, j2 - j1) <= MAX_BLOCK_WORDS:
+            pairs.extend(align_block(source[i1:i2], target[j1:j2]))
+    return pairs
+
+
+# --- Reading ---
+def iter_rows(db, since=None, reviewed_only=True, batch_size=EXPORT_BATCH_SIZE):
+    """Yields batches of rows saved after since (a timestamp string), oldest first."""
+    sql = '''SELECT id, image_name, input_text, corrected_text, timestamp FROM transcriptions
+             WHERE (timestamp, id) > (?, ?) AND input_text IS NOT NULL AND corrected_text IS NOT NULL'''
+    if reviewed_only:
+        sql += ' AND reviewed = 1'
+    sql += ' ORDER BY timestamp, id LIMIT ?'
+    key = (str(since), LAST_ROW_ID) if since else ('', 0)
+    while True:
+        rows = db.execute(sql, (*key, batch_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        key = (rows[-1]['timestamp'], rows[-1]['id'])
+
+
+def export_batches(db, granularity='words', since=None, reviewed_only=True, changed_only=True, align=True,
+                   batch_size=EXPORT_BATCH_SIZE, stats=None):
+    """Yields lists of export records; stats (a dict) is updated with counts and the last timestamp.
+
+    changed_only leaves out unchanged pages and the identity pairs of word records and alignments.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    stats = stats if stats is not None else {}
+    stats.update(pages=0, records=0, last_timestamp=None)
+    for rows in iter_rows(db, since=since, reviewed_only=reviewed_only, batch_size=batch_size):
+        records = []
+        for row in rows:
+            stats['pages'] += 1
+            stats['last_timestamp'] = str(row['timestamp'])
+            if granularity == 'words':
+                for source, target in align_words(row['input_text'], row['corrected_text']):
+                    if not changed_only or source != target:
+                        records.append({'image_name': row['image_name'], 'timestamp': str(row['timestamp']),
+                                        'input_text': source, 'corrected_text': target})
+                continue
+            if changed_only and row['input_text'] == row['corrected_text']:
+                continue
+            record = {'id': row['id'], 'image_name': row['image_name'], 'timestamp': str(row['timestamp']),
+                      'input_text': row['input_text'], 'corrected_text': row['corrected_text']}
+            if align:
+                record['alignment'] = [list(pair) for pair in align_words(row['input_text'], row['corrected_text'])
+                                       if not changed_only or pair[0] != pair[1]]
+            records.append(record)
+        stats['records'] += len(records)
+        if records:
+            yield records
+
+
+# --- Writing ---
+def jsonl_chunks(batches):
+    for records in batches:
+        yield ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+
+def parquet_schema(granularity='words', align=True):
+    import pyarrow as pa
+    fields = [('image_name', pa.string()), ('timestamp', pa.string()),
+              ('input_text', pa.string()), ('corrected_text', pa.string())]
+    if granularity == 'pages':
+        fields.insert(0, ('id', pa.int64()))
+        if align:
+            fields.append(('alignment', pa.list_(pa.list_(pa.string()))))
+    return pa.schema(fields)
+
+
+class ChunkSink(io.RawIOBase):
+    """A write-only file that hands back what was written since the last take()."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(batches, granularity='words', align=True):
+    """Yields a Parquet file piece by piece: one row group per batch, then the footer."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = parquet_schema(granularity, align)
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for records in batches:
+            writer.write_table(pa.Table.from_pylist(records, schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def export(db, output, file_format=None, granularity='words', **options):
+    """Writes the export to output ('-' for stdout in JSONL); returns the stats."""
+    file_format = file_format or ('parquet' if output.endswith('.parquet') else 'jsonl')
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format: {file_format}")
+    stats = {}
+    batches = export_batches(db, granularity=granularity, stats=stats, **options)
+    if file_format == 'parquet':
+        if output == '-':
+            raise ValueError("Parquet output needs a file name.")
+        import pyarrow.parquet  # before the output file is created
+        chunks, mode = parquet_chunks(batches, granularity, options.get('align', True)), 'wb'
+    else:
+        chunks, mode = jsonl_chunks(batches), 'w'
+    if output == '-':
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        return stats
+    # Written under a temporary name, so a failed export never leaves a truncated file behind
+    tmp_path = output + '.tmp'
+    with open(tmp_path, mode, **({} if mode == 'wb' else {'encoding': 'utf-8'})) as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, output)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export human-corrected transcriptions as ketuvim_nert training pairs.")
+    parser.add_argument('database')
+    parser.add_argument('-o', '--output', default='-', help="output file (.jsonl or .parquet), '-' for stdout")
+    parser.add_argument('--format', choices=FORMATS, help="default: from the output file extension")
+    parser.add_argument('--granularity', choices=GRANULARITIES, default='words',
+                        help="one record per aligned word pair (default) or per page with its word alignment; "
+                             "page texts exceed the model's 32-token max_len")
+    parser.add_argument('--since', help="only rows saved after this timestamp (e.g. the last one exported)")
+    parser.add_argument('--include-unreviewed', action='store_true',
+                        help="also export pages whose corrected text was never saved by a person")
+    parser.add_argument('--include-unchanged', action='store_true',
+                        help="keep pairs whose two sides are identical (skipped by default)")
+    parser.add_argument('--no-alignment', action='store_true', help="leave the alignment out of page records")
+    args = parser.parse_args()
+
+    from storage import connect, migrate
+    db = connect(args.database)
+    migrate(db)
+    try:
+        stats = export(db, args.output, file_format=args.format, granularity=args.granularity, since=args.since,
+                       reviewed_only=not args.include_unreviewed, changed_only=not args.include_unchanged,
+                       align=not args.no_alignment)
+    except ImportError:
+        print("ERROR: Parquet output needs pyarrow (pip install pyarrow).")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+    report = sys.stderr if args.output == '-' else sys.stdout
+    print(f"Exported {stats['records']} records from {stats['pages']} pages.", file=report)
+    if stats['last_timestamp']:
+        print(f"Next incremental export: --since '{stats['last_timestamp']}'", file=report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_span(span):
+    """Normalizes a span the same way for lookups and for the model input."""
+    return unicodedata.normalize('NFC', span).strip()
+
+
+def model_fingerprint(model_dir):
+    """Hashes the name, size and modification time of every file in the model directory."""
+    digest = hashlib.sha1()
+    if os.path.isdir(model_dir):
+        for name in sorted(os.listdir(model_dir)):
+            path = os.path.join(model_dir, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class CorrectionCache:
+    """Two-tier memo of span corrections: an in-memory LRU in front of an SQLite file.
+
+    Entries are keyed on the normalized span and a decoding configuration string.
+    Both tiers are dropped once the files in the model directory change, which is checked
+    at most every check_interval seconds. The file is only a cache: when it cannot be read
+    or written (e.g. another server process holds the lock for longer than timeout), the
+    lookup counts as a miss and the correction is kept in memory only.
+    """
+
+    def __init__(self, path, model_dir, max_memory_entries=20000, max_disk_entries=500000, check_interval=10.0,
+                 timeout=5.0):
+        self.path = path
+        self.model_dir = model_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.checked_at = None
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0,
+                         'errors': 0}
+        # Opened on first use in each process: the app is imported before the server forks its
+        # workers, and an SQLite connection must never be used on both sides of a fork
+        self.db = None
+        self.pid = None
+        self.inherited = []
+        self.connect_lock = threading.Lock()
+        self.model_key = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # A lock held by another thread at fork time would stay locked forever in the child
+        self.lock = threading.Lock()
+        self.connect_lock = threading.Lock()
+
+    def connection(self):
+        if self.pid == os.getpid():
+            return self.db
+        with self.connect_lock:
+            if self.pid != os.getpid():
+                if self.db is not None:
+                    # Kept open: closing a connection inherited through fork would release the parent's locks
+                    self.inherited.append(self.db)
+                    self.db = None
+                db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+                try:
+                    # Server processes share the file: readers must not wait for a writer
+                    db.execute('PRAGMA journal_mode=WAL')
+                    db.execute('PRAGMA synchronous=NORMAL')
+                    db.execute('''CREATE TABLE IF NOT EXISTS corrections (
+                        model_key TEXT NOT NULL,
+                        config_key TEXT NOT NULL,
+                        span TEXT NOT NULL,
+                        corrected TEXT NOT NULL,
+                        PRIMARY KEY (model_key, config_key, span)
+                    )''')
+                    db.commit()
+                except sqlite3.Error:
+                    db.close()
+                    raise
+                self.db = db
+                self.pid = os.getpid()
+        return self.db
+
+    def check_model(self, force=False):
+        """Drops every cached entry if the model files changed since the last check."""
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        current = model_fingerprint(self.model_dir)
+        if current == self.model_key:
+            return
+        with self.lock:
+            if self.model_key is not None:
+                self.counters['invalidations'] += 1
+            self.memory.clear()
+            self.model_key = current
+            try:
+                db = self.connection()
+                db.execute('DELETE FROM corrections WHERE model_key != ?', (current,))
+                db.commit()
+            except sqlite3.Error as e:
+                # Rows of the old model are never read again; the next invalidation deletes them
+                self._disk_error('clearing', e)
+
+    def _disk_error(self, action, error):
+        self.counters['errors'] += 1
+        print(f"ERROR {action} the correction cache {self.path}: {error}")
+        if self.db is not None and self.pid == os.getpid():
+            try:
+                self.db.rollback()
+            except sqlite3.Error:
+                pass
+
+    def get_many(self, spans, config_key):
+        """Returns {span: correction} for the spans that are cached."""
+        self.check_model()
+        found = {}
+        missing = []
+        with self.lock:
+            for span in spans:
+                key = (config_key, span)
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[span] = self.memory[key]
+                    self.counters['memory_hits'] += 1
+                else:
+                    missing.append(span)
+            try:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = self.connection().execute(
+                        f'SELECT span, corrected FROM corrections WHERE model_key = ? AND config_key = ? AND span IN ({placeholders})',
+                        [self.model_key, config_key] + chunk
+                    ).fetchall()
+                    for span, corrected in rows:
+                        found[span] = corrected
+                        self._remember(config_key, span, corrected)
+                        self.counters['disk_hits'] += 1
+            except sqlite3.Error as e:
+                self._disk_error('reading', e)
+            self.counters['misses'] += len(spans) - len(found)
+        return found
+
+    def put_many(self, corrections, config_key):
+        if not corrections:
+            return
+        self.check_model()
+        with self.lock:
+            for span, corrected in corrections.items():
+                self._remember(config_key, span, corrected)
+            try:
+                db = self.connection()
+                db.executemany(
+                    'INSERT OR REPLACE INTO corrections (model_key, config_key, span, corrected) VALUES (?, ?, ?, ?)',
+                    [(self.model_key, config_key, span, corrected) for span, corrected in corrections.items()]
+                )
+                # Keep the file bounded by dropping the oldest rows
+                db.execute(
+                    'DELETE FROM corrections WHERE rowid <= (SELECT MAX(rowid) FROM corrections) - ?',
+                    (self.max_disk_entries,)
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                self._disk_error('writing', e)
+
+    def _remember(self, config_key, span, corrected):
+        self.memory[(config_key, span)] = corrected
+        self.memory.move_to_end((config_key, span))
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def stats(self, count_disk=True):
+        """Counters and sizes; count_disk=False skips counting the file's rows (a full scan)."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self.memory)
+            stats['disk_entries'] = None
+            if count_disk:
+                try:
+                    stats['disk_entries'] = self.connection().execute('SELECT COUNT(*) FROM corrections').fetchone()[0]
+                except sqlite3.Error as e:
+                    self._disk_error('counting', e)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        stats['model_key'] = self.model_key
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            try:
+                db = self.connection()
+                db.execute('DELETE FROM corrections')
+                db.commit()
+            except sqlite3.Error as e:
+                self._disk_error('clearing', e)
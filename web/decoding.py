@@ -0,0 +1,154 @@
+import threading
+from collections import namedtuple
+
+from metrics import metrics
+
+DECODING_STRATEGIES = ('adaptive', 'greedy', 'beam')
+
+decoding_counts = {'greedy': 0, 'beam': 0, 'escalated': 0}
+decoding_counts_lock = threading.Lock()
+
+
+class DecodingPolicy(namedtuple('DecodingPolicy', [
+        'strategy', 'num_beams', 'confidence_threshold', 'length_ratio', 'length_slack', 'max_length'],
+        defaults=('adaptive', 4, 0.8, 1.5, 4, 32))):
+    """How a batch is decoded.
+
+    'adaptive' decodes greedily and re-decodes with beam search only the sequences whose
+    confidence (geometric mean of the chosen tokens' probabilities) is below
+    confidence_threshold. 'greedy' and 'beam' always use one path. The output budget is
+    length_ratio * input tokens + length_slack, capped at max_length.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_options(cls, options, default=None, limits=None):
+        """Builds a policy from request options, e.g. {'strategy': 'greedy'}; unset fields keep the default.
+
+        limits maps fields to the largest value a request may ask for, e.g. {'num_beams': 4};
+        larger values are lowered to it.
+        """
+        policy = default or cls()
+        if options is None:
+            return policy
+        if not isinstance(options, dict):
+            raise ValueError("Decoding options must be an object, e.g. {\"strategy\": \"greedy\"}")
+        unknown = set(options) - set(cls._fields)
+        if unknown:
+            raise ValueError(f"Unknown decoding options: {', '.join(sorted(unknown))}")
+        fields = {}
+        for name, value in options.items():
+            if value in (None, ''):
+                continue
+            if name == 'strategy':
+                if value not in DECODING_STRATEGIES:
+                    raise ValueError(f"Unknown decoding strategy '{value}', expected one of {DECODING_STRATEGIES}")
+                fields[name] = value
+            elif name in ('confidence_threshold', 'length_ratio'):
+                fields[name] = float(value)
+            else:
+                fields[name] = int(value)
+        if not 0.0 <= fields.get('confidence_threshold', policy.confidence_threshold) <= 1.0:
+            raise ValueError("confidence_threshold must be between 0 and 1")
+        if fields.get('num_beams', policy.num_beams) < 1:
+            raise ValueError("num_beams must be at least 1")
+        for name, maximum in (limits or {}).items():
+            if name in fields:
+                fields[name] = min(fields[name], maximum)
+        return policy._replace(**fields)
+
+    def key(self):
+        return (f"{self.strategy}|beams={self.num_beams}|threshold={self.confidence_threshold}"
+                f"|length={self.length_ratio}x+{self.length_slack}<={self.max_length}")
+
+    def output_budget(self, input_tokens, cap=None):
+        cap = self.max_length if cap is None else cap
+        return max(2, min(cap, int(input_tokens * self.length_ratio) + self.length_slack))
+
+
+def sequence_confidence(model, output):
+    """Geometric mean probability of the generated tokens of each sequence (padding excluded)."""
+    import torch
+    scores = model.compute_transition_scores(output.sequences, output.scores, normalize_logits=True)
+    generated = output.sequences[:, 1:]
+    mask = (generated != model.config.pad_token_id).to(scores.dtype)
+    # The EOS token of each sequence counts, the padding after it does not
+    totals = (scores * mask).sum(dim=1)
+    lengths = mask.sum(dim=1).clamp(min=1)
+    return torch.exp(totals / lengths)
+
+
+def decode_batch(tokenizer, model, inputs, policy, prefix_tokens=0, trie=None, length_cap=None):
+    """Decodes a tokenized batch following the policy; returns (texts, paths) with paths 'greedy' or 'beam'."""
+    import torch
+    input_tokens = int(inputs['attention_mask'].sum(dim=1).max()) - prefix_tokens
+    generate_kwargs = {'max_length': policy.output_budget(input_tokens, length_cap)}
+    if trie:
+        generate_kwargs = {
+            'max_length': min(length_cap or policy.max_length, trie.max_depth + 1),
+            'prefix_allowed_tokens_fn': trie.prefix_allowed_tokens_fn(),
+        }
+    size = inputs['input_ids'].shape[0]
+    metrics.inc('tokens_total', int(inputs['attention_mask'].sum()), kind='input')
+
+    def beam_search(input_ids, attention_mask):
+        with metrics.stage('model_generate'), torch.no_grad():
+            outputs = model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                num_beams=policy.num_beams,
+                early_stopping=True,
+                **generate_kwargs
+            )
+        count_output_tokens(model, outputs)
+        with metrics.stage('tokenizer_decode'):
+            return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    if policy.strategy == 'beam' and policy.num_beams > 1:
+        paths = ['beam'] * size
+        record_paths(paths)
+        return beam_search(inputs['input_ids'], inputs['attention_mask']), paths
+
+    with metrics.stage('model_generate'), torch.no_grad():
+        output = model.generate(
+            input_ids=inputs['input_ids'],
+            attention_mask=inputs['attention_mask'],
+            num_beams=1,
+            do_sample=False,
+            output_scores=True,
+            return_dict_in_generate=True,
+            **generate_kwargs
+        )
+    count_output_tokens(model, output.sequences)
+    with metrics.stage('tokenizer_decode'):
+        texts = tokenizer.batch_decode(output.sequences, skip_special_tokens=True)
+    paths = ['greedy'] * size
+    if policy.strategy == 'adaptive' and policy.num_beams > 1:
+        confidence = sequence_confidence(model, output)
+        uncertain = [i for i in range(size) if float(confidence[i]) < policy.confidence_threshold]
+        if uncertain:
+            index = torch.tensor(uncertain)
+            rescored = beam_search(inputs['input_ids'][index], inputs['attention_mask'][index])
+            for i, text in zip(uncertain, rescored):
+                texts[i] = text
+                paths[i] = 'beam'
+    record_paths(paths, escalated=policy.strategy == 'adaptive')
+    return texts, paths
+
+
+def count_output_tokens(model, sequences):
+    metrics.inc('tokens_total', int((sequences[:, 1:] != model.config.pad_token_id).sum()), kind='output')
+
+
+def record_paths(paths, escalated=False):
+    with decoding_counts_lock:
+        for path in paths:
+            decoding_counts[path] += 1
+            if escalated and path == 'beam':
+                decoding_counts['escalated'] += 1
+
+
+def decoding_stats():
+    with decoding_counts_lock:
+        return dict(decoding_counts)
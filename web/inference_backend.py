@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+INFERENCE_BACKENDS = ('float32', 'int8')
+
+# Fixed sample set for warmup and for checking the int8 model against the float model.
+# The first four are the words training/ketuvim_nert_training.py checks after training.
+SAMPLE_WORDS = [
+    "Абрим", "ймкипур", "Чернавцы", "Голдштуин",
+    "Абрам", "Голдштейн", "Бердичев", "Ицкович", "Мошко", "Хаим",
+    "Лейба", "Шмуль", "Рывка", "Сура", "Хана", "Янкель",
+    "Ривкин", "Бреслав", "Каменец", "Житомир", "Бердчиев", "Мошка",
+    "Иосиф", "Гершко", "Гитля", "Двойра", "Зельман", "Меер",
+]
+
+
+_threads_configured_in = None  # pid of the process whose thread pools were set
+
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+    """Sets torch's thread pools once per process, before its first forward pass.
+
+    Later calls (model hot reloads) leave the pools alone: torch refuses to change the
+    inter-op pool once it has been used.
+    """
+    global _threads_configured_in
+    if _threads_configured_in == os.getpid():
+        return torch.get_num_threads(), torch.get_num_interop_threads()
+    _threads_configured_in = os.getpid()
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Only possible before any inter-op parallel work has started
+            print(f"WARNING: could not set inter-op threads: {e}")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every Linear layer (weights int8, activations quantized on the fly)."""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def prepare_model(model, backend):
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}")
+    model.eval()
+    if backend == 'int8':
+        model = quantize_int8(model)
+    return model
+
+
+def generate_corrections(tokenizer, model, words, prefix="correct: ", max_length=32, num_beams=4):
+    inputs = tokenizer([prefix + word for word in words], return_tensors="pt",
+                       padding=True, truncation=True, max_length=max_length)
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=inputs['input_ids'],
+            attention_mask=inputs['attention_mask'],
+            max_length=max_length,
+            num_beams=num_beams,
+            early_stopping=True
+        )
+    return [text.strip() for text in tokenizer.batch_decode(outputs, skip_special_tokens=True)]
+
+
+def warmup(tokenizer, model, words=None, runs=2):
+    """Runs a few batches so lazy initialisation and allocator growth happen before the first request."""
+    words = words or SAMPLE_WORDS[:8]
+    start = time.perf_counter()
+    for _ in range(runs):
+        generate_corrections(tokenizer, model, words)
+    return time.perf_counter() - start
+
+
+def compare_models(tokenizer, reference_model, candidate_model, words=None):
+    """Agreement of the candidate model with the reference (float) model on the sample set."""
+    words = words or SAMPLE_WORDS
+    start = time.perf_counter()
+    reference = generate_corrections(tokenizer, reference_model, words)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    candidate = generate_corrections(tokenizer, candidate_model, words)
+    candidate_seconds = time.perf_counter() - start
+    disagreements = [
+        {'input': word, 'reference': ref, 'candidate': cand}
+        for word, ref, cand in zip(words, reference, candidate) if ref != cand
+    ]
+    return {
+        'samples': len(words),
+        'agreement': 1 - len(disagreements) / len(words),
+        'reference_seconds': reference_seconds,
+        'candidate_seconds': candidate_seconds,
+        'speedup': reference_seconds / candidate_seconds if candidate_seconds else None,
+        'disagreements': disagreements,
+    }
+
+
+def main():
+    from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+    parser = argparse.ArgumentParser(description="Check the int8 ketuvim_nert backend against the float model.")
+    parser.add_argument('model_dir')
+    parser.add_argument('--samples', help="file with one input word per line (default: built-in sample set)")
+    parser.add_argument('--threads', type=int, help="intra-op threads")
+    parser.add_argument('--interop-threads', type=int)
+    parser.add_argument('--min-agreement', type=float, default=0.95)
+    args = parser.parse_args()
+
+    configure_threads(args.threads, args.interop_threads)
+    words = None
+    if args.samples:
+        with open(args.samples, encoding='utf-8') as f:
+            words = [line.strip() for line in f if line.strip()]
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    float_model = AutoModelForSeq2SeqLM.from_pretrained(args.model_dir).eval()
+    int8_model = quantize_int8(AutoModelForSeq2SeqLM.from_pretrained(args.model_dir).eval())
+    warmup(tokenizer, float_model)
+    warmup(tokenizer, int8_model)
+    report = compare_models(tokenizer, float_model, int8_model, words)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report['agreement'] >= args.min_agreement else 1)
+
+
+if __name__ == '__main__':
+    main()
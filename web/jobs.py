@@ -0,0 +1,287 @@
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+ACTIVE_STATUSES = ('queued', 'running')
+JOB_EVENTS = ('submitted', 'done', 'failed', 'requeued', 'discarded', 'pruned')
+
+
+class JobQueue:
+    """Correction jobs persisted in the jobs table of ketuvim.db and run by a pool of worker threads.
+
+    The table is the source of truth: workers claim the oldest queued row, so jobs
+    that were queued (or left running) when the server stopped are picked up again.
+    The in-memory queue only wakes idle workers up early.
+
+    A claimed job carries a lease: its owner (one worker thread of one process) and the
+    time the lease expires. A heartbeat thread renews the leases of the jobs its process
+    is running, so only jobs whose process died, however long they run, are re-queued,
+    and a job can only be finished by the worker that holds it.
+
+    Finished jobs are deleted retention_seconds after they finished. Nothing touches the
+    database before the queue is first used.
+    """
+
+    def __init__(self, database, handler, num_workers=2, poll_interval=5.0, lease_seconds=30.0,
+                 retention_seconds=7 * 24 * 3600, prune_interval=3600.0):
+        self.database = database
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.prune_interval = prune_interval
+        self.pruned_at = 0.0
+        self.table_ready = False
+        self.wakeups = queue.Queue()
+        self.workers = []
+        self.heartbeat = None
+        self.running = {}  # job id -> owner, for the jobs this process is running
+        self.running_lock = threading.Lock()
+        self.events = {event: 0 for event in JOB_EVENTS}  # what this process did, for /metrics
+        self.events_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def connect(self):
+        db = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        if not self.table_ready:
+            init_jobs_table(db)
+            self.table_ready = True
+        return db
+
+    def alive(self):
+        return (len(self.workers) == self.num_workers and all(worker.is_alive() for worker in self.workers)
+                and self.heartbeat is not None and self.heartbeat.is_alive())
+
+    def count(self, event, n=1):
+        with self.events_lock:
+            self.events[event] += n
+
+    def start(self):
+        """Starts the worker threads (again, if any has died); safe to call on every request."""
+        if self.alive():
+            return
+        with self.start_lock:
+            if self.alive():
+                return
+            # Threads do not survive fork, so the owner name is made in the process that runs them
+            process = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self.requeue_expired()
+            if self.heartbeat is None or not self.heartbeat.is_alive():
+                self.heartbeat = threading.Thread(target=self._renew_leases, name="nert-job-heartbeat", daemon=True)
+                self.heartbeat.start()
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            for i in range(len(self.workers), self.num_workers):
+                worker = threading.Thread(target=self._work, args=(f"{process}/{i}",), name=f"nert-job-worker-{i}",
+                                          daemon=True)
+                worker.start()
+                self.workers.append(worker)
+            print(f"Started {self.num_workers} NERT job worker(s).")
+
+    def stop(self):
+        self.stopping.set()
+        for _ in self.workers:
+            self.wakeups.put(None)
+
+    def submit(self, image_name, input_text, options=None):
+        job_id = uuid.uuid4().hex
+        db = self.connect()
+        try:
+            db.execute(
+                'INSERT INTO jobs (id, image_name, input_text, options, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, image_name, input_text, json.dumps(options or {}), 'queued', time.time())
+            )
+        finally:
+            db.close()
+        self.count('submitted')
+        self.start()
+        self.wakeups.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        self.start()
+        db = self.connect()
+        try:
+            row = db.execute(
+                'SELECT id, image_name, status, corrected_text, error, created_at, started_at, finished_at FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        job = dict(row)
+        if job['status'] == 'queued':
+            job['position'] = self.position(job)
+        return job
+
+    def position(self, job):
+        db = self.connect()
+        try:
+            return db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (job['created_at'],)
+            ).fetchone()[0]
+        finally:
+            db.close()
+
+    def active_counts(self):
+        """Queued and running jobs; read through the status index, so finished jobs cost nothing."""
+        db = self.connect()
+        try:
+            rows = db.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+            ).fetchall()
+        finally:
+            db.close()
+        counts = {status: 0 for status in ACTIVE_STATUSES}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def event_counts(self):
+        with self.events_lock:
+            return dict(self.events)
+
+    def requeue_expired(self):
+        """Puts running jobs whose lease ran out (their process stopped mid-job) back in the queue."""
+        db = self.connect()
+        try:
+            cursor = db.execute(
+                """UPDATE jobs SET status = 'queued', owner = NULL, started_at = NULL, lease_expires_at = NULL
+                   WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)""",
+                (time.time(),)
+            )
+            if cursor.rowcount:
+                self.count('requeued', cursor.rowcount)
+                print(f"Re-queued {cursor.rowcount} interrupted NERT job(s).")
+        finally:
+            db.close()
+
+    def prune(self):
+        """Deletes the jobs that finished more than retention_seconds ago; returns how many."""
+        self.pruned_at = time.time()
+        db = self.connect()
+        try:
+            cursor = db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (self.pruned_at - self.retention_seconds,)
+            )
+        finally:
+            db.close()
+        if cursor.rowcount:
+            self.count('pruned', cursor.rowcount)
+            print(f"Deleted {cursor.rowcount} NERT job(s) finished more than {self.retention_seconds / 86400:g} days ago.")
+        return cursor.rowcount
+
+    def _claim_next(self, db, owner):
+        db.execute('BEGIN IMMEDIATE')
+        row = None
+        try:
+            row = db.execute(
+                "SELECT id, image_name, input_text, options FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                db.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, started_at = ?, lease_expires_at = ? WHERE id = ?",
+                    (owner, now, now + self.lease_seconds, row['id'])
+                )
+                with self.running_lock:
+                    self.running[row['id']] = owner
+            db.execute('COMMIT')
+            return row
+        except Exception:
+            db.execute('ROLLBACK')
+            with self.running_lock:
+                if row is not None:
+                    self.running.pop(row['id'], None)
+            raise
+
+    def _finish(self, db, job, owner, status, corrected_text=None, error=None):
+        """Records the outcome, unless the lease was lost and the job now belongs to another worker."""
+        with self.running_lock:
+            self.running.pop(job['id'], None)
+        try:
+            cursor = db.execute(
+                """UPDATE jobs SET status = ?, corrected_text = ?, error = ?, finished_at = ?, lease_expires_at = NULL
+                   WHERE id = ? AND owner = ? AND status = 'running'""",
+                (status, corrected_text, error, time.time(), job['id'], owner)
+            )
+            if cursor.rowcount:
+                self.count(status)
+            else:
+                self.count('discarded')
+                print(f"WARNING: NERT job {job['id']} was re-queued while it ran; its result is discarded.")
+        except sqlite3.Error as e:
+            print(f"ERROR recording NERT job {job['id']} as {status}: {e}")
+
+    def _renew_leases(self):
+        db = self.connect()
+        while not self.stopping.wait(self.lease_seconds / 3):
+            with self.running_lock:
+                running = list(self.running.items())
+            if not running:
+                continue
+            try:
+                db.executemany(
+                    "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                    [(time.time() + self.lease_seconds, job_id, owner) for job_id, owner in running]
+                )
+            except sqlite3.Error as e:
+                print(f"ERROR renewing NERT job leases: {e}")
+        db.close()
+
+    def _work(self, owner):
+        db = self.connect()
+        while not self.stopping.is_set():
+            try:
+                job = self._claim_next(db, owner)
+            except sqlite3.Error as e:
+                print(f"ERROR claiming NERT job: {e}")
+                job = None
+            if job is None:
+                try:
+                    self.wakeups.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    try:
+                        self.requeue_expired()
+                        if time.time() - self.pruned_at > self.prune_interval:
+                            self.prune()
+                    except sqlite3.Error as e:
+                        print(f"ERROR re-queueing or pruning NERT jobs: {e}")
+                continue
+            try:
+                options = json.loads(job['options'] or '{}')
+                corrected_text = self.handler(job['image_name'], job['input_text'], options)
+            except Exception as e:
+                print(f"ERROR in NERT job {job['id']} for {job['image_name']}: {e}")
+                self._finish(db, job, owner, 'failed', error=str(e))
+            else:
+                self._finish(db, job, owner, 'done', corrected_text=corrected_text)
+        db.close()
+
+
+def init_jobs_table(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        image_name TEXT NOT NULL,
+        input_text TEXT,
+        options TEXT,
+        status TEXT NOT NULL,
+        corrected_text TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        owner TEXT,
+        lease_expires_at REAL
+    )''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)')
+
@@ -0,0 +1,169 @@
+import csv
+import os
+import pickle
+import sys
+import threading
+
+LEXICON_INDEX_VERSION = 1
+MIN_FUZZY_LENGTH = 4  # shorter words have too many neighbours at distance 1
+
+
+def read_vocabulary(csv_path):
+    """Reads every non-empty cell of every column, like training/ketuvim_nert_training.py does."""
+    vocabulary = []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header row holds the column names
+        for row in reader:
+            for cell in row:
+                word = cell.strip()
+                if word:
+                    vocabulary.append(word)
+    return vocabulary
+
+
+def single_deletes(word):
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def within_one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion, substitution or adjacent transposition."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return (len(diffs) == 2 and diffs[1] == diffs[0] + 1
+                and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    for i in range(len(a)):
+        if a[i] != b[i]:
+            return a[i:] == b[i + 1:]
+    return True
+
+
+def match_case(source, target):
+    if source.isupper() and len(source) > 1:
+        return target.upper()
+    if source[:1].isupper():
+        return target[:1].upper() + target[1:]
+    if source.islower():
+        return target.lower()
+    return target
+
+
+class LexiconIndex:
+    """Symmetric-delete index over the vocabulary used to train ketuvim_nert.
+
+    Lookups are case-insensitive. A word is either known (returned unchanged),
+    resolved to its single vocabulary neighbour at edit distance 1, or left for the model.
+    """
+
+    def __init__(self, vocabulary):
+        self.spellings = {}
+        self.deletes = {}
+        for word in vocabulary:
+            key = word.lower()
+            if key in self.spellings:
+                continue
+            self.spellings[key] = word
+            if len(key) >= MIN_FUZZY_LENGTH - 1:
+                for deleted in single_deletes(key):
+                    self.deletes.setdefault(deleted, []).append(key)
+        self.lock = threading.Lock()
+        self.counters = {'exact': 0, 'resolved': 0, 'ambiguous': 0, 'unknown': 0}
+
+    def __len__(self):
+        return len(self.spellings)
+
+    def candidates(self, word):
+        key = word.lower()
+        found = set()
+        for deleted in single_deletes(key):
+            for candidate in self.deletes.get(deleted, ()):
+                if candidate not in found and within_one_edit(key, candidate):
+                    found.add(candidate)
+        return found
+
+    def lookup(self, word):
+        """Returns (status, spelling); status is 'exact', 'resolved', 'ambiguous' or 'unknown'."""
+        key = word.lower()
+        if key in self.spellings:
+            status, spelling = 'exact', word
+        elif len(key) < MIN_FUZZY_LENGTH:
+            status, spelling = 'unknown', None
+        else:
+            found = self.candidates(word)
+            if len(found) == 1:
+                status, spelling = 'resolved', match_case(word, self.spellings[found.pop()])
+            else:
+                status, spelling = ('ambiguous' if found else 'unknown'), None
+        with self.lock:
+            self.counters[status] += 1
+        return status, spelling
+
+    def resolve_many(self, words):
+        """Splits words into ({word: spelling} resolved without the model, [words left for the model])."""
+        resolved = {}
+        remaining = []
+        for word in words:
+            status, spelling = self.lookup(word)
+            if spelling is not None:
+                resolved[word] = spelling
+            else:
+                remaining.append(word)
+        return resolved, remaining
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['entries'] = len(self.spellings)
+        return stats
+
+    def __getstate__(self):
+        return {'spellings': self.spellings, 'deletes': self.deletes}
+
+    def __setstate__(self, state):
+        self.spellings = state['spellings']
+        self.deletes = state['deletes']
+        self.lock = threading.Lock()
+        self.counters = {'exact': 0, 'resolved': 0, 'ambiguous': 0, 'unknown': 0}
+
+
+def build_lexicon_index(csv_path, index_path):
+    index = LexiconIndex(read_vocabulary(csv_path))
+    with open(index_path, 'wb') as f:
+        pickle.dump({'version': LEXICON_INDEX_VERSION, 'index': index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"Lexicon index with {len(index)} entries saved to {index_path}.")
+    return index
+
+
+def load_lexicon_index(index_path, csv_path=None):
+    """Loads the prebuilt index, rebuilding it first if vocabulary.csv is newer."""
+    csv_exists = csv_path and os.path.isfile(csv_path)
+    if os.path.isfile(index_path) and not (csv_exists and os.path.getmtime(csv_path) > os.path.getmtime(index_path)):
+        try:
+            with open(index_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == LEXICON_INDEX_VERSION:
+                print(f"Lexicon index loaded from {index_path} ({len(data['index'])} entries).")
+                return data['index']
+        except Exception as e:
+            print(f"ERROR loading lexicon index from {index_path}: {e}")
+    if csv_exists:
+        try:
+            return build_lexicon_index(csv_path, index_path)
+        except Exception as e:
+            print(f"ERROR building lexicon index from {csv_path}: {e}")
+    return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python lexicon.py <vocabulary.csv> <lexicon_index.pkl>")
+        sys.exit(1)
+    build_lexicon_index(sys.argv[1], sys.argv[2])
@@ -0,0 +1,200 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; spans take milliseconds, whole pages in 'full' mode take seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    """In-process counters and latency histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, prefix='ketuvim', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.bucket_bounds = {}  # name -> buckets, for histograms not measured in seconds
+        self.help = {}
+        self.collectors = []
+
+    def describe(self, name, kind, text, buckets=None):
+        self.help[name] = (kind, text)
+        if buckets:
+            self.bucket_bounds[name] = tuple(buckets)
+
+    def buckets_of(self, name):
+        return self.bucket_bounds.get(name, self.buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets_of(name)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def stage(self, stage):
+        """Times a block as one stage of the correction path and counts it as an error if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('errors_total', stage=stage)
+            raise
+        finally:
+            self.observe('stage_duration_seconds', time.perf_counter() - start, stage=stage)
+
+    def add_collector(self, collect):
+        """collect() returns [(name, kind, labels, value)] read at scrape time (e.g. cache counters)."""
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            text = self.help.get(name, (kind, name.replace('_', ' ')))[1]
+            lines.append(f"# HELP {self.prefix}_{name} {text}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{self.prefix}_{name}{format_labels(dict(labels))} {value}")
+        for (name, labels), values in histograms:
+            header(name, 'histogram')
+            labels = dict(labels)
+            for bound, count in zip(self.buckets_of(name), values):
+                lines.append(f"{self.prefix}_{name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{self.prefix}_{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {values[-1]}")
+            lines.append(f"{self.prefix}_{name}_sum{format_labels(labels)} {values[-2]}")
+            lines.append(f"{self.prefix}_{name}_count{format_labels(labels)} {values[-1]}")
+        for collect in self.collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                print(f"ERROR collecting metrics: {e}")
+                continue
+            for name, kind, labels, value in samples:
+                if value is None:
+                    continue
+                header(name, kind)
+                lines.append(f"{self.prefix}_{name}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class SlowRequestProfiler:
+    """Opt-in sampling profiler: profiles a fraction of requests and keeps the cProfile dumps of slow ones.
+
+    cProfile only sees the thread it runs in, so a dump of a request that waited on the
+    job workers or the micro-batcher mostly shows that wait.
+    """
+
+    def __init__(self, directory, enabled=False, sample_rate=0.1, threshold=2.0):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.dumps = 0
+
+    @contextmanager
+    def profile(self, name):
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                self.dump(profiler, name, elapsed)
+
+    def wrap_wsgi(self, wsgi_app):
+        """WSGI middleware that profiles each sampled request until its response body is closed.
+
+        Streamed responses do their work while the server iterates the body, after the
+        application has returned, so the profile only ends when the server closes it.
+        """
+        def profiled_app(environ, start_response):
+            profile = self.profile(f"{environ.get('REQUEST_METHOD', '')}{environ.get('PATH_INFO', '')}")
+            profile.__enter__()
+            try:
+                body = wsgi_app(environ, start_response)
+            except BaseException:
+                profile.__exit__(None, None, None)
+                raise
+            return ProfiledBody(body, profile)
+        return profiled_app
+
+    def dump(self, profiler, name, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_name}_{elapsed * 1000:.0f}ms.prof")
+        profiler.dump_stats(path)
+        self.dumps += 1
+        print(f"Slow request profile ({elapsed:.2f}s) written to {path}")
+
+
+class ProfiledBody:
+    """A WSGI response body that ends its request's profile when the server closes it."""
+
+    def __init__(self, body, profile):
+        self.body = body
+        self.profile = profile
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.profile.__exit__(None, None, None)
+
+
+metrics = Metrics()
+metrics.describe('stage_duration_seconds', 'histogram', "Duration of each stage of the correction path.")
+metrics.describe('request_duration_seconds', 'histogram', "Duration of HTTP requests by endpoint.")
+metrics.describe('requests_total', 'counter', "HTTP requests by endpoint and status code.")
+metrics.describe('tokens_total', 'counter', "Tokens fed to (input) and produced by (output) ketuvim_nert.")
+metrics.describe('errors_total', 'counter', "Errors by stage.")
+metrics.describe('batcher_batch_size', 'histogram', "Unique spans per micro-batch.",
+                 buckets=(1, 2, 4, 8, 16, 32, 64, 128))
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+
+from correction_cache import model_fingerprint
+
+
+class ModelManager:
+    """Owns the loaded NERT model bundle: lazy or background loading, readiness and hot reload.
+
+    loader(timings) returns a dict (tokenizer, model, ...) or None on failure, and fills
+    timings with the duration of each startup phase. Requests keep using the current
+    bundle while a changed model directory is being reloaded; the new bundle replaces it
+    only once it has loaded successfully.
+    """
+
+    def __init__(self, model_dir, loader, watch_paths=(), watch_interval=10.0, retry_interval=30.0):
+        self.model_dir = model_dir
+        self.loader = loader
+        self.watch_paths = list(watch_paths)
+        self.watch_interval = watch_interval
+        self.retry_interval = retry_interval
+        self.condition = threading.Condition()
+        self.bundle = None
+        self.state = 'unloaded'  # unloaded, loading, ready, reloading, failed
+        self.error = None
+        self.fingerprint = None
+        self.timings = {}
+        self.loads = 0
+        self.loaded_at = None
+        self.last_attempt = 0.0
+        self.watcher = None
+
+    def current_fingerprint(self):
+        stamps = [model_fingerprint(self.model_dir)]
+        for path in self.watch_paths:
+            stamps.append(str(os.path.getmtime(path)) if os.path.exists(path) else '-')
+        return '|'.join(stamps)
+
+    def start(self):
+        """Starts loading in the background if nothing is loaded yet (or a failed load may be retried)."""
+        with self.condition:
+            retry = self.state == 'failed' and time.time() - self.last_attempt > self.retry_interval
+            if self.state != 'unloaded' and not retry:
+                return
+            self._begin_load('loading')
+        self._start_watcher()
+
+    def reload(self):
+        with self.condition:
+            if self.state in ('loading', 'reloading'):
+                return
+            self._begin_load('reloading' if self.bundle else 'loading')
+
+    def _begin_load(self, state):
+        self.state = state
+        self.last_attempt = time.time()
+        threading.Thread(target=self._load, name="nert-model-loader", daemon=True).start()
+
+    def _load(self):
+        fingerprint = self.current_fingerprint()
+        timings = {}
+        start = time.perf_counter()
+        try:
+            bundle = self.loader(timings)
+            error = None if bundle else "loader returned no model"
+        except Exception as e:
+            bundle, error = None, str(e)
+        timings['total'] = time.perf_counter() - start
+        with self.condition:
+            self.timings = timings
+            if bundle:
+                self.bundle = bundle
+                self.fingerprint = fingerprint
+                self.loads += 1
+                self.loaded_at = time.time()
+                self.state = 'ready'
+                self.error = None
+            else:
+                self.error = error
+                # A failed hot reload keeps serving the previous model
+                self.state = 'ready' if self.bundle else 'failed'
+                if self.bundle:
+                    self.fingerprint = fingerprint
+            self.condition.notify_all()
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+        if bundle:
+            print(f"NERT model ready ({phases}).")
+        else:
+            print(f"WARNING: NERT model failed to load ({error}). Correction is unavailable until it loads.")
+
+    def _start_watcher(self):
+        if self.watcher is not None or not self.watch_interval:
+            return
+        with self.condition:
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=self._watch, name="nert-model-watcher", daemon=True)
+                self.watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            if self.state == 'ready' and self.fingerprint and self.current_fingerprint() != self.fingerprint:
+                print("NERT model files changed, reloading.")
+                self.reload()
+            elif self.state == 'failed':
+                self.start()
+
+    def get(self, timeout=None):
+        """Returns the loaded bundle, waiting for a load in progress; None if loading failed."""
+        self.start()
+        with self.condition:
+            self.condition.wait_for(lambda: self.bundle is not None or self.state == 'failed', timeout)
+            return self.bundle
+
+    def is_ready(self):
+        return self.bundle is not None
+
+    def status(self):
+        with self.condition:
+            return {
+                'state': self.state,
+                'ready': self.bundle is not None,
+                'error': self.error,
+                'loads': self.loads,
+                'loaded_at': self.loaded_at,
+                'timings': dict(self.timings),
+            }
@@ -0,0 +1,279 @@
+"""Full-text and fuzzy search over the transcriptions in ketuvim.db.
+
+transcriptions_fts is an FTS5 index over input_text and corrected_text that reads its
+content from the transcriptions table; triggers keep it in sync with every insert, update
+and delete. search_terms holds every distinct word ever indexed, and search_terms_trigram
+is a trigram index over those words: a fuzzy query first finds the known words within a
+small edit distance of each query word (OCR variants of a surname), then runs an ordinary
+FTS query for any of them.
+
+    python search.py ketuvim.db --rebuild        # index a database created before search existed
+    python search.py ketuvim.db Гольдштейн --fuzzy
+"""
+import argparse
+import base64
+import html
+import json
+import re
+import sqlite3
+import sys
+
+TOKENIZER = 'unicode61 remove_diacritics 0'  # keeps й and ё apart from и and е
+TERM_PATTERN = re.compile(r'[^\W_]+')  # what unicode61 treats as one token
+FUZZY_CANDIDATES = 200  # closest words (by shared trigrams) checked for edit distance
+MAX_FUZZY_TERMS = 50  # spellings of one query word OR'ed into the FTS query
+SNIPPET_TOKENS = 16
+MARK_START, MARK_END = '\ue000', '\ue001'  # replaced by <mark> after HTML escaping
+
+
+# --- Schema ---
+def has_table(db, name):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def init_search_index(db):
+    """Creates the search tables and triggers (if missing) and indexes the existing rows."""
+    db.execute('CREATE TABLE IF NOT EXISTS search_terms (term TEXT PRIMARY KEY) WITHOUT ROWID')
+    try:
+        db.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS transcriptions_fts USING fts5(
+            input_text, corrected_text, content='transcriptions', content_rowid='id', tokenize="{TOKENIZER}")''')
+    except sqlite3.OperationalError as e:
+        print(f"WARNING: SQLite has no FTS5 ({e}); search is disabled. Run search.py --rebuild after upgrading.")
+        return
+    db.execute('''CREATE TRIGGER IF NOT EXISTS transcriptions_fts_insert AFTER INSERT ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (rowid, input_text, corrected_text)
+        VALUES (new.id, new.input_text, new.corrected_text);
+    END''')
+    db.execute('''CREATE TRIGGER IF NOT EXISTS transcriptions_fts_delete AFTER DELETE ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (transcriptions_fts, rowid, input_text, corrected_text)
+        VALUES ('delete', old.id, old.input_text, old.corrected_text);
+    END''')
+    db.execute('''CREATE TRIGGER IF NOT EXISTS transcriptions_fts_update AFTER UPDATE OF input_text, corrected_text ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (transcriptions_fts, rowid, input_text, corrected_text)
+        VALUES ('delete', old.id, old.input_text, old.corrected_text);
+        INSERT INTO transcriptions_fts (rowid, input_text, corrected_text)
+        VALUES (new.id, new.input_text, new.corrected_text);
+    END''')
+    try:
+        # The trigram tokenizer needs SQLite 3.34 or newer
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_terms_trigram USING fts5(term, tokenize='trigram')")
+        db.execute('''CREATE TRIGGER IF NOT EXISTS search_terms_trigram_insert AFTER INSERT ON search_terms BEGIN
+            INSERT INTO search_terms_trigram (term) VALUES (new.term);
+        END''')
+    except sqlite3.OperationalError as e:
+        print(f"WARNING: SQLite has no trigram tokenizer ({e}); fuzzy search falls back to exact words.")
+    rebuild_search_index(db)
+
+
+def terms_of(texts):
+    terms = set()
+    for text in texts:
+        if text:
+            terms.update(TERM_PATTERN.findall(text.lower()))
+    return terms
+
+
+def index_terms(db, texts):
+    """Adds the words of texts to the fuzzy vocabulary; call inside the transaction that stores them.
+
+    Words are never removed when a text is edited: a stale spelling only costs a query term
+    that matches nothing, and --rebuild drops them.
+    """
+    db.executemany('INSERT OR IGNORE INTO search_terms (term) VALUES (?)', ((term,) for term in terms_of(texts)))
+
+
+def rebuild_search_index(db, batch_size=10000):
+    """Rebuilds both indexes from the transcriptions table, reading it in batches. The caller commits."""
+    if has_table(db, 'transcriptions_fts'):
+        db.execute("INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('rebuild')")
+    db.execute('DELETE FROM search_terms')
+    if has_table(db, 'search_terms_trigram'):
+        db.execute('DELETE FROM search_terms_trigram')
+    rows = db.execute('SELECT input_text, corrected_text FROM transcriptions')
+    count = 0
+    while True:
+        batch = rows.fetchmany(batch_size)
+        if not batch:
+            break
+        index_terms(db, [text for row in batch for text in row])
+        count += len(batch)
+    if has_table(db, 'transcriptions_fts'):
+        db.execute("INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('optimize')")
+    terms = db.execute('SELECT count(*) FROM search_terms').fetchone()[0]
+    print(f"Search index rebuilt: {count} transcriptions, {terms} distinct words.")
+    return count
+
+
+# --- Fuzzy Matching ---
+def edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or limit + 1 once it is known to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def max_distance_for(word):
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def fuzzy_terms(db, word):
+    """Known words within max_distance_for(word) edits of word, closest first (word itself included)."""
+    limit = max_distance_for(word)
+    if not limit or len(word) < 3 or not has_table(db, 'search_terms_trigram'):
+        return [word]
+    trigrams = {word[i:i + 3] for i in range(len(word) - 2)}
+    query = ' OR '.join(quote(trigram) for trigram in trigrams)
+    rows = db.execute('''SELECT term FROM search_terms_trigram WHERE search_terms_trigram MATCH ?
+                         ORDER BY rank LIMIT ?''', (query, FUZZY_CANDIDATES)).fetchall()
+    scored = [(edit_distance(word, row[0], limit), row[0]) for row in rows]
+    matches = sorted((distance, term) for distance, term in scored if distance <= limit)
+    terms = [term for _, term in matches[:MAX_FUZZY_TERMS]]
+    return terms if word in terms else [word] + terms[:MAX_FUZZY_TERMS - 1]
+
+
+# --- Queries ---
+FIELDS = {'all': None, 'input': 'input_text', 'corrected': 'corrected_text'}
+
+
+def quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_match(db, query, fuzzy=False, field='all'):
+    """Turns what the user typed into an FTS5 query: every word must match (in any order).
+
+    A trailing * makes a word a prefix; with fuzzy, each word also matches its known OCR variants.
+    Returns (match_expression, {word: [spellings]}).
+    """
+    if field not in FIELDS:
+        raise ValueError(f"Unknown search field: {field}")
+    clauses, expansions = [], {}
+    for raw in query.split():
+        prefix = raw.endswith('*')
+        words = TERM_PATTERN.findall(raw.lower())
+        if not words:
+            continue
+        if prefix or len(words) > 1 or not fuzzy:
+            # A hyphenated or punctuated word is several tokens: match them as a phrase
+            clauses.append(quote(' '.join(words)) + ('*' if prefix else ''))
+            continue
+        spellings = fuzzy_terms(db, words[0])
+        expansions[words[0]] = spellings
+        clauses.append('(' + ' OR '.join(quote(term) for term in spellings) + ')')
+    if not clauses:
+        raise ValueError("The search query has no words.")
+    expression = ' AND '.join(clauses)
+    if FIELDS[field]:
+        expression = f"{FIELDS[field]} : ({expression})"
+    return expression, expansions
+
+
+def encode_search_cursor(row_id):
+    return base64.urlsafe_b64encode(json.dumps([row_id]).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_search_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        (row_id,) = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid page cursor: {cursor}")
+
+
+def snippet_html(snippet):
+    if snippet is None:
+        return ''
+    return html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def search_transcriptions(db, query, fuzzy=False, field='all', limit=50, cursor=None):
+    """One page of the transcriptions matching query, most recently created first.
+
+    Pages are keyed on the row id, which the FTS index is ordered by, so every page costs the
+    same however deep it is and however many rows match. Returns (items, next_cursor, expansions);
+    each item carries HTML snippets of both texts with the matches in <mark>.
+    """
+    if not has_table(db, 'transcriptions_fts'):
+        raise ValueError("Search is not available: this SQLite has no FTS5.")
+    expression, expansions = build_match(db, query, fuzzy=fuzzy, field=field)
+    sql = f'''SELECT t.id, t.image_name, t.timestamp,
+                     snippet(transcriptions_fts, 0, '{MARK_START}', '{MARK_END}', '…', {SNIPPET_TOKENS}) AS input_snippet,
+                     snippet(transcriptions_fts, 1, '{MARK_START}', '{MARK_END}', '…', {SNIPPET_TOKENS}) AS corrected_snippet
+              FROM transcriptions_fts JOIN transcriptions t ON t.id = transcriptions_fts.rowid
+              WHERE transcriptions_fts MATCH ?'''
+    params = [expression]
+    if cursor:
+        sql += ' AND transcriptions_fts.rowid < ?'
+        params.append(decode_search_cursor(cursor))
+    sql += ' ORDER BY transcriptions_fts.rowid DESC LIMIT ?'
+    params.append(limit + 1)
+    try:
+        rows = db.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'fts5' in str(e) or 'syntax' in str(e):
+            raise ValueError(f"Invalid search query: {query}")
+        raise
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1]['id'])
+    items = [{
+        'id': row['id'],
+        'image_name': row['image_name'],
+        'timestamp': row['timestamp'],
+        'input_snippet': snippet_html(row['input_snippet']),
+        'corrected_snippet': snippet_html(row['corrected_snippet']),
+    } for row in rows]
+    return items, next_cursor, expansions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search (or rebuild the search index of) a ketuvim database.")
+    parser.add_argument('database')
+    parser.add_argument('query', nargs='*')
+    parser.add_argument('--rebuild', action='store_true', help="recreate and repopulate the search index")
+    parser.add_argument('--fuzzy', action='store_true', help="also match OCR variants of each word")
+    parser.add_argument('--field', choices=sorted(FIELDS), default='all')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_intermixed_args()
+
+    from storage import MIGRATIONS, connect, migrate
+    db = connect(args.database)
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    migrate(db)
+    if args.rebuild:
+        # A database that had no search index yet got a freshly built one from migrate()
+        index_version = next(target for target, migration in MIGRATIONS if migration is init_search_index)
+        if version < index_version:
+            print("The search index was just created; no rebuild needed.")
+        else:
+            init_search_index(db)
+            db.commit()
+    if args.query:
+        try:
+            items, _, expansions = search_transcriptions(db, ' '.join(args.query), fuzzy=args.fuzzy,
+                                                         field=args.field, limit=args.limit)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+        for word, spellings in expansions.items():
+            print(f"{word}: {', '.join(spellings)}")
+        for item in items:
+            text = item['corrected_snippet'] or item['input_snippet']
+            print(f"{item['timestamp']}  {item['image_name']}  {html.unescape(re.sub('</?mark>', '*', text))}")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
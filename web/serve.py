@@ -0,0 +1,77 @@
+"""Production server: preforked gunicorn workers that share one memory-mapped copy of ketuvim_nert.
+
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+
+Before forking, the checkpoint is converted (once, in a separate process) to
+models/ketuvim_nert.safetensors, next to the model directory. Each worker then maps that file read-only
+(see shared_weights.py), so adding workers adds their activations and caches, not
+another copy of the weights. The master process never imports torch itself.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def convert_shared_weights(model_dir):
+    # In a child process: torch's thread pools must not exist in the master before it forks
+    result = subprocess.run([sys.executable, os.path.join(BASE_DIR, 'shared_weights.py'), model_dir])
+    if result.returncode != 0:
+        print("WARNING: converting to shared weights failed; every worker will load its own copy.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the ketuvim web app with preforked workers.")
+    parser.add_argument('--bind', default='127.0.0.1:8000')
+    parser.add_argument('--workers', type=int, default=2, help="worker processes")
+    parser.add_argument('--threads', type=int, default=4, help="request threads per worker")
+    parser.add_argument('--torch-threads', type=int,
+                        help="torch intra-op threads per worker (default: cores divided by workers)")
+    parser.add_argument('--timeout', type=int, default=120, help="seconds before a silent worker is restarted")
+    args = parser.parse_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("ERROR: serve.py needs gunicorn (pip install gunicorn); use `python app.py` for development.")
+        sys.exit(1)
+
+    import app as ketuvim_app
+
+    print("Initializing database...")
+    ketuvim_app.init_db()
+    if ketuvim_app.NERT_SHARED_WEIGHTS and os.path.isdir(ketuvim_app.NERT_MODEL_PATH):
+        convert_shared_weights(ketuvim_app.NERT_MODEL_PATH)
+    # Workers share the cores: one full-size torch pool per worker would oversubscribe them
+    ketuvim_app.NERT_INTRA_OP_THREADS = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    def post_fork(server, worker):
+        # Threads do not survive fork, so model loading and job workers start in each worker
+        ketuvim_app.nert_models.start()
+        ketuvim_app.job_queue.start()
+
+    class KetuvimServer(BaseApplication):
+        def load_config(self):
+            for name, value in {
+                'bind': args.bind,
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread',
+                'preload_app': True,
+                'timeout': args.timeout,
+                'post_fork': post_fork,
+            }.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return ketuvim_app.app
+
+    print(f"Serving on {args.bind}: {args.workers} workers x {args.threads} threads, "
+          f"{ketuvim_app.NERT_INTRA_OP_THREADS} torch threads each.")
+    KetuvimServer().run()
+
+
+if __name__ == '__main__':
+    main()
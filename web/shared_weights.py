@@ -0,0 +1,203 @@
+"""Converts the ketuvim_nert checkpoint once into a memory-mappable safetensors file and loads models from it.
+
+load_shared_model() maps the file with MAP_PRIVATE and points every parameter at its slice of
+the mapping, so the weights are never copied into the process: all server workers on a host
+read the same page-cache pages, and a worker only gets a private copy of a page if it writes
+to it (which inference never does).
+
+    python shared_weights.py models/ketuvim_nert            # convert (or re-convert if stale)
+
+The file is written next to the model directory (models/ketuvim_nert.safetensors), not into
+it: the app reloads the model and drops its correction cache whenever a file in the model
+directory changes.
+"""
+import argparse
+import itertools
+import json
+import os
+import struct
+import sys
+
+import torch
+
+SHARED_WEIGHTS_SUFFIX = '.safetensors'
+# Checkpoints a shared file can be converted from, in order of preference
+SOURCE_WEIGHTS_NAMES = ('pytorch_model.bin', 'model.safetensors')
+
+DTYPES = {
+    torch.float64: 'F64', torch.float32: 'F32', torch.float16: 'F16', torch.bfloat16: 'BF16',
+    torch.int64: 'I64', torch.int32: 'I32', torch.int16: 'I16', torch.int8: 'I8', torch.uint8: 'U8',
+    torch.bool: 'BOOL',
+}
+TORCH_DTYPES = {name: dtype for dtype, name in DTYPES.items()}
+
+
+def shared_weights_path(model_dir):
+    """models/ketuvim_nert -> models/ketuvim_nert.safetensors"""
+    return os.path.normpath(model_dir) + SHARED_WEIGHTS_SUFFIX
+
+
+def source_stamp(model_dir):
+    """Identifies the checkpoint the shared file was converted from."""
+    for name in SOURCE_WEIGHTS_NAMES:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            return f"{name}:{stat.st_size}:{stat.st_mtime_ns}"
+    return None
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def is_up_to_date(model_dir):
+    path = shared_weights_path(model_dir)
+    if not os.path.exists(path):
+        return False
+    metadata = read_header(path)[0].get('__metadata__', {})
+    stamp = source_stamp(model_dir)
+    # A shared file whose model directory holds no checkpoint (nothing to convert from) is up to date
+    return stamp is None or metadata.get('source') == stamp
+
+
+def write_shared_weights(model, path, metadata=None):
+    """Writes the state dict in the safetensors layout, storing tied tensors once.
+
+    Tensors are ordered by element size (largest first), so every tensor starts at an offset
+    its dtype can be viewed at directly from the byte mapping.
+    """
+    tensors, aliases, seen = [], {}, {}
+    for name, tensor in model.state_dict().items():
+        key = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape))
+        if key in seen:
+            aliases[name] = seen[key]
+            continue
+        seen[key] = name
+        tensors.append((name, tensor.detach().cpu().contiguous()))
+    tensors.sort(key=lambda item: -item[1].element_size())
+
+    header, offset = {}, 0
+    for name, tensor in tensors:
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': DTYPES[tensor.dtype], 'shape': list(tensor.shape), 'data_offsets': [offset, offset + size]}
+        offset += size
+    header['__metadata__'] = {'format': 'pt', 'aliases': json.dumps(aliases), **(metadata or {})}
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    encoded += b' ' * (-(8 + len(encoded)) % 8)  # data starts 8-byte aligned
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for _, tensor in tensors:
+            f.write(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp_path, path)
+    return {'tensors': len(tensors), 'aliases': len(aliases), 'bytes': offset}
+
+
+def convert(model_dir, force=False):
+    """Converts the checkpoint in model_dir unless an up-to-date shared file exists; returns True if it did."""
+    if not force and is_up_to_date(model_dir):
+        return False
+    remove_legacy_file(model_dir)
+    from transformers import AutoModelForSeq2SeqLM
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_dir).eval()
+    path = shared_weights_path(model_dir)
+    stamp = source_stamp(model_dir)
+    report = write_shared_weights(model, path, metadata={'source': stamp} if stamp else None)
+    print(f"Wrote {path}: {report['tensors']} tensors ({report['aliases']} tied), {report['bytes'] / 2**20:.1f} MiB.")
+    return True
+
+
+def remove_legacy_file(model_dir):
+    """Earlier versions wrote the shared file into the model directory; transformers would prefer it
+    to pytorch_model.bin there, although it stores tied weights only once."""
+    path = os.path.join(model_dir, 'model.safetensors')
+    if not os.path.exists(path) or not os.path.exists(os.path.join(model_dir, SOURCE_WEIGHTS_NAMES[0])):
+        return
+    try:
+        metadata = read_header(path)[0].get('__metadata__', {})
+    except (OSError, ValueError, struct.error):
+        return
+    if 'aliases' in metadata and 'source' in metadata:
+        os.remove(path)
+        print(f"Removed {path}, written by an earlier version; the shared weights now live in "
+              f"{shared_weights_path(model_dir)}.")
+
+
+def set_tensor(model, name, tensor):
+    module_name, _, leaf = name.rpartition('.')
+    module = model.get_submodule(module_name) if module_name else model
+    if leaf in module._parameters:
+        module._parameters[leaf] = torch.nn.Parameter(tensor, requires_grad=False)
+    else:
+        module._buffers[leaf] = tensor
+
+
+def build_skeleton(model_dir):
+    from transformers import AutoConfig, AutoModelForSeq2SeqLM
+    config = AutoConfig.from_pretrained(model_dir)
+    try:
+        # Parameters on the meta device take no memory; every one of them is replaced below
+        with torch.device('meta'):
+            return AutoModelForSeq2SeqLM.from_config(config)
+    except (AttributeError, TypeError, RuntimeError, NotImplementedError):
+        return AutoModelForSeq2SeqLM.from_config(config)
+
+
+def load_shared_model(model_dir):
+    """The model with its weights mapped from the shared file, or None if there is no usable file."""
+    path = shared_weights_path(model_dir)
+    if not os.path.exists(path):
+        return None
+    if not is_up_to_date(model_dir):
+        print(f"WARNING: {path} is older than the checkpoint in {model_dir}; run shared_weights.py to convert it again.")
+        return None
+    try:
+        header, data_start = read_header(path)
+        metadata = header.pop('__metadata__', {})
+        mapped = torch.from_file(path, shared=False, size=os.path.getsize(path), dtype=torch.uint8)
+        model = build_skeleton(model_dir)
+        tensors = {}
+        for name, entry in header.items():
+            start, end = entry['data_offsets']
+            tensor = mapped[data_start + start:data_start + end].view(TORCH_DTYPES[entry['dtype']])
+            tensors[name] = tensor.view(entry['shape'])
+            set_tensor(model, name, tensors[name])
+        aliases = json.loads(metadata.get('aliases', '{}'))
+        for alias, name in aliases.items():
+            set_tensor(model, alias, tensors[name])
+        model.tie_weights()
+        # Every weight must now live inside the mapping (tied ones through their shared module)
+        low, high = mapped.data_ptr(), mapped.data_ptr() + mapped.numel()
+        missing = [name for name, tensor in itertools.chain(model.named_parameters(), model.named_buffers())
+                   if tensor.is_meta or not low <= tensor.data_ptr() < high]
+        if missing:
+            raise ValueError(f"no weights for {', '.join(missing[:5])}")
+        try:
+            from transformers import GenerationConfig
+            model.generation_config = GenerationConfig.from_pretrained(model_dir)
+        except OSError:
+            pass  # no generation_config.json: keep the defaults derived from the config
+        return model.eval()
+    except Exception as e:
+        print(f"WARNING: could not map the shared weights from {path} ({e}), loading a private copy instead.")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert ketuvim_nert to memory-mappable shared weights.")
+    parser.add_argument('model_dir')
+    parser.add_argument('--force', action='store_true', help="convert even if the shared file is up to date")
+    args = parser.parse_args()
+    if not convert(args.model_dir, force=args.force):
+        print(f"{shared_weights_path(args.model_dir)} is up to date.")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -70,4 +70,125 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     } else {
     }
+
+    const jobStatusDiv = document.getElementById('job-status');
+
+    if (jobStatusDiv && jobStatusDiv.dataset.status !== 'failed') {
+        const statusUrl = jobStatusDiv.dataset.statusUrl;
+
+        const pollJob = function() {
+            fetch(statusUrl, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(job => {
+                if (!job.success) {
+                    throw new Error(job.message || 'Unknown job.');
+                }
+                if (job.status === 'done') {
+                    window.location.href = job.edit_url;
+                    return;
+                }
+                if (job.status === 'failed') {
+                    jobStatusDiv.textContent = 'ketuvim_nert could not process this text: ' + job.error;
+                    jobStatusDiv.className = 'message-box error-message';
+                    return;
+                }
+                if (job.status === 'running') {
+                    jobStatusDiv.textContent = 'ketuvim_nert is correcting the text...';
+                } else {
+                    jobStatusDiv.textContent = 'Waiting in the queue' + (job.position ? ' (' + job.position + ' ahead)' : '') + '...';
+                }
+                setTimeout(pollJob, 1000);
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                jobStatusDiv.textContent = 'Error: ' + error.message;
+                jobStatusDiv.className = 'message-box error-message';
+            });
+        };
+
+        setTimeout(pollJob, 500);
+    }
+
+    const overlayViewer = document.getElementById('overlay-viewer');
+
+    if (overlayViewer) {
+        const manifestUrl = overlayViewer.dataset.manifestUrl;
+        const tilesUrl = manifestUrl.slice(0, manifestUrl.lastIndexOf('/') + 1);
+        const plane = document.createElement('div');
+        plane.className = 'overlay-plane';
+        overlayViewer.appendChild(plane);
+        let pyramid = null;
+        let level = 0;
+        let loadedTiles = {};
+
+        // Level 0 is full resolution, each further level is half the size of the previous one
+        const levelSize = function(lvl) {
+            return {
+                width: Math.ceil(pyramid.width / Math.pow(2, lvl)),
+                height: Math.ceil(pyramid.height / Math.pow(2, lvl))
+            };
+        };
+
+        const showVisibleTiles = function() {
+            const size = levelSize(level);
+            const tileSize = pyramid.tile_size;
+            const firstCol = Math.floor(overlayViewer.scrollLeft / tileSize);
+            const lastCol = Math.min(Math.ceil(size.width / tileSize) - 1,
+                Math.floor((overlayViewer.scrollLeft + overlayViewer.clientWidth) / tileSize));
+            const firstRow = Math.floor(overlayViewer.scrollTop / tileSize);
+            const lastRow = Math.min(Math.ceil(size.height / tileSize) - 1,
+                Math.floor((overlayViewer.scrollTop + overlayViewer.clientHeight) / tileSize));
+            for (let row = firstRow; row <= lastRow; row++) {
+                for (let col = firstCol; col <= lastCol; col++) {
+                    const key = col + '_' + row;
+                    if (loadedTiles[key]) {
+                        continue;
+                    }
+                    const tile = document.createElement('img');
+                    tile.src = tilesUrl + level + '/' + key + '.' + pyramid.format;
+                    tile.style.left = (col * tileSize) + 'px';
+                    tile.style.top = (row * tileSize) + 'px';
+                    tile.alt = '';
+                    plane.appendChild(tile);
+                    loadedTiles[key] = true;
+                }
+            }
+        };
+
+        const setLevel = function(newLevel) {
+            newLevel = Math.max(0, Math.min(pyramid.levels - 1, newLevel));
+            // Keep the point at the centre of the viewer where it is
+            const oldSize = levelSize(level);
+            const centerX = (overlayViewer.scrollLeft + overlayViewer.clientWidth / 2) / oldSize.width;
+            const centerY = (overlayViewer.scrollTop + overlayViewer.clientHeight / 2) / oldSize.height;
+            level = newLevel;
+            const size = levelSize(level);
+            plane.innerHTML = '';
+            loadedTiles = {};
+            plane.style.width = size.width + 'px';
+            plane.style.height = size.height + 'px';
+            overlayViewer.scrollLeft = centerX * size.width - overlayViewer.clientWidth / 2;
+            overlayViewer.scrollTop = centerY * size.height - overlayViewer.clientHeight / 2;
+            showVisibleTiles();
+        };
+
+        fetch(manifestUrl)
+        .then(response => response.json())
+        .then(data => {
+            pyramid = data;
+            // Start at the largest level that fits the viewer's width
+            level = pyramid.levels - 1;
+            while (level > 0 && levelSize(level - 1).width <= overlayViewer.clientWidth) {
+                level--;
+            }
+            setLevel(level);
+            overlayViewer.addEventListener('scroll', showVisibleTiles);
+            document.getElementById('overlay-zoom-in').addEventListener('click', () => setLevel(level - 1));
+            document.getElementById('overlay-zoom-out').addEventListener('click', () => setLevel(level + 1));
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            overlayViewer.textContent = 'Could not load the segmentation overlay.';
+        });
+    }
 });
\ No newline at end of file
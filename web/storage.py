@@ -0,0 +1,167 @@
+import base64
+import json
+import queue
+import sqlite3
+import threading
+
+from jobs import init_jobs_table
+from search import init_search_index
+from upload_store import init_uploads_table
+
+
+def connect(database):
+    """Opens a connection in WAL mode: readers (history, search) no longer block the writer or each other."""
+    db = sqlite3.connect(database, timeout=30, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    # In WAL mode NORMAL only risks the last commits on power loss, never corruption
+    db.execute('PRAGMA synchronous=NORMAL')
+    # Rows removed by INSERT OR REPLACE must fire the delete triggers that keep the search index in sync
+    db.execute('PRAGMA recursive_triggers=ON')
+    return db
+
+
+# --- Schema Migrations ---
+# Applied in order; PRAGMA user_version records the last one applied to a ketuvim.db file.
+# Migrations run inside migrate()'s transaction, so they must not commit themselves.
+def create_transcriptions(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS transcriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_name TEXT UNIQUE NOT NULL,
+        input_text TEXT,
+        corrected_text TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+def index_transcriptions_by_timestamp(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_transcriptions_timestamp_id ON transcriptions (timestamp, id)')
+
+def has_column(db, table, column):
+    return any(row[1] == column for row in db.execute(f'PRAGMA table_info({table})'))
+
+def add_reviewed_flag(db):
+    # Set when a person saves the page from the edit page; those are the pairs worth retraining on
+    if not has_column(db, 'transcriptions', 'reviewed'):
+        db.execute('ALTER TABLE transcriptions ADD COLUMN reviewed INTEGER NOT NULL DEFAULT 0')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_transcriptions_reviewed ON transcriptions (timestamp, id) WHERE reviewed = 1')
+    # Pages saved before the flag existed: a corrected text that differs from what the model's
+    # correction job produced for the page can only have come from /save. Pages with no job to
+    # compare against stay unreviewed (corpus_export.py --include-unreviewed exports them).
+    cursor = db.execute('''UPDATE transcriptions SET reviewed = 1
+        WHERE reviewed = 0 AND corrected_text IS NOT NULL
+          AND EXISTS (SELECT 1 FROM jobs WHERE jobs.image_name = transcriptions.image_name AND jobs.status = 'done')
+          AND NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.image_name = transcriptions.image_name AND jobs.status = 'done'
+                          AND jobs.corrected_text IS transcriptions.corrected_text)''')
+    if cursor.rowcount:
+        print(f"Marked {cursor.rowcount} volunteer-edited transcription(s) as reviewed.")
+    unmarked = db.execute('SELECT COUNT(*) FROM transcriptions WHERE reviewed = 0').fetchone()[0]
+    if unmarked:
+        print(f"NOTE: {unmarked} earlier transcription(s) could not be told apart from model output and stay "
+              "unreviewed; export them with corpus_export.py --include-unreviewed.")
+
+MIGRATIONS = [
+    (1, create_transcriptions),
+    (2, index_transcriptions_by_timestamp),
+    (3, init_jobs_table),
+    (4, init_uploads_table),
+    (5, init_search_index),
+    (6, add_reviewed_flag),
+]
+
+
+def migrate(db):
+    """Brings the schema up to date and returns the resulting version.
+
+    Each migration commits together with its version bump, so a crash leaves the file at the
+    previous version with none of the migration applied, and the next start runs it again.
+    """
+    if db.in_transaction:
+        db.commit()
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    for target, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        # IMMEDIATE takes the write lock up front; another process may have migrated meanwhile
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if target <= version:
+                db.rollback()
+                continue
+            migration(db)
+            db.execute(f'PRAGMA user_version = {target}')
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        print(f"Database migrated to schema version {target} ({migration.__name__}).")
+        version = target
+    return version
+
+
+class ConnectionPool:
+    """Keeps opened connections for reuse across requests instead of connecting for each one."""
+
+    def __init__(self, database, max_idle=8):
+        self.database = database
+        self.idle = queue.LifoQueue(maxsize=max_idle)
+        self.migrated = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        db = connect(self.database)
+        if not self.migrated:
+            with self.lock:
+                if not self.migrated:
+                    migrate(db)
+                    self.migrated = True
+        return db
+
+    def release(self, db):
+        if db.in_transaction:
+            db.rollback()
+        try:
+            self.idle.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+
+# --- Keyset Pagination ---
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([str(timestamp), row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid page cursor: {cursor}")
+
+
+def list_transcriptions(db, limit=50, cursor=None, preview_length=200):
+    """One page of transcriptions, newest first, and the cursor of the next page (None on the last page).
+
+    Only the first preview_length characters of the texts are read.
+    """
+    sql = '''SELECT id, image_name, substr(input_text, 1, ?) AS input_text,
+                    substr(corrected_text, 1, ?) AS corrected_text, timestamp
+             FROM transcriptions'''
+    params = [preview_length, preview_length]
+    if cursor:
+        sql += ' WHERE (timestamp, id) < (?, ?)'
+        params.extend(decode_cursor(cursor))
+    sql += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+    rows = db.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_cursor
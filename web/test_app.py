@@ -0,0 +1,196 @@
+import io
+import json
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('flask')
+
+import app
+from constrained_decoding import VocabularyTrie
+from correction_cache import CorrectionCache
+from decoding import DecodingPolicy
+from lexicon import LexiconIndex
+from storage import connect, migrate
+
+
+class UppercaseBatcher:
+    """Stands in for the model: records what reached it and upper-cases every span."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, key, spans):
+        self.submitted.extend(spans)
+        return {span: span.upper() for span in spans}
+
+
+def test_split_into_spans_joins_back_into_the_text():
+    text = "Абрам Гольдштеин, 1901 г.\n  Йом-Кипур d'Arc!"
+    spans = app.split_into_spans(text)
+    assert ''.join(chunk for _, chunk in spans) == text
+    assert [chunk for is_word, chunk in spans if is_word] == ['Абрам', 'Гольдштеин', 'г', 'Йом-Кипур', "d'Arc"]
+
+
+def test_corrected_words_are_put_back_between_the_original_separators():
+    batcher = UppercaseBatcher()
+    texts = ["мошко, 1901 —\nхаим", "хаим!"]
+    corrected = app.correct_texts_by_spans(texts, None, None, batcher=batcher)
+    assert corrected == ["МОШКО, 1901 —\nХАИМ", "ХАИМ!"]
+    # a word shared between the texts reaches the model once
+    assert sorted(batcher.submitted) == ['мошко', 'хаим']
+
+
+def test_lexicon_resolves_known_words_without_the_model():
+    batcher = UppercaseBatcher()
+    lexicon = LexiconIndex(['Гольдштейн', 'Черновцы'])
+    corrected = app.correct_texts_by_spans(["Гольдштеин из Черновцы"], None, None, lexicon=lexicon, batcher=batcher)
+    assert corrected == ["Гольдштейн ИЗ Черновцы"]
+    assert batcher.submitted == ['из']
+
+
+def test_text_without_words_is_returned_unchanged():
+    assert app.correct_texts_by_spans(["1901 — 12.", ""], None, None, batcher=UppercaseBatcher()) == ["1901 — 12.", ""]
+
+
+def test_constrained_corrections_are_cached_per_vocabulary(tmp_path):
+    (tmp_path / 'model').mkdir()
+    cache = CorrectionCache(str(tmp_path / 'cache.db'), str(tmp_path / 'model'), check_interval=0)
+    old, new = VocabularyTrie([], 1), VocabularyTrie([], 1)
+    old.fingerprint, new.fingerprint = 'vocabulary-v1', 'vocabulary-v2'
+    batcher = UppercaseBatcher()
+    app.correct_texts_by_spans(["хаим"], None, None, cache=cache, trie=old, batcher=batcher)
+    app.correct_texts_by_spans(["хаим"], None, None, cache=cache, trie=old, batcher=batcher)
+    assert batcher.submitted == ['хаим']
+    app.correct_texts_by_spans(["хаим"], None, None, cache=cache, trie=new, batcher=batcher)
+    app.correct_texts_by_spans(["хаим"], None, None, cache=cache, batcher=batcher)
+    assert batcher.submitted == ['хаим'] * 3
+
+
+@pytest.mark.parametrize('agreement, expected', [(0.5, 'float32'), (1.0, 'int8')])
+def test_the_int8_backend_reports_a_fallback_to_float32(monkeypatch, agreement, expected):
+    inference_backend = pytest.importorskip('inference_backend')
+    monkeypatch.setattr(inference_backend, 'quantize_int8', lambda model: 'int8 model')
+    monkeypatch.setattr(inference_backend, 'compare_models', lambda tokenizer, reference, candidate: {
+        'agreement': agreement, 'samples': 28, 'speedup': 2.0})
+    float_model = SimpleNamespace(eval=lambda: None)
+    model, backend = app.select_int8_model(None, float_model)
+    assert backend == expected
+    assert model is (float_model if expected == 'float32' else 'int8 model')
+
+
+# --- /api/correct/batch ---
+@pytest.fixture
+def bulk(tmp_path, monkeypatch):
+    """A test client whose model upper-cases every text; records the policy of each chunk."""
+    database = str(tmp_path / 'ketuvim.db')
+    db = connect(database)
+    migrate(db)
+    db.close()
+    policies = []
+
+    def correct(texts, tokenizer, model, policy=None, **options):
+        policies.append(policy)
+        return [text.upper() for text in texts]
+
+    monkeypatch.setattr(app, 'DATABASE', database)
+    monkeypatch.setattr(app, 'BULK_CHUNK_SIZE', 2)
+    monkeypatch.setattr(app.nert_models, 'get', lambda: {'tokenizer': 't', 'model': 'm', 'lexicon': None, 'trie': None})
+    monkeypatch.setattr(app, 'run_nert_corrector_batch', correct)
+    return SimpleNamespace(client=app.app.test_client(), database=database, policies=policies)
+
+
+def stored(database):
+    db = connect(database)
+    try:
+        return {row['image_name']: row['corrected_text'] for row in db.execute('SELECT * FROM transcriptions')}
+    finally:
+        db.close()
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_bulk_records_are_corrected_stored_and_reported_line_by_line(bulk):
+    records = [{'image_name': 'a.png', 'input_text': 'абрам'}, {'image_name': 'b.png'},
+               {'image_name': 'c.png', 'input_text': 'хаим'}, 'not a record']
+    response = bulk.client.post('/api/correct/batch', json={'records': records})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    *lines, summary = ndjson(response)
+    assert [(line['status'], line['image_name']) for line in lines] == [
+        ('error', 'b.png'), ('ok', 'a.png'), ('error', None), ('ok', 'c.png')]
+    assert summary['summary']['records'] == 4
+    assert summary['summary']['corrected'] == 2 and summary['summary']['failed'] == 2
+    assert stored(bulk.database) == {'a.png': 'АБРАМ', 'c.png': 'ХАИМ'}
+
+
+def test_bulk_ndjson_and_archives_are_accepted_and_save_can_be_skipped(bulk):
+    body = '{"image_name": "a.png", "input_text": "абрам"}\n\n{"image_name": "b.png", "input_text": "хаим"}\n'
+    response = bulk.client.post('/api/correct/batch?save=0', data=body.encode('utf-8'),
+                                content_type='application/x-ndjson')
+    assert [line.get('corrected_text') for line in ndjson(response)[:-1]] == ['АБРАМ', 'ХАИМ']
+    assert stored(bulk.database) == {}
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('page_001.txt', 'мошко')
+        zf.writestr('notes/readme.md', 'skipped')
+    archive.seek(0)
+    response = bulk.client.post('/api/correct/batch', data={'archive': (archive, 'volume.zip')},
+                                content_type='multipart/form-data')
+    assert ndjson(response)[0]['corrected_text'] == 'МОШКО'
+    assert stored(bulk.database) == {'page_001': 'МОШКО'}
+
+
+def test_bulk_rejects_an_unreadable_archive(bulk):
+    response = bulk.client.post('/api/correct/batch', data={'archive': (io.BytesIO(b'not a zip'), 'volume.zip')},
+                                content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('decoding', ['beam', ['beam'], {'strategy': 'sampling'}, {'beams': 2}])
+def test_bulk_rejects_invalid_decoding_options(bulk, decoding):
+    response = bulk.client.post('/api/correct/batch', json={'records': [], 'decoding': decoding})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_bulk_decoding_options_are_held_to_the_server_limits(bulk):
+    decoding = {'strategy': 'beam', 'num_beams': 64, 'max_length': 4096, 'length_slack': 1000}
+    response = bulk.client.post('/api/correct/batch', json={
+        'records': [{'image_name': 'a.png', 'input_text': 'абрам'}], 'decoding': decoding, 'save': False})
+    assert response.status_code == 200
+    ndjson(response)
+    [policy] = bulk.policies
+    assert policy.strategy == 'beam'
+    assert policy.num_beams == app.NERT_NUM_BEAMS
+    assert policy.max_length == app.NERT_SPAN_MAX_LENGTH
+    assert policy.length_slack <= app.NERT_SPAN_MAX_LENGTH
+
+
+def test_bulk_waits_for_the_model(bulk, monkeypatch):
+    monkeypatch.setattr(app.nert_models, 'get', lambda: None)
+    response = bulk.client.post('/api/correct/batch', json={'records': []})
+    assert response.status_code == 503
+
+
+def test_job_decoding_options_are_held_to_the_server_limits():
+    policy = app.request_policy({'num_beams': '99', 'confidence_threshold': '0.5'})
+    assert policy == app.NERT_DECODING_POLICY._replace(num_beams=app.NERT_NUM_BEAMS, confidence_threshold=0.5)
+    with pytest.raises(ValueError):
+        app.request_policy('beam')
+
+
+def test_the_correction_export_defaults_to_changed_word_pairs(bulk):
+    db = connect(bulk.database)
+    db.execute('''INSERT INTO transcriptions (image_name, input_text, corrected_text, reviewed)
+                  VALUES ('a.png', 'Абрам Гольдштеин', 'Абрам Гольдштейн', 1)''')
+    db.commit()
+    db.close()
+    words = ndjson(bulk.client.get('/api/export/corrections'))
+    assert [(record['input_text'], record['corrected_text']) for record in words] == [('Гольдштеин', 'Гольдштейн')]
+    [page] = ndjson(bulk.client.get('/api/export/corrections?granularity=pages&changed_only=0'))
+    assert page['alignment'] == [['Абрам', 'Абрам'], ['Гольдштеин', 'Гольдштейн']]
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from batching import MicroBatcher, histogram_bucket
+
+
+class RecordingModel:
+    """Stands in for the model: records each batch and upper-cases its spans."""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+
+    def __call__(self, key, spans):
+        with self.lock:
+            self.batches.append((key, sorted(spans)))
+        if self.fail_on in spans:
+            raise RuntimeError('model failed')
+        return {span: f"{key}:{span.upper()}" for span in spans}
+
+
+def submit_concurrently(batcher, requests):
+    results = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def run(i, key, spans):
+        start.wait()
+        try:
+            results[i] = batcher.submit(key, spans)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, key, spans)) for i, (key, spans) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_concurrent_requests_share_a_batch_and_decode_shared_spans_once():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=32, window=0.5)
+    results = submit_concurrently(batcher, [('k', ['хаим', 'абрам']), ('k', ['абрам', 'мошко'])])
+    assert results == [{'хаим': 'k:ХАИМ', 'абрам': 'k:АБРАМ'}, {'абрам': 'k:АБРАМ', 'мошко': 'k:МОШКО'}]
+    assert model.batches == [('k', ['абрам', 'мошко', 'хаим'])]
+    stats = batcher.stats()
+    assert stats['batches'] == 1 and stats['spans'] == 3
+
+
+def test_spans_are_only_batched_with_the_same_decoding_key():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=32, window=0.2)
+    results = submit_concurrently(batcher, [('greedy', ['хаим']), ('beam', ['хаим'])])
+    assert results == [{'хаим': 'greedy:ХАИМ'}, {'хаим': 'beam:ХАИМ'}]
+    assert sorted(model.batches) == [('beam', ['хаим']), ('greedy', ['хаим'])]
+
+
+def test_a_full_batch_does_not_wait_for_the_window():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=2, window=60)
+    spans = ['a', 'b', 'c', 'd']
+    assert batcher.submit('k', spans) == {span: f"k:{span.upper()}" for span in spans}
+    assert [len(spans) for _, spans in model.batches] == [2, 2]
+    assert batcher.stats()['batch_size_histogram'] == {'le_2': 2}
+
+
+def test_a_failed_batch_fails_every_caller_waiting_on_it():
+    batcher = MicroBatcher(RecordingModel(fail_on='boom'), window=0.2)
+    results = submit_concurrently(batcher, [('k', ['boom']), ('k', ['boom', 'хаим'])])
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # the batcher keeps serving after a failure
+    assert batcher.submit('k', ['хаим']) == {'хаим': 'k:ХАИМ'}
+
+
+@pytest.mark.parametrize('value, bucket', [(1, 1), (2, 2), (3, 4), (32, 32), (33, 64)])
+def test_histogram_buckets_are_powers_of_two(value, bucket):
+    assert histogram_bucket(value) == bucket
@@ -0,0 +1,57 @@
+from constrained_decoding import VocabularyTrie, load_vocabulary_trie
+
+EOS = 1
+
+
+class CharTokenizer:
+    """One token per character, ending with EOS like the T5 tokenizer."""
+
+    eos_token_id = EOS
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, words, add_special_tokens=True):
+        self.calls += 1
+        return {'input_ids': [[ord(ch) for ch in word] + [EOS] for word in words]}
+
+
+def ids(text):
+    return [ord(ch) for ch in text]
+
+
+def test_beams_may_only_continue_vocabulary_spellings():
+    trie = VocabularyTrie([ids('ab') + [EOS], ids('ac') + [EOS], ids('b') + [EOS]], EOS)
+    assert sorted(trie.allowed_tokens([])) == sorted(ids('ab'))
+    assert sorted(trie.allowed_tokens(ids('a'))) == sorted(ids('bc'))
+    assert trie.allowed_tokens(ids('ab')) == [EOS]
+    assert trie.allowed_tokens(ids('ab') + [EOS]) == [EOS]
+    # a prefix that left the trie can only finish
+    assert trie.allowed_tokens(ids('x')) == [EOS]
+    assert trie.entries == 3 and trie.max_depth == 3
+
+
+def test_trie_is_cached_until_the_vocabulary_changes(tmp_path):
+    csv_path = tmp_path / 'vocabulary.csv'
+    trie_path = str(tmp_path / 'vocabulary_trie.pkl')
+    csv_path.write_text('name\nАбрам\nХаим\n', encoding='utf-8')
+    tokenizer = CharTokenizer()
+
+    trie = load_vocabulary_trie(trie_path, str(csv_path), tokenizer, str(tmp_path))
+    assert trie.entries == 2
+    cached = load_vocabulary_trie(trie_path, str(csv_path), tokenizer, str(tmp_path))
+    assert cached.entries == 2
+    assert tokenizer.calls == 1
+    # the fingerprint keys cached constrained corrections, so it must survive the pickle round trip
+    assert cached.fingerprint == trie.fingerprint is not None
+
+    csv_path.write_text('name\nАбрам\nХаим\nМошко\n', encoding='utf-8')
+    rebuilt = load_vocabulary_trie(trie_path, str(csv_path), tokenizer, str(tmp_path))
+    assert rebuilt.entries == 3
+    assert tokenizer.calls == 2
+    assert rebuilt.fingerprint != trie.fingerprint
+
+
+def test_no_vocabulary_means_no_trie(tmp_path):
+    assert load_vocabulary_trie(str(tmp_path / 'trie.pkl'), str(tmp_path / 'missing.csv'), CharTokenizer(),
+                                str(tmp_path)) is None
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import corpus_export
+import storage
+from storage import connect, migrate
+
+
+def save(db, image_name, input_text, corrected_text, timestamp, reviewed):
+    db.execute('''INSERT INTO transcriptions (image_name, input_text, corrected_text, timestamp, reviewed)
+                  VALUES (?, ?, ?, ?, ?)''', (image_name, input_text, corrected_text, timestamp, int(reviewed)))
+    db.commit()
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = connect(str(tmp_path / 'ketuvim.db'))
+    migrate(db)
+    save(db, 'a.png', 'Абрам Гольдштеин', 'Абрам Гольдштейн', '2026-10-01 10:00:00', True)
+    save(db, 'b.png', 'Хаим из Чернавцы', 'Хаим из Чернавцы', '2026-10-02 10:00:00', False)
+    save(db, 'c.png', 'Йом Кипур', 'Йом-Кипур', '2026-10-03 10:00:00', True)
+    yield db
+    db.close()
+
+
+def export(db, **options):
+    return [record for batch in corpus_export.export_batches(db, **options) for record in batch]
+
+
+def test_only_reviewed_pages_are_exported_by_default(db):
+    assert [record['image_name'] for record in export(db)] == ['a.png', 'c.png']
+    pages = export(db, granularity='pages', reviewed_only=False, changed_only=False)
+    assert [record['image_name'] for record in pages] == ['a.png', 'b.png', 'c.png']
+
+
+def test_since_exports_only_later_saves_across_batches(db):
+    stats = {}
+    records = export(db, granularity='pages', since='2026-10-01 10:00:00', reviewed_only=False, changed_only=False,
+                     batch_size=1, stats=stats)
+    assert [record['image_name'] for record in records] == ['b.png', 'c.png']
+    assert stats == {'pages': 2, 'records': 2, 'last_timestamp': '2026-10-03 10:00:00'}
+    assert export(db, since=stats['last_timestamp']) == []
+
+
+def test_changed_word_pairs_are_the_default_records(db):
+    records = export(db)
+    assert [(record['input_text'], record['corrected_text']) for record in records] == [
+        ('Гольдштеин', 'Гольдштейн'), ('Йом Кипур', 'Йом-Кипур')]
+    everything = export(db, changed_only=False)
+    assert [record['input_text'] for record in everything] == ['Абрам', 'Гольдштеин', 'Йом Кипур']
+
+
+def test_alignment_survives_inserted_and_dropped_words():
+    assert corpus_export.align_words('Абрам Гольдштеин из Чернавцы Йом Кипур лишнее',
+                                     'абрам Гольдштейн Черновцы Йом-Кипур') == [
+        ('Абрам', 'абрам'), ('Гольдштеин', 'Гольдштейн'), ('Чернавцы', 'Черновцы'), ('Йом Кипур', 'Йом-Кипур')]
+    assert corpus_export.align_words('абв где', 'жзи клм') == []
+
+
+def test_jsonl_file_has_one_page_per_line(db, tmp_path):
+    output = str(tmp_path / 'corrections.jsonl')
+    stats = corpus_export.export(db, output, granularity='pages')
+    with open(output, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert stats['records'] == len(lines) == 2
+    assert lines[0]['alignment'] == [['Гольдштеин', 'Гольдштейн']]
+    corpus_export.export(db, output, granularity='pages', changed_only=False)
+    with open(output, encoding='utf-8') as f:
+        assert json.loads(f.readline())['alignment'] == [['Абрам', 'Абрам'], ['Гольдштеин', 'Гольдштейн']]
+
+
+def test_adding_the_flag_marks_pages_edited_after_their_correction_job(tmp_path, capsys):
+    db = connect(str(tmp_path / 'old.db'))
+    for version, migration in storage.MIGRATIONS:
+        if migration is storage.add_reviewed_flag:
+            break
+        migration(db)
+        db.execute(f'PRAGMA user_version = {version}')
+    db.executemany('INSERT INTO transcriptions (image_name, input_text, corrected_text) VALUES (?, ?, ?)',
+                   [('model.png', 'x', 'model output'), ('edited.png', 'x', 'volunteer text'), ('bulk.png', 'x', 'y')])
+    db.executemany("INSERT INTO jobs (id, image_name, status, corrected_text, created_at) VALUES (?, ?, 'done', ?, 0)",
+                   [('1', 'model.png', 'model output'), ('2', 'edited.png', 'model output')])
+    db.commit()
+    migrate(db)
+    reviewed = dict(db.execute('SELECT image_name, reviewed FROM transcriptions').fetchall())
+    db.close()
+    assert reviewed == {'model.png': 0, 'edited.png': 1, 'bulk.png': 0}
+    assert '--include-unreviewed' in capsys.readouterr().out
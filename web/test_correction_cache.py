@@ -0,0 +1,97 @@
+import os
+import sqlite3
+
+import pytest
+
+import correction_cache
+from correction_cache import CorrectionCache
+
+
+def make_cache(tmp_path, **options):
+    model_dir = tmp_path / 'model'
+    model_dir.mkdir()
+    (model_dir / 'pytorch_model.bin').write_bytes(b'v1')
+    options.setdefault('check_interval', 0)
+    return CorrectionCache(str(tmp_path / 'cache.db'), str(model_dir), **options), model_dir
+
+
+def test_hits_come_from_memory_then_disk(tmp_path):
+    cache, model_dir = make_cache(tmp_path)
+    cache.put_many({'Абрим': 'Абрам'}, 'spans')
+    assert cache.get_many(['Абрим', 'Хаим'], 'spans') == {'Абрим': 'Абрам'}
+    reopened = CorrectionCache(cache.path, str(model_dir))
+    assert reopened.get_many(['Абрим'], 'spans') == {'Абрим': 'Абрам'}
+    assert reopened.stats()['disk_hits'] == 1
+    assert reopened.stats()['disk_entries'] == 1
+    assert reopened.stats(count_disk=False)['disk_entries'] is None
+
+
+def test_entries_are_kept_per_decoding_configuration(tmp_path):
+    cache, _ = make_cache(tmp_path)
+    cache.put_many({'Абрим': 'Абрам'}, 'greedy')
+    assert cache.get_many(['Абрим'], 'beam') == {}
+
+
+def test_changing_the_model_files_drops_every_entry(tmp_path):
+    cache, model_dir = make_cache(tmp_path)
+    cache.put_many({'Абрим': 'Абрам'}, 'spans')
+    (model_dir / 'pytorch_model.bin').write_bytes(b'version 2')
+    assert cache.get_many(['Абрим'], 'spans') == {}
+    stats = cache.stats()
+    assert stats['invalidations'] == 1
+    assert stats['disk_entries'] == 0
+
+
+def test_the_model_directory_is_only_checked_every_interval(tmp_path, monkeypatch):
+    cache, model_dir = make_cache(tmp_path, check_interval=3600)
+    calls = []
+    fingerprint = correction_cache.model_fingerprint
+    monkeypatch.setattr(correction_cache, 'model_fingerprint', lambda path: calls.append(path) or fingerprint(path))
+    cache.put_many({'Абрим': 'Абрам'}, 'spans')
+    (model_dir / 'pytorch_model.bin').write_bytes(b'version 2')
+    for _ in range(5):
+        assert cache.get_many(['Абрим'], 'spans') == {'Абрим': 'Абрам'}
+    assert len(calls) == 1
+    cache.check_model(force=True)
+    assert cache.get_many(['Абрим'], 'spans') == {}
+
+
+def test_a_locked_file_does_not_fail_the_correction(tmp_path):
+    cache, _ = make_cache(tmp_path, timeout=0.05)
+    cache.put_many({'Абрим': 'Абрам'}, 'spans')
+    other = sqlite3.connect(cache.path)
+    other.execute('BEGIN EXCLUSIVE')
+    try:
+        cache.put_many({'Хиам': 'Хаим'}, 'spans')
+        assert cache.get_many(['Хиам', 'Абрим'], 'spans') == {'Хиам': 'Хаим', 'Абрим': 'Абрам'}
+    finally:
+        other.rollback()
+        other.close()
+    assert cache.stats()['errors'] == 1
+    # The write that failed is not retried: the span is only known to this process
+    cache.memory.clear()
+    assert cache.get_many(['Хиам', 'Абрим'], 'spans') == {'Абрим': 'Абрам'}
+
+
+def test_an_unusable_file_leaves_a_memory_only_cache(tmp_path):
+    (tmp_path / 'cache.db').mkdir()
+    cache, _ = make_cache(tmp_path)
+    cache.put_many({'Абрим': 'Абрам'}, 'spans')
+    assert cache.get_many(['Абрим', 'Хиам'], 'spans') == {'Абрим': 'Абрам'}
+    stats = cache.stats()
+    assert stats['disk_entries'] is None
+    assert stats['errors'] >= 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_a_forked_process_opens_its_own_connection(tmp_path):
+    cache, _ = make_cache(tmp_path)
+    cache.put_many({'Абрим': 'Абрам'}, 'spans')
+    parent_db = cache.db
+    pid = os.fork()
+    if pid == 0:
+        cache.put_many({'Хиам': 'Хаим'}, 'spans')
+        os._exit(0 if cache.db is not parent_db else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    cache.memory.clear()
+    assert cache.get_many(['Хиам'], 'spans') == {'Хиам': 'Хаим'}
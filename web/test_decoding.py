@@ -0,0 +1,138 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from decoding import DecodingPolicy, decode_batch, decoding_stats
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+needs_torch = pytest.mark.skipif(torch is None, reason="needs torch")
+PAD, EOS = 0, 1
+
+
+def test_options_override_only_the_fields_given():
+    default = DecodingPolicy(strategy='adaptive', num_beams=4, confidence_threshold=0.8)
+    policy = DecodingPolicy.from_options({'strategy': 'beam', 'num_beams': '6', 'confidence_threshold': ''},
+                                         default=default)
+    assert policy == default._replace(strategy='beam', num_beams=6)
+    assert DecodingPolicy.from_options(None, default=default) is default
+    assert DecodingPolicy.from_options({'strategy': None}, default=default) == default
+
+
+@pytest.mark.parametrize('options', [
+    {'strategy': 'sampling'},
+    {'beams': 4},
+    {'num_beams': 0},
+    {'num_beams': 'four'},
+    {'confidence_threshold': 1.5},
+    'beam',
+    ['beam'],
+])
+def test_invalid_options_are_rejected(options):
+    with pytest.raises(ValueError):
+        DecodingPolicy.from_options(options)
+
+
+def test_requests_are_held_to_the_limits():
+    limits = {'num_beams': 4, 'max_length': 32}
+    policy = DecodingPolicy.from_options({'num_beams': 64, 'max_length': 16, 'length_slack': 100}, limits=limits)
+    assert (policy.num_beams, policy.max_length, policy.length_slack) == (4, 16, 100)
+
+
+def test_the_output_budget_follows_the_input_length():
+    policy = DecodingPolicy(length_ratio=1.5, length_slack=4, max_length=32)
+    assert policy.output_budget(2) == 7
+    assert policy.output_budget(40) == 32
+    assert policy.output_budget(40, cap=512) == 64
+    assert policy.output_budget(0) == 4
+
+
+class ScriptedModel:
+    """Stands in for ketuvim_nert: greedy output i gets the confidence given for row i.
+
+    Token 100 + i decodes to "greedy i", token 200 + i to "beam i"; every output ends with EOS.
+    """
+
+    config = SimpleNamespace(pad_token_id=PAD)
+
+    def __init__(self, confidences):
+        self.confidences = confidences
+        self.calls = []
+
+    def generate(self, input_ids, attention_mask, num_beams, max_length, **options):
+        rows = [int(row[0]) for row in input_ids]
+        self.calls.append({'rows': rows, 'num_beams': num_beams, 'max_length': max_length, **options})
+        base = 100 if num_beams == 1 else 200
+        sequences = torch.tensor([[PAD, base + row, EOS] for row in rows])
+        if not options.get('return_dict_in_generate'):
+            return sequences
+        return SimpleNamespace(sequences=sequences, scores=rows)
+
+    def compute_transition_scores(self, sequences, rows, normalize_logits=True):
+        return torch.tensor([[math.log(self.confidences[row])] * 2 for row in rows])
+
+
+class ScriptedTokenizer:
+    def batch_decode(self, sequences, skip_special_tokens=True):
+        names = {100: 'greedy', 200: 'beam'}
+        return [f"{names[int(row[1]) // 100 * 100]} {int(row[1]) % 100}" for row in sequences]
+
+
+def batch(size, tokens=6):
+    input_ids = torch.tensor([[i] + [5] * (tokens - 1) for i in range(size)])
+    return {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+
+
+@needs_torch
+def test_adaptive_decoding_escalates_only_the_uncertain_spans():
+    model = ScriptedModel([0.95, 0.5, 0.9, 0.79])
+    before = decoding_stats()
+    policy = DecodingPolicy(strategy='adaptive', num_beams=4, confidence_threshold=0.8)
+    texts, paths = decode_batch(ScriptedTokenizer(), model, batch(4), policy)
+    assert paths == ['greedy', 'beam', 'greedy', 'beam']
+    assert texts == ['greedy 0', 'beam 1', 'greedy 2', 'beam 3']
+    greedy, beam = model.calls
+    assert greedy['rows'] == [0, 1, 2, 3] and greedy['num_beams'] == 1
+    assert beam['rows'] == [1, 3] and beam['num_beams'] == 4
+    after = decoding_stats()
+    assert after['escalated'] - before['escalated'] == 2
+    assert after['greedy'] - before['greedy'] == 2
+
+
+@needs_torch
+def test_confident_batches_never_run_beam_search():
+    model = ScriptedModel([0.99, 0.85])
+    texts, paths = decode_batch(ScriptedTokenizer(), model, batch(2), DecodingPolicy(confidence_threshold=0.8))
+    assert paths == ['greedy', 'greedy'] and len(model.calls) == 1
+
+
+@needs_torch
+def test_fixed_strategies_use_a_single_path():
+    model = ScriptedModel([0.1, 0.1])
+    _, paths = decode_batch(ScriptedTokenizer(), model, batch(2), DecodingPolicy(strategy='greedy'))
+    assert paths == ['greedy', 'greedy'] and len(model.calls) == 1
+    model = ScriptedModel([0.99, 0.99])
+    texts, paths = decode_batch(ScriptedTokenizer(), model, batch(2), DecodingPolicy(strategy='beam', num_beams=3))
+    assert texts == ['beam 0', 'beam 1'] and paths == ['beam', 'beam']
+    assert [call['num_beams'] for call in model.calls] == [3]
+
+
+@needs_torch
+def test_the_output_budget_excludes_the_task_prefix():
+    model = ScriptedModel([0.99])
+    policy = DecodingPolicy(strategy='greedy', length_ratio=1.5, length_slack=4, max_length=32)
+    decode_batch(ScriptedTokenizer(), model, batch(1, tokens=10), policy, prefix_tokens=4)
+    assert model.calls[0]['max_length'] == policy.output_budget(6)
+
+
+@needs_torch
+def test_a_vocabulary_trie_bounds_the_output_by_its_depth():
+    model = ScriptedModel([0.99])
+    trie = SimpleNamespace(max_depth=7, prefix_allowed_tokens_fn=lambda: 'allowed')
+    decode_batch(ScriptedTokenizer(), model, batch(1), DecodingPolicy(strategy='greedy'), trie=trie)
+    assert model.calls[0]['max_length'] == 8
+    assert model.calls[0]['prefix_allowed_tokens_fn'] == 'allowed'
@@ -0,0 +1,104 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import inference_backend
+from inference_backend import compare_models, configure_threads, prepare_model, warmup
+
+
+class ListTokenizer:
+    """Encodes each text as one id into a list of texts; decodes ids back from it."""
+
+    def __init__(self):
+        self.texts = []
+
+    def encode(self, text):
+        self.texts.append(text)
+        return len(self.texts) - 1
+
+    def __call__(self, texts, **options):
+        ids = torch.tensor([[self.encode(text)] for text in texts])
+        return {'input_ids': ids, 'attention_mask': torch.ones_like(ids)}
+
+    def batch_decode(self, sequences, skip_special_tokens=True):
+        return [self.texts[int(row[0])] for row in sequences]
+
+
+class RuleModel:
+    """Stands in for ketuvim_nert: corrects with a dictionary, leaving other words unchanged."""
+
+    def __init__(self, tokenizer, corrections):
+        self.tokenizer = tokenizer
+        self.corrections = corrections
+        self.calls = 0
+
+    def generate(self, input_ids, attention_mask, **options):
+        self.calls += 1
+        outputs = []
+        for row in input_ids:
+            word = self.tokenizer.texts[int(row[0])].removeprefix("correct: ")
+            outputs.append([self.tokenizer.encode(self.corrections.get(word, word))])
+        return torch.tensor(outputs)
+
+
+@pytest.fixture
+def thread_calls(monkeypatch):
+    """Records the thread pool sizes set instead of changing this process's pools."""
+    calls, sizes = [], {'intra': 4, 'inter': 4}
+
+    def setter(kind):
+        def set_threads(count):
+            calls.append((kind, count))
+            sizes[kind] = count
+        return set_threads
+
+    monkeypatch.setattr(inference_backend, '_threads_configured_in', None)
+    monkeypatch.setattr(torch, 'set_num_threads', setter('intra'))
+    monkeypatch.setattr(torch, 'set_num_interop_threads', setter('inter'))
+    monkeypatch.setattr(torch, 'get_num_threads', lambda: sizes['intra'])
+    monkeypatch.setattr(torch, 'get_num_interop_threads', lambda: sizes['inter'])
+    return calls
+
+
+def test_thread_pools_are_configured_once_per_process(thread_calls):
+    assert configure_threads(2, 1) == (2, 1)
+    # a hot reload asks again with other settings: the pools in use are kept
+    assert configure_threads(8, 4) == (2, 1)
+    assert thread_calls == [('intra', 2), ('inter', 1)]
+
+
+def test_an_inter_op_pool_already_in_use_is_left_alone(thread_calls, monkeypatch):
+    def refuse(count):
+        raise RuntimeError("cannot set number of interop threads after parallel work has started")
+    monkeypatch.setattr(torch, 'set_num_interop_threads', refuse)
+    assert configure_threads(3, 2) == (3, 4)
+
+
+def test_int8_backend_quantizes_the_linear_layers():
+    model = torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU(), torch.nn.Linear(8, 2))
+    quantized = prepare_model(model, 'int8')
+    assert not quantized.training
+    assert all(type(layer).__name__ == 'Linear' and 'quantized' in type(layer).__module__
+               for layer in (quantized[0], quantized[2]))
+    inputs = torch.randn(3, 8)
+    assert torch.allclose(quantized(inputs), model(inputs), atol=0.1)
+    assert prepare_model(model, 'float32') is model
+    with pytest.raises(ValueError):
+        prepare_model(model, 'int4')
+
+
+def test_agreement_is_measured_against_the_reference_model():
+    tokenizer = ListTokenizer()
+    reference = RuleModel(tokenizer, {'Абрим': 'Абрам', 'Голдштуин': 'Голдштейн'})
+    candidate = RuleModel(tokenizer, {'Абрим': 'Абрам'})
+    report = compare_models(tokenizer, reference, candidate, words=['Абрим', 'Голдштуин', 'Хаим', 'Мошко'])
+    assert report['samples'] == 4
+    assert report['agreement'] == 0.75
+    assert report['disagreements'] == [{'input': 'Голдштуин', 'reference': 'Голдштейн', 'candidate': 'Голдштуин'}]
+
+
+def test_warmup_runs_the_model_before_the_first_request():
+    tokenizer = ListTokenizer()
+    model = RuleModel(tokenizer, {})
+    assert warmup(tokenizer, model, runs=3) >= 0
+    assert model.calls == 3
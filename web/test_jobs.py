@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import time
+
+from jobs import JobQueue, init_jobs_table
+
+
+def wait_for(queue, job_id, statuses=('done', 'failed'), timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not reach {statuses}")
+
+
+def make_queue(tmp_path, handler, **options):
+    options = {'num_workers': 2, 'poll_interval': 0.1, 'lease_seconds': 0.6, **options}
+    database = str(tmp_path / 'ketuvim.db')
+    db = sqlite3.connect(database)
+    init_jobs_table(db)
+    db.close()
+    return JobQueue(database, handler, **options)
+
+
+def test_jobs_run_once_and_report_their_result(tmp_path):
+    calls = []
+    lock = threading.Lock()
+
+    def handler(image_name, input_text, options):
+        with lock:
+            calls.append(image_name)
+        if input_text == 'boom':
+            raise RuntimeError('model failed')
+        return input_text.upper()
+
+    queue = make_queue(tmp_path, handler)
+    try:
+        done = queue.submit('a.png', 'абрим', options={'decoding': {'strategy': 'greedy'}})
+        failed = queue.submit('b.png', 'boom')
+        assert wait_for(queue, done)['corrected_text'] == 'АБРИМ'
+        job = wait_for(queue, failed)
+        assert job['status'] == 'failed' and job['error'] == 'model failed'
+    finally:
+        queue.stop()
+    assert sorted(calls) == ['a.png', 'b.png']
+
+
+def test_a_job_outliving_its_first_lease_is_not_run_twice(tmp_path):
+    calls = []
+
+    def slow(image_name, input_text, options):
+        calls.append(image_name)
+        time.sleep(2.0)  # more than three lease periods: only the heartbeat keeps the job
+        return input_text
+
+    queue = make_queue(tmp_path, slow)
+    try:
+        job_id = queue.submit('slow.png', 'текст')
+        assert wait_for(queue, job_id)['status'] == 'done'
+    finally:
+        queue.stop()
+    assert calls == ['slow.png']
+
+
+def test_a_job_with_an_expired_lease_is_requeued_and_finished(tmp_path):
+    queue = make_queue(tmp_path, lambda image_name, input_text, options: input_text + '!')
+    db = sqlite3.connect(queue.database)
+    # left running by a process that stopped: nobody renews its lease
+    db.execute("""INSERT INTO jobs (id, image_name, input_text, options, status, created_at, started_at, owner,
+                                    lease_expires_at)
+                  VALUES ('orphan', 'x.png', 'слово', '{}', 'running', 0, 0, 'gone:1/0', ?)""", (time.time() - 1,))
+    db.commit()
+    db.close()
+    try:
+        queue.start()
+        assert wait_for(queue, 'orphan')['corrected_text'] == 'слово!'
+    finally:
+        queue.stop()
+
+
+def test_a_result_is_discarded_when_the_lease_was_lost(tmp_path):
+    queue = make_queue(tmp_path, lambda image_name, input_text, options: input_text)
+    db = queue.connect()
+    # inserted directly, so no worker is started
+    db.execute("""INSERT INTO jobs (id, image_name, input_text, options, status, created_at)
+                  VALUES ('j', 'j.png', 'старое', '{}', 'queued', 0)""")
+    job = queue._claim_next(db, 'first/0')
+    # the lease ran out and another worker claimed the job
+    db.execute("UPDATE jobs SET status = 'running', owner = 'second/0' WHERE id = 'j'")
+    queue._finish(db, job, 'first/0', 'done', corrected_text='stale')
+    row = db.execute("SELECT status, owner, corrected_text FROM jobs WHERE id = 'j'").fetchone()
+    db.close()
+    assert tuple(row) == ('running', 'second/0', None)
+
+
+def test_a_dead_worker_is_restarted(tmp_path):
+    queue = make_queue(tmp_path, lambda image_name, input_text, options: input_text, num_workers=1)
+    try:
+        queue.start()
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        queue.workers = [dead]
+        job_id = queue.submit('c.png', 'слово')
+        assert wait_for(queue, job_id)['status'] == 'done'
+        assert queue.workers[0] is not dead
+    finally:
+        queue.stop()
+
+
+def test_the_queue_touches_no_database_until_it_is_used(tmp_path):
+    database = tmp_path / 'ketuvim.db'
+    queue = JobQueue(str(database), lambda image_name, input_text, options: input_text)
+    assert not database.exists()
+    assert queue.active_counts()['queued'] == 0
+    assert database.exists()
+
+
+def test_finished_jobs_are_pruned_after_the_retention_period(tmp_path):
+    queue = make_queue(tmp_path, lambda image_name, input_text, options: input_text, retention_seconds=60)
+    db = queue.connect()
+    now = time.time()
+    for job_id, status, finished_at in (('old', 'done', now - 120), ('old-failure', 'failed', now - 120),
+                                        ('recent', 'done', now - 30), ('waiting', 'queued', None)):
+        db.execute("""INSERT INTO jobs (id, image_name, status, created_at, finished_at)
+                      VALUES (?, 'x.png', ?, 0, ?)""", (job_id, status, finished_at))
+    db.close()
+    assert queue.prune() == 2
+    assert queue.event_counts()['pruned'] == 2
+    assert queue.get('old') is None and queue.get('old-failure') is None
+    assert queue.get('recent')['status'] == 'done'
+    queue.stop()
@@ -0,0 +1,57 @@
+import time
+
+from metrics import Metrics, SlowRequestProfiler
+
+
+def streaming_app(chunks, delay):
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+
+        def body():
+            for chunk in chunks:
+                time.sleep(delay)  # the work of a streamed response happens while it is iterated
+                yield chunk
+        return body()
+    return wsgi_app
+
+
+def serve(wsgi_app, path='/api/correct/batch'):
+    body = wsgi_app({'REQUEST_METHOD': 'POST', 'PATH_INFO': path}, lambda status, headers: None)
+    try:
+        return b''.join(body)
+    finally:
+        body.close()
+
+
+def test_a_slow_streamed_response_is_profiled_until_its_body_is_closed(tmp_path):
+    profiler = SlowRequestProfiler(str(tmp_path), enabled=True, sample_rate=1.0, threshold=0.1)
+    assert serve(profiler.wrap_wsgi(streaming_app([b'a\n', b'b\n', b'c\n'], 0.05))) == b'a\nb\nc\n'
+    assert profiler.dumps == 1
+    [dump] = tmp_path.iterdir()
+    assert dump.name.endswith('.prof') and '_POST_api_correct_batch_' in dump.name
+
+
+def test_fast_and_unsampled_requests_leave_no_dump(tmp_path):
+    fast = SlowRequestProfiler(str(tmp_path), enabled=True, sample_rate=1.0, threshold=10)
+    serve(fast.wrap_wsgi(streaming_app([b'a'], 0)))
+    disabled = SlowRequestProfiler(str(tmp_path), enabled=False, threshold=0)
+    assert serve(disabled.wrap_wsgi(streaming_app([b'a'], 0.01))) == b'a'
+    assert fast.dumps == disabled.dumps == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_a_histogram_renders_cumulative_buckets_sum_and_count_with_its_own_bounds():
+    metrics = Metrics(prefix='test')
+    metrics.describe('batch_size', 'histogram', "Spans per batch.", buckets=(1, 2, 4))
+    for size in (1, 3, 3, 9):
+        metrics.observe('batch_size', size)
+    lines = metrics.render().splitlines()
+    assert '# TYPE test_batch_size histogram' in lines
+    assert [line for line in lines if line.startswith('test_batch_size')] == [
+        'test_batch_size_bucket{le="1"} 1',
+        'test_batch_size_bucket{le="2"} 1',
+        'test_batch_size_bucket{le="4"} 3',
+        'test_batch_size_bucket{le="+Inf"} 4',
+        'test_batch_size_sum 16',
+        'test_batch_size_count 4',
+    ]
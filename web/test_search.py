@@ -0,0 +1,100 @@
+import sys
+
+import pytest
+
+import search
+from storage import connect, migrate
+
+
+def save(db, image_name, input_text, corrected_text):
+    """What app.write_transcriptions does, without Flask."""
+    db.execute('''INSERT INTO transcriptions (image_name, input_text, corrected_text) VALUES (?, ?, ?)
+                  ON CONFLICT (image_name) DO UPDATE SET input_text = excluded.input_text,
+                      corrected_text = excluded.corrected_text''', (image_name, input_text, corrected_text))
+    search.index_terms(db, [input_text, corrected_text])
+    db.commit()
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = connect(str(tmp_path / 'ketuvim.db'))
+    migrate(db)
+    if not search.has_table(db, 'transcriptions_fts'):
+        pytest.skip("this SQLite has no FTS5")
+    yield db
+    db.close()
+
+
+def names(items):
+    return [item['image_name'] for item in items]
+
+
+def test_snippets_escape_the_text_and_mark_the_matches(db):
+    save(db, 'a.png', 'Абрам <script>alert(1)</script> & Гольдштеин', 'Абрам Гольдштейн')
+    items, _, _ = search.search_transcriptions(db, 'абрам')
+    assert items[0]['input_snippet'] == '<mark>Абрам</mark> &lt;script&gt;alert(1)&lt;/script&gt; &amp; Гольдштеин'
+    assert items[0]['corrected_snippet'] == '<mark>Абрам</mark> Гольдштейн'
+
+
+def test_index_follows_updates_and_replacements(db):
+    save(db, 'a.png', 'Абрам', 'Абрам')
+    save(db, 'a.png', 'Хаим', 'Хаим')
+    assert search.search_transcriptions(db, 'Абрам')[0] == []
+    db.execute("INSERT OR REPLACE INTO transcriptions (image_name, input_text, corrected_text) VALUES ('a.png', 'Мошко', '')")
+    db.commit()
+    assert search.search_transcriptions(db, 'Хаим')[0] == []
+    assert names(search.search_transcriptions(db, 'Мошко')[0]) == ['a.png']
+    db.execute("INSERT INTO transcriptions_fts (transcriptions_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_fuzzy_search_matches_ocr_variants(db):
+    save(db, 'a.png', 'Гольдштеин', 'Гольдштейн')
+    save(db, 'b.png', 'Гольдштуин', 'Гольдштуин')
+    save(db, 'c.png', 'Гольдберг', 'Гольдберг')
+    assert names(search.search_transcriptions(db, 'Гольдштейн')[0]) == ['a.png']
+    items, _, expansions = search.search_transcriptions(db, 'Гольдштейн', fuzzy=True)
+    assert names(items) == ['b.png', 'a.png']
+    assert 'гольдштуин' in expansions['гольдштейн'] and 'гольдберг' not in expansions['гольдштейн']
+
+
+def test_pages_follow_the_cursor_newest_first(db):
+    for i in range(5):
+        save(db, f'{i}.png', f'Хаим {i}', '')
+    first, cursor, _ = search.search_transcriptions(db, 'хаим', limit=2)
+    second, cursor, _ = search.search_transcriptions(db, 'хаим', limit=2, cursor=cursor)
+    third, cursor, _ = search.search_transcriptions(db, 'хаим', limit=2, cursor=cursor)
+    assert names(first + second + third) == ['4.png', '3.png', '2.png', '1.png', '0.png']
+    assert cursor is None
+
+
+def test_field_and_query_validation(db):
+    save(db, 'a.png', 'Чернавцы', 'Черновцы')
+    assert names(search.search_transcriptions(db, 'Черн*', field='corrected')[0]) == ['a.png']
+    assert search.search_transcriptions(db, 'Чернавцы', field='corrected')[0] == []
+    for query, options in (('***', {}), ('x', {'field': 'notes'}), ('x', {'cursor': 'not-a-cursor'})):
+        with pytest.raises(ValueError):
+            search.search_transcriptions(db, query, **options)
+
+
+def test_rebuild_restores_the_fuzzy_vocabulary(db):
+    save(db, 'a.png', 'Абрам', 'Абрам')
+    save(db, 'b.png', 'Абрм', 'Абрм')
+    # as in a database whose words were never indexed
+    db.execute("DELETE FROM search_terms")
+    db.execute("DELETE FROM search_terms_trigram")
+    db.commit()
+    assert search.fuzzy_terms(db, 'абрам') == ['абрам']
+    assert search.rebuild_search_index(db) == 2
+    assert search.fuzzy_terms(db, 'абрам') == ['абрам', 'абрм']
+
+
+def test_rebuild_on_a_fresh_database_indexes_once(tmp_path, monkeypatch):
+    rebuilds = []
+    rebuild = search.rebuild_search_index
+    monkeypatch.setattr(search, 'rebuild_search_index', lambda db: rebuilds.append(1) or rebuild(db))
+    database = str(tmp_path / 'fresh.db')
+    monkeypatch.setattr(sys, 'argv', ['search.py', database, '--rebuild'])
+    search.main()
+    assert len(rebuilds) == 1
+    search.main()
+    assert len(rebuilds) == 2
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+
+import shared_weights
+from correction_cache import model_fingerprint
+from shared_weights import convert, is_up_to_date, load_shared_model, shared_weights_path, write_shared_weights
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """A tiny T5 saved the way the ketuvim_nert checkpoint is: pytorch_model.bin and config.json."""
+    torch.manual_seed(0)
+    config = transformers.T5Config(vocab_size=40, d_model=16, d_kv=4, d_ff=32, num_layers=1, num_decoder_layers=1,
+                                   num_heads=2, decoder_start_token_id=0, pad_token_id=0, eos_token_id=1)
+    model = transformers.T5ForConditionalGeneration(config).eval()
+    path = tmp_path / 'ketuvim_nert'
+    model.save_pretrained(str(path))
+    # Newer transformers only write safetensors; the checkpoint in the repo is a pytorch_model.bin
+    (path / 'model.safetensors').unlink()
+    torch.save(model.state_dict(), path / 'pytorch_model.bin')
+    return str(path)
+
+
+def generate(model):
+    input_ids = torch.tensor([[5, 6, 7, 1]])
+    with torch.no_grad():
+        return model.generate(input_ids=input_ids, max_length=6, num_beams=2).tolist()
+
+
+def test_the_shared_file_is_written_next_to_the_model_directory(model_dir):
+    before = sorted(os.listdir(model_dir)), model_fingerprint(model_dir)
+    assert convert(model_dir)
+    assert shared_weights_path(model_dir) == model_dir + '.safetensors'
+    assert os.path.exists(shared_weights_path(model_dir))
+    # Converting must not look like a new model to the app's watcher and correction cache
+    assert (sorted(os.listdir(model_dir)), model_fingerprint(model_dir)) == before
+    assert not convert(model_dir)
+
+
+def test_the_mapped_model_generates_what_the_checkpoint_does(model_dir):
+    convert(model_dir)
+    shared = load_shared_model(model_dir)
+    private = transformers.AutoModelForSeq2SeqLM.from_pretrained(model_dir).eval()
+    assert generate(shared) == generate(private)
+    # Tied embeddings are stored once and still shared after loading
+    assert shared.shared.weight.data_ptr() == shared.lm_head.weight.data_ptr() or not shared.config.tie_word_embeddings
+
+
+def test_a_newer_checkpoint_makes_the_shared_file_stale(model_dir):
+    convert(model_dir)
+    checkpoint = os.path.join(model_dir, 'pytorch_model.bin')
+    stat = os.stat(checkpoint)
+    os.utime(checkpoint, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not is_up_to_date(model_dir)
+    assert load_shared_model(model_dir) is None
+    assert convert(model_dir)
+    assert load_shared_model(model_dir) is not None
+
+
+def test_without_a_shared_file_the_app_loads_a_private_copy(model_dir):
+    assert load_shared_model(model_dir) is None
+
+
+def test_a_shared_file_left_in_the_model_directory_is_removed(model_dir):
+    model = transformers.AutoModelForSeq2SeqLM.from_pretrained(model_dir)
+    legacy = os.path.join(model_dir, 'model.safetensors')
+    write_shared_weights(model, legacy, metadata={'source': shared_weights.source_stamp(model_dir)})
+    convert(model_dir)
+    assert not os.path.exists(legacy)
+    assert os.path.exists(shared_weights_path(model_dir))
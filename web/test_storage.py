@@ -0,0 +1,76 @@
+import pytest
+
+import storage
+from storage import connect, list_transcriptions, migrate
+
+
+def user_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def columns(db, table):
+    return [row[1] for row in db.execute(f'PRAGMA table_info({table})')]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = connect(str(tmp_path / 'ketuvim.db'))
+    yield db
+    db.close()
+
+
+def test_a_fresh_database_gets_every_migration_once(db):
+    latest = storage.MIGRATIONS[-1][0]
+    assert migrate(db) == latest
+    assert user_version(db) == latest
+    assert 'reviewed' in columns(db, 'transcriptions')
+    assert migrate(db) == latest
+
+
+def test_a_failed_migration_leaves_the_previous_version_untouched(db, monkeypatch):
+    def broken(db):
+        db.execute('CREATE TABLE half_done (x)')
+        raise RuntimeError("interrupted")
+
+    migrations = storage.MIGRATIONS[:2]
+    monkeypatch.setattr(storage, 'MIGRATIONS', migrations + [(3, broken)])
+    with pytest.raises(RuntimeError):
+        migrate(db)
+    assert user_version(db) == 2
+    assert 'half_done' not in [row[0] for row in db.execute("SELECT name FROM sqlite_master")]
+
+    monkeypatch.setattr(storage, 'MIGRATIONS', migrations + [(3, lambda db: db.execute('CREATE TABLE half_done (x)'))])
+    assert migrate(db) == 3
+
+
+def test_adding_the_reviewed_column_again_is_harmless(db):
+    # as in a file whose ALTER was committed but whose version bump was lost
+    migrate(db)
+    db.execute('PRAGMA user_version = 5')
+    db.commit()
+    assert migrate(db) == storage.MIGRATIONS[-1][0]
+    assert columns(db, 'transcriptions').count('reviewed') == 1
+
+
+def test_pages_follow_each_other_without_gaps_or_repeats(db):
+    migrate(db)
+    # Rows saved in the same second share a timestamp; the id breaks the tie
+    for i in range(5):
+        db.execute("INSERT INTO transcriptions (image_name, input_text, timestamp) VALUES (?, ?, ?)",
+                   (f'{i}.png', 'слово' * 100, '2026-01-01 10:00:00' if i < 3 else '2026-01-02 10:00:00'))
+    db.commit()
+    seen, cursor = [], None
+    while True:
+        rows, cursor = list_transcriptions(db, limit=2, cursor=cursor, preview_length=10)
+        seen.extend(row['image_name'] for row in rows)
+        assert all(len(row['input_text']) == 10 for row in rows)
+        if cursor is None:
+            break
+    assert seen == ['4.png', '3.png', '2.png', '1.png', '0.png']
+
+
+def test_an_invalid_cursor_is_rejected(db):
+    migrate(db)
+    for cursor in ('not-a-cursor', storage.encode_cursor('2026', 1)[:-2] + '!!'):
+        with pytest.raises(ValueError):
+            list_transcriptions(db, cursor=cursor)
@@ -0,0 +1,60 @@
+import hashlib
+import io
+import sqlite3
+
+import pytest
+
+from upload_store import UploadStore, init_uploads_table
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UploadStore(str(tmp_path / 'uploads'))
+    yield store
+    store.executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def db():
+    db = sqlite3.connect(':memory:')
+    init_uploads_table(db)
+    yield db
+    db.close()
+
+
+def test_the_same_scan_is_stored_once_under_its_name(store, db):
+    first = store.save(io.BytesIO(b'scan one'), 'page.png', db)
+    again = store.save(io.BytesIO(b'scan one'), 'page.png', db)
+    assert first == again == ('page.png', hashlib.sha256(b'scan one').hexdigest())
+    path, etag = store.lookup(db, 'page.png')
+    with open(path, 'rb') as f:
+        assert f.read() == b'scan one'
+    assert etag == first[1]
+
+
+def test_another_scan_under_a_taken_name_gets_a_new_name(store, db):
+    store.save(io.BytesIO(b'scan one'), 'page.png', db)
+    name, sha256 = store.save(io.BytesIO(b'scan two'), 'page.png', db)
+    assert name == f"page_{sha256[:8]}.png"
+    assert store.lookup(db, 'page.png')[1] == hashlib.sha256(b'scan one').hexdigest()
+    assert store.lookup(db, name)[1] == sha256
+
+
+def test_a_fallback_name_owned_by_another_scan_is_never_reused(store, db):
+    sha256 = hashlib.sha256(b'scan three').hexdigest()
+    for taken, content in (('page.png', 'a'), (f"page_{sha256[:8]}.png", 'b')):
+        db.execute('INSERT INTO uploads (image_name, sha256, extension, size) VALUES (?, ?, ?, 1)',
+                   (taken, content * 64, '.png'))
+    name, _ = store.save(io.BytesIO(b'scan three'), 'page.png', db)
+    assert name == f"page_{sha256[:8]}_2.png"
+    # uploading it again finds the name it was given
+    assert store.save(io.BytesIO(b'scan three'), 'page.png', db)[0] == name
+
+
+def test_running_out_of_names_raises(store, db):
+    sha256 = 'f' * 64
+    for taken in ['page.png', f"page_{sha256[:8]}.png"] + [f"page_{sha256[:8]}_{n}.png" for n in range(2, 5)]:
+        db.execute("INSERT INTO uploads (image_name, sha256, extension, size) VALUES (?, ?, '.png', 1)",
+                   (taken, '0' * 64))
+    with pytest.raises(ValueError):
+        store.assign_name(db, 'page.png', sha256, '.png', 1, max_attempts=5)
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def init_uploads_table(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS uploads (
+        image_name TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        extension TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads (sha256)')
+
+
+class UploadStore:
+    """Content-addressed image store under the uploads folder.
+
+    Each distinct file is stored once as objects/<aa>/<sha256><ext>; the uploads table maps
+    image names to contents. A name keeps pointing at the same content forever: a different
+    scan uploaded under a name that is already taken gets "<stem>_<hash prefix><ext>" instead,
+    which is what lets the images be served with long-lived cache headers.
+    Thumbnails are rendered once, in a background thread pool, into thumbnails/.
+    The directories are created when the first file is stored.
+    """
+
+    def __init__(self, root, thumbnail_size=320, thumbnail_workers=2):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.thumbnails_dir = os.path.join(root, 'thumbnails')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.directories_ready = False
+        self.thumbnail_size = thumbnail_size
+        self.executor = ThreadPoolExecutor(max_workers=thumbnail_workers, thread_name_prefix='thumbnailer')
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def ensure_directories(self):
+        if not self.directories_ready:
+            for directory in (self.objects_dir, self.thumbnails_dir, self.tmp_dir):
+                os.makedirs(directory, exist_ok=True)
+            self.directories_ready = True
+
+    def object_path(self, sha256, extension):
+        return os.path.join(self.objects_dir, sha256[:2], sha256 + extension)
+
+    def save(self, stream, image_name, db):
+        """Stores an uploaded stream, hashing it while it is written; returns (image_name, sha256)."""
+        self.ensure_directories()
+        extension = os.path.splitext(image_name)[1].lower()
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            path = self.object_path(sha256, extension)
+            if os.path.exists(path):
+                os.remove(tmp_path)  # already stored: this upload is a duplicate
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        image_name = self.assign_name(db, image_name, sha256, extension, size)
+        self.schedule_thumbnail(sha256, extension)
+        return image_name, sha256
+
+    def assign_name(self, db, image_name, sha256, extension, size, max_attempts=100):
+        """Maps image_name to this scan, or the first free variant of it if another scan has the name."""
+        insert = 'INSERT OR IGNORE INTO uploads (image_name, sha256, extension, size) VALUES (?, ?, ?, ?)'
+        stem = os.path.splitext(image_name)[0]
+        candidates = [image_name, f"{stem}_{sha256[:8]}{extension}"]
+        candidates += [f"{stem}_{sha256[:8]}_{n}{extension}" for n in range(2, max_attempts)]
+        for candidate in candidates:
+            cursor = db.execute(insert, (candidate, sha256, extension, size))
+            db.commit()
+            if cursor.rowcount:
+                return candidate
+            row = db.execute('SELECT sha256 FROM uploads WHERE image_name = ?', (candidate,)).fetchone()
+            if row is not None and row[0] == sha256:
+                return candidate  # the same scan uploaded again
+        raise ValueError(f"No free name for {image_name} after {max_attempts} attempts.")
+
+    def lookup(self, db, image_name):
+        """Returns (path, etag) of a stored image, or None for names stored before this store existed."""
+        row = db.execute('SELECT sha256, extension FROM uploads WHERE image_name = ?', (image_name,)).fetchone()
+        if row is None:
+            return None
+        sha256, extension = row[0], row[1]
+        path = self.object_path(sha256, extension)
+        return (path, sha256) if os.path.exists(path) else None
+
+    # --- Thumbnails ---
+    def thumbnail_path(self, key):
+        return os.path.join(self.thumbnails_dir, f"{key}_{self.thumbnail_size}.jpg")
+
+    def schedule_thumbnail(self, key, extension=None, source=None):
+        """Queues rendering of a thumbnail (once); returns a future, or None if it already exists."""
+        target = self.thumbnail_path(key)
+        if os.path.exists(target):
+            return None
+        source = source or self.object_path(key, extension)
+        self.ensure_directories()
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            future = self.pending[key] = self.executor.submit(self.render_thumbnail, source, target)
+        # Outside the lock: the callback runs right away if the render has already finished
+        future.add_done_callback(lambda done: self.forget(key, done))
+        return future
+
+    def forget(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def render_thumbnail(self, source, target):
+        from PIL import Image
+        with Image.open(source) as image:
+            image.draft('RGB', (self.thumbnail_size, self.thumbnail_size))  # lets JPEG decode at reduced scale
+            image = image.convert('RGB')
+            image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+            tmp_path = target + '.tmp'
+            image.save(tmp_path, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp_path, target)
+        return target
+
+    def get_thumbnail(self, key, source=None, extension=None, timeout=30):
+        """Path of the thumbnail, waiting for the background render if it is not there yet."""
+        future = self.schedule_thumbnail(key, extension=extension, source=source)
+        if future is not None:
+            future.result(timeout=timeout)
+        return self.thumbnail_path(key)